@@ -23,13 +23,25 @@ for p in [os.path.abspath(os.path.join(os.path.dirname(__file__), "..")),
 from llama_index.core.agent import FunctionAgent
 from llama_index.core.tools import FunctionTool
 from llama_index.core.llms import ChatMessage, MessageRole, TextBlock, ImageBlock
-from llama_index.llms.openai_like import OpenAILike
 from llama_index.core.agent.workflow.workflow_events import AgentStream, ToolCall, ToolCallResult
 
-from common.llm_config import resolve_llm_config, format_llm_error
+from common.llm_config import resolve_llm_config, format_llm_error, get_llm
 from common.openai_like_reasoning import to_chat_messages, extract_reasoning
+from common.sse import SSEWriter
 from agent.prompt import DEFAULT_SYSTEM_PROMPT, NON_STREAM_OUTPUT_INSTRUCTION, build_non_chinese_instruction, normalize_answer_language
-from skill.service import get_document_json, get_node_info_json, list_documents_json, rag_search_json
+from skill.service import (
+    aget_document_json,
+    aget_node_info_json,
+    alist_documents_json,
+    arag_search_json,
+    atranslate_terms_json,
+    get_document_catalog,
+    get_document_json,
+    get_node_info_json,
+    list_documents_json,
+    rag_search_json,
+    run_blocking,
+)
 from translate.service import translate_terms_json
 from agent.diagram import generate_diagram, diagram_store
 
@@ -126,8 +138,7 @@ def _iter_document_entries(data: Any) -> list[dict[str, Any]]:
 # ── 构建文档列表（用于 System Prompt）───────────────
 @lru_cache(maxsize=1)
 def _build_doc_list_text() -> str:
-    result = json.loads(list_documents_json())
-    return ", ".join(d["title"] for d in result.get("documents", []))
+    return ", ".join(entry.title for entry in get_document_catalog().entries())
 
 
 @lru_cache(maxsize=64)
@@ -142,24 +153,30 @@ def _build_default_system_prompt(plain_text_output: bool = False, answer_languag
     return prompt
 
 
+async def _agenerate_diagram(svg_content: str, title: str = "") -> str:
+    return await run_blocking(generate_diagram, svg_content, title)
+
+
 # ── 工具注册 ────────────────────────────────────────────────
+# FunctionAgent 调用 async_fn：磁盘与 Chroma 操作在 skill-io 线程池中执行，嵌入 API 走共享的异步连接池；
+# fn 只用于生成参数 schema 与同步调用
 AGENT_TOOLS = [
-    FunctionTool.from_defaults(fn=get_node_info_json, name="get_node_info",
+    FunctionTool.from_defaults(fn=get_node_info_json, async_fn=aget_node_info_json, name="get_node_info",
         description="根据节点名称查询节点说明。支持模糊匹配、批量查询。输入 names: list[str]。"),
-    FunctionTool.from_defaults(fn=list_documents_json, name="list_documents",
+    FunctionTool.from_defaults(fn=list_documents_json, async_fn=alist_documents_json, name="list_documents",
         description="列出知识库文档标题和路径。输入 keywords: list[str]，为空时返回全部文档。"),
-    FunctionTool.from_defaults(fn=get_document_json, name="get_document",
+    FunctionTool.from_defaults(fn=get_document_json, async_fn=aget_document_json, name="get_document",
         description="根据文档标题获取完整内容。支持模糊匹配。输入 titles: list[str]。"),
-    FunctionTool.from_defaults(fn=rag_search_json, name="search_knowledge",
+    FunctionTool.from_defaults(fn=rag_search_json, async_fn=arag_search_json, name="search_knowledge",
         description="向量检索知识库。输入 queries: list[str], top_k: int=5。"),
-    FunctionTool.from_defaults(fn=generate_diagram, name="generate_diagram",
+    FunctionTool.from_defaults(fn=generate_diagram, async_fn=_agenerate_diagram, name="generate_diagram",
         description=(
             "当回答涉及节点连接关系、执行流程、实体层级或逻辑结构时，生成 SVG 图表并转为 PNG 供用户查看。"
             "输入 svg_content: str（完整 SVG XML），title: str（图表标题，选填）。"
             "图表文本只允许使用中文、英文、数字和基础标点；不要使用 emoji或其他装饰性 Unicode 字符。"
             "调用成功后，必须将返回 JSON 中的 markdown 字段内容原样嵌入回答正文。"
         )),
-    FunctionTool.from_defaults(fn=translate_terms_json, name="translate_terms",
+    FunctionTool.from_defaults(fn=translate_terms_json, async_fn=atranslate_terms_json, name="translate_terms",
         description=(
             "用任意语言的术语查询其在目标语言的官方译法，用于多语言回答时的术语校准。"
             "输入 terms: list[str]（术语列表），source_lang: str（术语所属语言码，如 en/jp/chs），"
@@ -207,11 +224,7 @@ class AgentEngine:
     ) -> dict[str, Any]:
         """迭代上限兜底：禁用工具，将已有 tool_trace 作为上下文生成最终回答，并返回整理后的 sources。"""
         rc = resolve_llm_config(config)
-        llm = OpenAILike(
-            api_key=str(rc["api_key"]), api_base=str(rc["api_base_url"]),
-            model=str(rc["model"]), is_chat_model=True,
-            is_function_calling_model=False,
-        )
+        llm = get_llm(rc, is_function_calling_model=False)
 
         ctx_len = int(config.get("context_length", 3))
         limited = [] if ctx_len == 0 else conversation[-(ctx_len * 2):]
@@ -271,9 +284,7 @@ class AgentEngine:
                    plain_text_output: bool = False):
         """创建 LLM + Agent + chat_history"""
         rc = resolve_llm_config(config)
-        llm = OpenAILike(api_key=str(rc["api_key"]), api_base=str(rc["api_base_url"]),
-                         model=str(rc["model"]), is_chat_model=True,
-                         is_function_calling_model=True)
+        llm = get_llm(rc, is_function_calling_model=True)
         print(f"[AgentEngine] 模型: {rc['model']}")
 
         ctx_len = int(config.get("context_length", 3))
@@ -478,10 +489,11 @@ class AgentEngine:
     async def chat_stream(self, message: str, conversation: List[Dict[str, str]],
                           config: Dict[str, Any],
                           image_base64s: Optional[List[str]] = None):
+        writer = SSEWriter()  # token / reasoning 增量按时间窗口合并写出，见 common.sse
         try:
             agent, chat_history = self._run_agent(config, conversation, plain_text_output=False)
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'data': format_llm_error(e)}, ensure_ascii=False)}\n\n"
+            yield writer.event("error", format_llm_error(e))
             return
         yield ": connected\n\n"
 
@@ -492,23 +504,31 @@ class AgentEngine:
         try:
             handler = agent.run(user_msg=_build_user_msg(message, image_base64s), chat_history=chat_history,
                                 max_iterations=AGENT_MAX_ITERATIONS)
-            async for ev in handler.stream_events():
-                if isinstance(ev, ToolCall):
-                    yield f"data: {json.dumps({'type': 'tool_call', 'data': {'tool': ev.tool_name, 'args': _mask_tool_args(ev.tool_name, ev.tool_kwargs)}}, ensure_ascii=False)}\n\n"
+            async for ev in writer.paced(handler.stream_events()):
+                if ev is None:  # 等待下一个事件期间缓冲已到时间窗口
+                    frame = writer.flush()
+                    if frame:
+                        yield frame
+                elif isinstance(ev, ToolCall):
+                    yield writer.event("tool_call", {"tool": ev.tool_name, "args": _mask_tool_args(ev.tool_name, ev.tool_kwargs)})
                 elif isinstance(ev, ToolCallResult):
                     tool_calls_count += 1
                     if ev.tool_name == "search_knowledge":
                         retrieval_calls_count += 1
                     trace = self._extract_trace(ev)
                     tool_trace.append(trace)
-                    yield f"data: {json.dumps({'type': 'tool_result', 'data': trace}, ensure_ascii=False)}\n\n"
+                    yield writer.event("tool_result", trace)
                     sources.extend(self._extract_sources(ev))
                 elif isinstance(ev, AgentStream):
                     if ev.delta:
                         partial_answer += ev.delta
-                        yield f"data: {json.dumps({'type': 'token', 'data': ev.delta}, ensure_ascii=False)}\n\n"
+                        frame = writer.delta("token", ev.delta)
+                        if frame:
+                            yield frame
                     if ev.thinking_delta:
-                        yield f"data: {json.dumps({'type': 'reasoning', 'data': ev.thinking_delta}, ensure_ascii=False)}\n\n"
+                        frame = writer.delta("reasoning", ev.thinking_delta)
+                        if frame:
+                            yield frame
 
             # 步骤异常（如上游 429/超时）时，stream_events 只会收到一个空的
             # 哨兵 StopEvent 而静默结束，真正的异常挂在 handler future 上。
@@ -516,24 +536,26 @@ class AgentEngine:
             await handler
 
             if sources:
-                yield f"data: {json.dumps({'type': 'sources', 'data': sources}, ensure_ascii=False)}\n\n"
-            yield f"data: {json.dumps({'type': 'done', 'data': {'stats': {'tokens': 0, 'tool_calls': tool_calls_count, 'retrieval_calls': retrieval_calls_count}}}, ensure_ascii=False)}\n\n"
+                yield writer.event("sources", sources)
+            yield writer.event("done", {"stats": {"tokens": 0, "tool_calls": tool_calls_count, "retrieval_calls": retrieval_calls_count}})
         except Exception as e:
             if self._is_max_iter_error(e):  # 迭代上限兜底：携带 tool_trace 生成最终回答
                 print("[AgentEngine] 流式迭代上限，携带工具结果兜底作答")
+                frame = writer.flush()
+                if frame:
+                    yield frame
                 fallback = await self._fallback_answer(
                     config, message, conversation, tool_trace, partial_answer, image_base64s)
                 answer = fallback["answer"]
                 fallback_sources = fallback["sources"]
                 if answer:
-                    payload = json.dumps({'type': 'token', 'data': '\n\n' + answer}, ensure_ascii=False)
-                    yield f"data: {payload}\n\n"
+                    yield writer.event("token", "\n\n" + answer)
                 if fallback_sources:
-                    yield f"data: {json.dumps({'type': 'sources', 'data': fallback_sources}, ensure_ascii=False)}\n\n"
-                yield f"data: {json.dumps({'type': 'done', 'data': {'stats': {'tokens': 0, 'tool_calls': tool_calls_count, 'retrieval_calls': retrieval_calls_count}}}, ensure_ascii=False)}\n\n"
+                    yield writer.event("sources", fallback_sources)
+                yield writer.event("done", {"stats": {"tokens": 0, "tool_calls": tool_calls_count, "retrieval_calls": retrieval_calls_count}})
             else:
                 print(f"[AgentEngine] 流式生成失败: {format_llm_error(e)}")
-                yield f"data: {json.dumps({'type': 'error', 'data': format_llm_error(e)}, ensure_ascii=False)}\n\n"
+                yield writer.event("error", format_llm_error(e))
 
 
 def _collect_diagrams(tool_trace: list[dict]) -> list[dict[str, str]]:
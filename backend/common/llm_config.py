@@ -1,9 +1,18 @@
 """公用 LLM 配置解析
 
-提供 resolve_llm_config() 供 chatEngine 和 agentEngine 统一使用。
+提供 resolve_llm_config() 供 chatEngine 和 agentEngine 统一使用；
+get_llm() 按解析后的渠道配置复用 LLM 实例（及其 keep-alive 连接池）。
 """
+import asyncio
+import hashlib
 import os
-from typing import Dict, Any
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional
+
+import httpx
+from llama_index.llms.openai_like import OpenAILike
 
 from .pg_client import model_usage_manager
 
@@ -82,3 +91,216 @@ def resolve_llm_config(config: Dict[str, Any]) -> Dict[str, str | int]:
                 "model": config["model"], "channel_id": 0}
 
     raise ValueError("未提供有效的 API 配置，请完整配置 API Key、Base URL、Model，或启用默认免费模型")
+
+
+# ── LLM 实例注册表 ──────────────────────────────────────────
+# 用户自带 Key 的实例数上限与空闲过期秒数（默认免费渠道的实例常驻，不受限制）
+LLM_CLIENT_CACHE_SIZE = int(os.getenv("LLM_CLIENT_CACHE_SIZE", "64"))
+LLM_CLIENT_IDLE_TTL = float(os.getenv("LLM_CLIENT_IDLE_TTL", "600"))
+# 被淘汰实例的连接池延迟关闭秒数（留给仍在使用该实例的请求完成，默认与 AGENT_TIMEOUT 相同）
+LLM_CLIENT_CLOSE_GRACE = float(os.getenv("LLM_CLIENT_CLOSE_GRACE", "300"))
+# 每个实例的 HTTP 连接池：最大连接数、保持的空闲连接数与空闲连接存活秒数
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+# 请求超时秒数（与 OpenAILike 未传入 http_client 时的默认值一致）
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class _Entry:
+    """注册表中的一个实例及其 httpx 客户端"""
+
+    __slots__ = ("llm", "http_client", "async_http_client", "loop", "last_used")
+
+    def __init__(self, llm: OpenAILike, http_client: httpx.Client, async_http_client: httpx.AsyncClient,
+                 loop: Optional[asyncio.AbstractEventLoop], last_used: float):
+        self.llm = llm
+        self.http_client = http_client
+        self.async_http_client = async_http_client
+        self.loop = loop
+        self.last_used = last_used
+
+    def close(self) -> None:
+        """关闭连接池。异步客户端只能在其所属事件循环中关闭；循环已关闭时连接已随之失效，直接丢弃。"""
+        self.http_client.close()
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        if loop is _running_loop():
+            loop.create_task(self.async_http_client.aclose())
+        else:
+            try:
+                asyncio.run_coroutine_threadsafe(self.async_http_client.aclose(), loop)
+            except RuntimeError:  # 循环在检查后关闭
+                pass
+
+
+class LLMRegistry:
+    """按 (api_base_url, model, api_key 哈希, 是否启用工具调用, 事件循环) 缓存 OpenAILike 实例。
+
+    每个实例持有自己的 httpx 同步 / 异步客户端（keep-alive 连接池），同一渠道的后续请求
+    复用已建立的 TCP / TLS 连接，首个 token 不再包含建连耗时。httpx.AsyncClient 的连接
+    绑定在首次使用它的事件循环上，因此实例按调用时所在的事件循环分开缓存（线程池中的同步
+    调用没有事件循环，共用一组），所属事件循环关闭后对应实例随之移除。
+
+    - 默认免费渠道（channel_id != 0）的实例常驻；
+    - 用户自带 Key 的实例按 LRU 保留最多 max_user_entries 个，空闲超过 idle_ttl 秒后淘汰。
+
+    被淘汰的实例可能仍被进行中的请求使用，因此先移入待关闭列表，close_grace 秒后再关闭其
+    连接池（同步客户端 close()，异步客户端在所属事件循环中 aclose()）；clear() 立即关闭全部。
+    实例在请求间共享，调用方不应修改其属性（callback_manager 等）。线程安全。
+    """
+
+    def __init__(self, max_user_entries: int = 64, idle_ttl: float = 600.0, close_grace: float = 300.0,
+                 max_connections: int = 100, max_keepalive: int = 20, keepalive_expiry: float = 60.0,
+                 timeout: float = 60.0):
+        self.max_user_entries = max_user_entries
+        self.idle_ttl = idle_ttl
+        self.close_grace = close_grace
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._timeout = httpx.Timeout(timeout)
+        self._channel_entries: Dict[tuple, _Entry] = {}
+        # 按最近使用时间排列
+        self._user_entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        # (淘汰时间, 实例)，按淘汰时间排列
+        self._retired: "deque[tuple[float, _Entry]]" = deque()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.closed = 0
+
+    @staticmethod
+    def _key(resolved_config: Dict[str, Any], is_function_calling_model: bool,
+             loop: Optional[asyncio.AbstractEventLoop]) -> tuple:
+        key_hash = hashlib.sha256(str(resolved_config["api_key"]).encode("utf-8")).hexdigest()
+        return (str(resolved_config["api_base_url"]), str(resolved_config["model"]), key_hash,
+                is_function_calling_model, loop)
+
+    def _create(self, resolved_config: Dict[str, Any], is_function_calling_model: bool,
+                loop: Optional[asyncio.AbstractEventLoop], now: float) -> _Entry:
+        http_client = httpx.Client(limits=self._limits, timeout=self._timeout)
+        async_http_client = httpx.AsyncClient(limits=self._limits, timeout=self._timeout)
+        llm = OpenAILike(
+            api_key=str(resolved_config["api_key"]),
+            api_base=str(resolved_config["api_base_url"]),
+            model=str(resolved_config["model"]),
+            is_chat_model=True,
+            is_function_calling_model=is_function_calling_model,
+            timeout=self._timeout.read,
+            http_client=http_client,
+            async_http_client=async_http_client,
+        )
+        return _Entry(llm, http_client, async_http_client, loop, now)
+
+    def get(self, resolved_config: Dict[str, Any], is_function_calling_model: bool = False) -> OpenAILike:
+        """返回 resolve_llm_config() 结果对应的 LLM 实例，不存在时创建。"""
+        loop = _running_loop()
+        key = self._key(resolved_config, is_function_calling_model, loop)
+        now = time.monotonic()
+        with self._lock:
+            self._drop_closed_loops()
+            self._close_retired(now)
+            if resolved_config.get("channel_id", 0):
+                entry = self._channel_entries.get(key)
+                if entry is None:
+                    self.misses += 1
+                    entry = self._channel_entries[key] = self._create(resolved_config, is_function_calling_model, loop, now)
+                else:
+                    self.hits += 1
+                return entry.llm
+
+            self._evict_idle(now)
+            entry = self._user_entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry.last_used = now
+                self._user_entries.move_to_end(key)
+            else:
+                self.misses += 1
+                entry = self._user_entries[key] = self._create(resolved_config, is_function_calling_model, loop, now)
+            while len(self._user_entries) > max(self.max_user_entries, 0):
+                _, evicted = self._user_entries.popitem(last=False)
+                self._retire(evicted, now)
+            return entry.llm
+
+    def _retire(self, entry: _Entry, now: float) -> None:
+        self.evictions += 1
+        self._retired.append((now, entry))
+
+    def _evict_idle(self, now: float) -> None:
+        if self.idle_ttl <= 0:
+            return
+        # 从最久未使用的一端检查
+        while self._user_entries:
+            key, entry = next(iter(self._user_entries.items()))
+            if now - entry.last_used < self.idle_ttl:
+                break
+            del self._user_entries[key]
+            self._retire(entry, now)
+
+    def _close_retired(self, now: float) -> None:
+        while self._retired and now - self._retired[0][0] >= self.close_grace:
+            _, entry = self._retired.popleft()
+            entry.close()
+            self.closed += 1
+
+    def _drop_closed_loops(self) -> None:
+        """移除所属事件循环已关闭的实例（其异步连接已不可用，只需关闭同步客户端）"""
+        for entries in (self._channel_entries, self._user_entries):
+            for key in [key for key, entry in entries.items() if entry.loop is not None and entry.loop.is_closed()]:
+                entries.pop(key).close()
+                self.closed += 1
+
+    def clear(self) -> None:
+        """移除并立即关闭全部实例"""
+        with self._lock:
+            entries = [*self._channel_entries.values(), *self._user_entries.values(),
+                       *(entry for _, entry in self._retired)]
+            self._channel_entries.clear()
+            self._user_entries.clear()
+            self._retired.clear()
+            for entry in entries:
+                entry.close()
+                self.closed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "channel_clients": len(self._channel_entries),
+                "user_clients": len(self._user_entries),
+                "retired_clients": len(self._retired),
+                "max_user_clients": self.max_user_entries,
+                "idle_ttl": self.idle_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "closed": self.closed,
+            }
+
+
+llm_registry = LLMRegistry(
+    max_user_entries=LLM_CLIENT_CACHE_SIZE,
+    idle_ttl=LLM_CLIENT_IDLE_TTL,
+    close_grace=LLM_CLIENT_CLOSE_GRACE,
+    max_connections=LLM_HTTP_MAX_CONNECTIONS,
+    max_keepalive=LLM_HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+    timeout=LLM_HTTP_TIMEOUT,
+)
+
+
+def get_llm(resolved_config: Dict[str, Any], is_function_calling_model: bool = False) -> OpenAILike:
+    """从全局注册表获取 LLM 实例（见 LLMRegistry）。"""
+    return llm_registry.get(resolved_config, is_function_calling_model)
@@ -0,0 +1,175 @@
+"""SSE 事件编码与 token 合并写出
+
+模型的流式增量往往只有一两个字符，逐个编码成帧并 yield 时，每个 token 都是一次 json.dumps、
+一次 socket 写入和一次反向代理 flush。SSEWriter 把连续的 token / reasoning 增量缓冲起来，
+累计超过 SSE_FLUSH_MAX_CHARS 个字符或距第一个缓冲增量超过 SSE_FLUSH_INTERVAL_MS 毫秒时合并为一帧写出；
+其他事件与心跳注释写出前先带上缓冲的增量（同一次写入），事件顺序不变。
+SSE_FLUSH_INTERVAL_MS=0 时不合并，每个增量立即成帧。
+
+帧格式与 json.dumps({"type": ..., "data": ...}, ensure_ascii=False) 完全一致，前端无需改动。
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Optional, TypeVar
+
+SSE_FLUSH_INTERVAL_MS = float(os.getenv("SSE_FLUSH_INTERVAL_MS", "30"))
+SSE_FLUSH_MAX_CHARS = int(os.getenv("SSE_FLUSH_MAX_CHARS", "512"))
+
+T = TypeVar("T")
+
+# 增量事件的固定前缀预先编码，写出时只需编码 data 字符串
+_DELTA_PREFIX = {
+    event_type: 'data: {"type": "%s", "data": ' % event_type
+    for event_type in ("token", "reasoning")
+}
+_FRAME_SUFFIX = "}\n\n"
+
+
+def sse_event(event_type: str, data: Any) -> str:
+    """编码单个 data 事件帧"""
+    return f"data: {json.dumps({'type': event_type, 'data': data}, ensure_ascii=False)}\n\n"
+
+
+def sse_comment(text: str) -> str:
+    """编码心跳 / 状态注释行（前端用于保活或显示进度）"""
+    return f": {text}\n\n"
+
+
+class SSEWriter:
+    """单个流式响应的 SSE 写出器（非线程安全，每个请求创建一个）。
+
+    用法：
+        writer = SSEWriter()
+        async for chunk in writer.paced(stream):
+            if chunk is None:            # 等待下一个增量时缓冲已超过时间窗口
+                frame = writer.flush()
+                if frame:
+                    yield frame
+                continue
+            frame = writer.delta("token", chunk.delta)
+            if frame:
+                yield frame
+        yield writer.event("done", {...})   # 先写出缓冲的增量
+    """
+
+    def __init__(self, interval_ms: Optional[float] = None, max_chars: Optional[int] = None):
+        self.interval = (SSE_FLUSH_INTERVAL_MS if interval_ms is None else interval_ms) / 1000
+        self.max_chars = SSE_FLUSH_MAX_CHARS if max_chars is None else max_chars
+        self.frames = 0  # 已写出的帧数（合并后的 token 帧计为一帧）
+        self.writes = 0  # 返回给调用方的非空字符串数，即网络写入次数
+        self._buffer_type: Optional[str] = None
+        self._buffer: list[str] = []
+        self._buffer_chars = 0
+        self._buffered_at = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _encode_delta(self) -> str:
+        if not self._buffer:
+            return ""
+        frame = _DELTA_PREFIX[self._buffer_type] + json.dumps("".join(self._buffer), ensure_ascii=False) + _FRAME_SUFFIX
+        self._buffer_type = None
+        self._buffer = []
+        self._buffer_chars = 0
+        self._cancel_timer()
+        self.frames += 1
+        return frame
+
+    def _write(self, text: str) -> str:
+        if text:
+            self.writes += 1
+        return text
+
+    def delta(self, event_type: str, text: str) -> str:
+        """缓冲一个 token / reasoning 增量；需要写出时返回合并后的帧，否则返回空串"""
+        if not text:
+            return ""
+        pending = ""
+        if self._buffer_type not in (None, event_type):
+            pending = self._encode_delta()  # 增量类型切换，先写出另一类型的缓冲
+        if not self._buffer:
+            self._buffered_at = time.monotonic()
+        self._buffer_type = event_type
+        self._buffer.append(text)
+        self._buffer_chars += len(text)
+        if (
+            self.interval <= 0
+            or self._buffer_chars >= self.max_chars
+            or time.monotonic() - self._buffered_at >= self.interval
+        ):
+            pending += self._encode_delta()
+        return self._write(pending)
+
+    def event(self, event_type: str, data: Any) -> str:
+        """写出缓冲的增量与一个完整事件（同一次写入）"""
+        text = self._encode_delta() + sse_event(event_type, data)
+        self.frames += 1
+        return self._write(text)
+
+    def comment(self, text: str) -> str:
+        """写出缓冲的增量与一行心跳注释（同一次写入）"""
+        return self._write(self._encode_delta() + sse_comment(text))
+
+    def flush(self) -> str:
+        """写出缓冲的增量；缓冲为空时返回空串"""
+        return self._write(self._encode_delta())
+
+    async def paced(self, source: AsyncIterator[T]) -> AsyncIterator[Optional[T]]:
+        """逐个产出 source 的元素；等待下一个元素期间缓冲到期时产出 None，提示调用方 flush。
+
+        上游由一个后台 task 读取到队列中，缓冲到期由 loop.call_later 向队列放入 flush 标记，
+        每个元素不额外创建 task。
+        """
+        if self.interval <= 0:
+            async for item in source:
+                yield item
+            return
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def pump():
+            try:
+                async for item in source:
+                    queue.put_nowait(item)
+            except BaseException as e:  # 上游异常交给消费方重新抛出
+                queue.put_nowait(_Failure(e))
+            else:
+                queue.put_nowait(_END)
+
+        task = asyncio.ensure_future(pump())
+        try:
+            while True:
+                if self._buffer and self._timer is None:
+                    delay = max(self.interval - (time.monotonic() - self._buffered_at), 0.0)
+                    self._timer = loop.call_later(delay, queue.put_nowait, _FLUSH)
+                item = await queue.get()
+                if item is _FLUSH:
+                    self._timer = None
+                    if self._buffer:
+                        yield None
+                elif item is _END:
+                    return
+                elif isinstance(item, _Failure):
+                    raise item.error
+                else:
+                    yield item
+        finally:
+            self._cancel_timer()
+            if not task.done():
+                task.cancel()
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_FLUSH = object()
+_END = object()
@@ -0,0 +1,27 @@
+"""Token 用量统计
+
+每个请求从自己的 LLM 响应中读取 completion tokens（上游返回的 usage），上游未返回时
+按词表估算已生成的文本。不修改全局 LlamaSettings.callback_manager，也不共享计数器，
+并发请求之间互不影响。
+"""
+from typing import Any, Callable, List, Optional
+
+from llama_index.core.callbacks.token_counting import get_tokens_from_response
+
+
+def completion_tokens(response: Any, text: Optional[str], tokenizer: Callable[[str], List[Any]]) -> int:
+    """返回单次 LLM 调用的 completion tokens。
+
+    Args:
+        response: ChatResponse；流式调用传最后一个 chunk（上游开启 include_usage 时用量在其中），可为 None
+        text: 生成的完整文本，上游未返回用量时用于估算
+        tokenizer: 估算用的分词函数（如 tiktoken encoding 的 encode）
+    """
+    if response is not None:
+        try:
+            _, tokens = get_tokens_from_response(response)
+        except Exception:
+            tokens = 0
+        if tokens:
+            return int(tokens)
+    return len(tokenizer(text)) if text else 0
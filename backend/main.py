@@ -12,11 +12,13 @@ from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from rag.chat import router as chat_router
+from rag.query_rewrite import STRATEGY_HEURISTIC, default_keyword_extractor, normalize_strategy
 from notes.router import router as notes_router
 from upload.router import router as upload_router
 from agent.router import router as agent_router
 from data.router import router as data_router
 from skill.router import router as skill_router
+from skill.service import get_document_catalog, run_blocking
 from translate.router import router as translate_router
 from translate import term_service
 from svg.router import router as svg_router
@@ -239,6 +241,19 @@ async def lifespan(app: FastAPI):
         # Error is already logged inside TermService.
         pass
 
+    # 启动时扫描一次官方文档目录，之后 list_documents / get_document 只按修改时间增量刷新
+    try:
+        await run_blocking(get_document_catalog().refresh)
+    except Exception as e:
+        print(f"[Skill] 文档目录扫描失败: {e}")
+
+    # heuristic 检索策略的本地关键词词表（术语表 + 知识库索引标题），在线程池中预先构建，首个请求不必等待
+    if normalize_strategy(os.getenv("RETRIEVAL_QUERY_STRATEGY")) == STRATEGY_HEURISTIC:
+        try:
+            await run_blocking(default_keyword_extractor)
+        except Exception as e:
+            print(f"[QueryRewrite] 关键词词表构建失败: {e}")
+
     yield
 
 
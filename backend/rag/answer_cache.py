@@ -0,0 +1,146 @@
+"""
+RAG 回答缓存
+
+社区提问中近似重复的问题很多（定时器怎么用、商店怎么做……），每次都要经历检索词改写、检索与完整生成。
+开启 ANSWER_CACHE_ENABLED 后，ChatEngine 按 (归一化问题, 回答语言, 模型, 索引版本号, 输出格式) 缓存回答：
+
+    精确匹配:   归一化后的问题完全相同
+    语义匹配:   同一 (回答语言, 模型, 索引版本号, 输出格式) 范围内，问题向量的余弦相似度
+               不低于 ANSWER_CACHE_SIMILARITY（设为 1 或以上时只做精确匹配）
+
+知识库重建后索引版本号变化，旧版本的缓存条目全部清空。
+只缓存无对话历史、无图片的提问，追问与图片问题的回答依赖额外输入，不复用。
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from rag.query_rewrite import normalize_question
+
+# (回答语言, 模型, 索引版本号, 输出格式)
+Scope = Tuple[str, str, Optional[str], str]
+
+
+class AnswerCache:
+    """回答的 LRU + TTL 缓存，支持精确与向量相似度查找。线程安全。"""
+
+    def __init__(self, max_size: int = 512, ttl: float = 86400.0, similarity_threshold: float = 0.95):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Tuple[str, Scope], Dict[str, Any]]" = OrderedDict()
+        self._index_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return 0 < self.similarity_threshold < 1
+
+    def _check_version(self, index_version: Optional[str]) -> None:
+        """索引版本号变化（知识库重建）时清空缓存，调用方需持有锁"""
+        if index_version != self._index_version:
+            self._data.clear()
+            self._index_version = index_version
+
+    def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return self.ttl > 0 and now - entry["created_at"] >= self.ttl
+
+    @staticmethod
+    def _result(entry: Dict[str, Any], match: str, similarity: float) -> Dict[str, Any]:
+        return {
+            "match": match,
+            "answer": entry["answer"],
+            "sources": entry["sources"],
+            "reasoning": entry["reasoning"],
+            "similarity": similarity,
+        }
+
+    def get(self, question: str, scope: Scope) -> Optional[Dict[str, Any]]:
+        """精确查找。命中时返回 {"match", "answer", "sources", "reasoning", "similarity"}，未命中不计数"""
+        key = (normalize_question(question), scope)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(scope[2])
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry, now):
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            self.exact_hits += 1
+            return self._result(entry, "exact", 1.0)
+
+    def get_similar(self, embedding: Sequence[float], scope: Scope) -> Optional[Dict[str, Any]]:
+        """在同一范围内按余弦相似度查找最接近的问题，不低于阈值时命中"""
+        vector = _unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(scope[2])
+            best_key, best_similarity = None, -1.0
+            for key, entry in list(self._data.items()):
+                if key[1] != scope or entry["embedding"] is None:
+                    continue
+                if self._expired(entry, now):
+                    del self._data[key]
+                    continue
+                similarity = float(np.dot(vector, entry["embedding"]))
+                if similarity > best_similarity:
+                    best_key, best_similarity = key, similarity
+            if best_key is None or best_similarity < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self._data.move_to_end(best_key)
+            self.semantic_hits += 1
+            return self._result(self._data[best_key], "semantic", round(best_similarity, 4))
+
+    def record_miss(self) -> None:
+        """只做精确查找且未命中时由调用方记录"""
+        with self._lock:
+            self.misses += 1
+
+    def put(self, question: str, scope: Scope, answer: str, sources: List[Dict[str, Any]],
+            reasoning: Optional[str] = None, embedding: Optional[Sequence[float]] = None) -> None:
+        if self.max_size <= 0 or not answer:
+            return
+        key = (normalize_question(question), scope)
+        entry = {
+            "answer": answer,
+            "sources": sources,
+            "reasoning": reasoning,
+            "embedding": _unit(embedding) if embedding is not None else None,
+            "created_at": time.monotonic(),
+        }
+        with self._lock:
+            self._check_version(scope[2])
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "index_version": self._index_version,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+            }
+
+
+def _unit(embedding: Sequence[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else vector
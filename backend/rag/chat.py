@@ -11,6 +11,7 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from .chatEngine import ChatEngine
+from common.llm_config import llm_registry
 
 router = APIRouter()
 
@@ -107,8 +108,8 @@ async def chat(request: ChatRequest):
         if not image_base64s and request.image_base64:
             image_base64s = [request.image_base64]
 
-        # 4. 执行对话
-        result = engine.chat(
+        # 4. 执行对话（异步版本，等待 LLM 响应时不阻塞其他请求）
+        result = await engine.achat(
             message=request.message,
             conversation=conversation,
             config=llm_config,
@@ -123,7 +124,11 @@ async def chat(request: ChatRequest):
                 question=request.message,
                 answer=result["answer"],
                 sources=[SourceNode(**src) for src in result["sources"]],
-                stats={"tokens": result["tokens"]},
+                stats={
+                    "tokens": result["tokens"],
+                    "timings": result.get("timings", {}),
+                    "context": result.get("context", {}),
+                },
                 reasoning=result.get("reasoning")
             )
         )
@@ -143,7 +148,11 @@ async def health():
         engine = get_chat_engine()
         return {
             "status": "ok",
-            "index_loaded": engine.rag_engine.index is not None
+            "index_loaded": engine.rag_engine.index is not None,
+            "query_embedding_cache": engine.rag_engine.get_query_embedding_stats(),
+            "retrieval_executor": engine.rag_engine.get_retrieval_executor_stats(),
+            "answer_cache": engine.answer_cache.stats() if engine.answer_cache else None,
+            "llm_clients": llm_registry.stats()
         }
     except Exception as e:
         return {
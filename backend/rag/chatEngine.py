@@ -34,17 +34,30 @@ if rag_v1_path not in sys.path:
 
 from typing import List, Dict, Any, Generator, Optional
 import json
+import math
+import time
 import asyncio
 import base64
-from llama_index.llms.openai_like import OpenAILike
 from llama_index.core.llms import ChatMessage, TextBlock, ImageBlock, MessageRole
-from llama_index.core.callbacks import CallbackManager, TokenCountingHandler
-from llama_index.core import Settings as LlamaSettings
 from llama_index.core.vector_stores.types import MetadataFilters, MetadataFilter, FilterOperator
 import tiktoken
 
 from src.rag_engine import create_rag_engine
-from common.llm_config import resolve_llm_config, format_llm_error
+from src.hybrid import reciprocal_rank_fusion
+from common.llm_config import resolve_llm_config, format_llm_error, get_llm
+from common.token_usage import completion_tokens
+from common.sse import SSEWriter, sse_event
+from rag.answer_cache import AnswerCache
+from rag.packing import pack_context
+from rag.query_rewrite import (
+    STRATEGY_CACHED,
+    STRATEGY_HEURISTIC,
+    STRATEGY_PARALLEL,
+    RewriteCache,
+    aheuristic_query,
+    heuristic_query,
+    normalize_strategy,
+)
 from common.openai_like_reasoning import to_chat_messages, extract_reasoning, reasoning_delta_from_chunk
 from common.i18n import (
     normalize_answer_language,
@@ -53,11 +66,24 @@ from common.i18n import (
 )
 
 
+# CombinedRetriever 召回模式
+MODE_SINGLE_PASS = "single_pass"  # 一次超量召回 + 内存分配名额，名额不足时才补充过滤检索
+MODE_TWO_PHASE = "two_phase"      # 官方 / 非官方各做一次带过滤的向量检索
+
+
 class CombinedRetriever:
-    """基于名额分配的优先级检索器，通过 rag_engine.retrieve_nodes() 执行两阶段召回：
+    """基于名额分配的优先级检索器，通过 rag_engine.retrieve_nodes() 召回两类内容：
+
+    preferred: official 目录下的官方文档，最多 doc_max 条
+    non_preferred: bbs/user 目录下的用户内容，补齐至 total_k 条
 
-    Phase 1 (preferred): 召回 official 目录下的官方文档，最多 doc_max 条
-    Phase 2 (non_preferred): 召回 bbs/user 目录下的用户内容，补齐至 total_k 条
+    召回模式（mode，默认 single_pass，由环境变量 RETRIEVAL_MODE 覆盖）:
+        single_pass: 不带过滤召回 total_k * overfetch 条，在内存中按 source_dir 分配名额；
+                     仅当某类名额无法填满且候选已取满时，才补一次带过滤的检索
+        two_phase:   官方 / 非官方各执行一次带过滤的向量检索
+
+    hybrid=True（环境变量 RETRIEVAL_HYBRID=true）时每次检索都融合 BM25 词法结果，
+    节点名、参数名、报错文本等原文能被精确召回；名额分配逻辑不变。
 
     合并顺序: 先放 non_preferred，再放 preferred，按 node_id 去重。
     效果: 官方文档占主要名额(doc_max)，用户内容补齐剩余。
@@ -74,47 +100,137 @@ class CombinedRetriever:
     # 官方文档的 source_dir 白名单（对应 Miliastra-knowledge/official/ 下的子目录）
     OFFICIAL_SOURCE_DIRS = ["guide", "tutorial", "faq", "official_faq"]
 
-    def __init__(self, rag_engine, total_k: int = 5, doc_max: int = 4, similarity_cutoff: float = None):
+    def __init__(self, rag_engine, total_k: int = 5, doc_max: int = 4, similarity_cutoff: float = None,
+                 mode: str = MODE_SINGLE_PASS, overfetch: float = 2.0, hybrid: bool = False):
         self.rag_engine = rag_engine
         self.total_k = int(total_k)
         self.doc_max = int(doc_max)
         self.similarity_cutoff = similarity_cutoff
+        self.mode = mode if mode in (MODE_SINGLE_PASS, MODE_TWO_PHASE) else MODE_SINGLE_PASS
+        self.overfetch = max(float(overfetch), 1.0)
+        self.hybrid = bool(hybrid)
 
-    def retrieve(self, query: str):
-        total_k = max(self.total_k, 0)
-        preferred_k = max(min(self.doc_max, total_k), 0)
+    def _preferred_filters(self) -> MetadataFilters:
+        return MetadataFilters(
+            filters=[MetadataFilter(key="source_dir", value=self.OFFICIAL_SOURCE_DIRS, operator=FilterOperator.IN)]
+        )
+
+    def _non_preferred_filters(self) -> MetadataFilters:
+        return MetadataFilters(
+            filters=[MetadataFilter(key="source_dir", value=self.OFFICIAL_SOURCE_DIRS, operator=FilterOperator.NIN)]
+        )
 
-        preferred_nodes = []
-        non_preferred_nodes = []
+    def _is_preferred(self, node) -> bool:
+        return node.metadata.get("source_dir") in self.OFFICIAL_SOURCE_DIRS
 
-        # Phase 1: 官方文档 (source_dir IN official 白名单)
+    def _retrieve_filtered(self, query: str, filters: MetadataFilters, top_k: int, query_embedding):
         try:
-            preferred_filters = MetadataFilters(
-                filters=[MetadataFilter(key="source_dir", value=self.OFFICIAL_SOURCE_DIRS, operator=FilterOperator.IN)]
-            )
-            preferred_nodes = list(self.rag_engine.retrieve_nodes(
+            return list(self.rag_engine.retrieve_nodes(
                 query,
-                filters=preferred_filters,
-                top_k=max(preferred_k, 4) if preferred_k > 0 else 4,
+                filters=filters,
+                top_k=top_k,
                 similarity_cutoff=self.similarity_cutoff,
+                query_embedding=query_embedding,
+                hybrid=self.hybrid,
             ))
         except Exception:
-            preferred_nodes = []
+            return []
+
+    async def _aretrieve_filtered(self, query: str, filters: MetadataFilters, top_k: int, query_embedding):
+        try:
+            return list(await self.rag_engine.aretrieve_nodes(
+                query,
+                filters=filters,
+                top_k=top_k,
+                similarity_cutoff=self.similarity_cutoff,
+                query_embedding=query_embedding,
+                hybrid=self.hybrid,
+            ))
+        except Exception:
+            return []
+
+    def _retrieve_two_phase(self, query: str, preferred_limit: int, total_k: int, query_embedding):
+        # Phase 1: 官方文档 (source_dir IN official 白名单)
+        preferred_nodes = self._retrieve_filtered(query, self._preferred_filters(), preferred_limit, query_embedding)
 
         # Phase 2: 用户内容 (source_dir NOT IN official 白名单，即 bbs/user 等)
-        non_preferred_k = total_k - len(preferred_nodes)
+        non_preferred_limit = max(total_k - len(preferred_nodes), 1)
+        non_preferred_nodes = self._retrieve_filtered(query, self._non_preferred_filters(), non_preferred_limit, query_embedding)
+        return preferred_nodes, non_preferred_nodes
+
+    async def _aretrieve_two_phase(self, query: str, preferred_limit: int, total_k: int, query_embedding):
+        preferred_nodes = await self._aretrieve_filtered(query, self._preferred_filters(), preferred_limit, query_embedding)
+        non_preferred_limit = max(total_k - len(preferred_nodes), 1)
+        non_preferred_nodes = await self._aretrieve_filtered(query, self._non_preferred_filters(), non_preferred_limit, query_embedding)
+        return preferred_nodes, non_preferred_nodes
+
+    def _fetch_k(self, preferred_limit: int, total_k: int) -> int:
+        return max(math.ceil(total_k * self.overfetch), preferred_limit + 1, total_k)
+
+    def _retrieve_single_pass(self, query: str, preferred_limit: int, total_k: int, query_embedding):
+        """一次不带过滤的超量召回，在内存中按 source_dir 分配名额。
+
+        超量召回的结果已按相似度排序，某一类的前 N 条与带过滤检索的前 N 条一致；
+        只有候选已取满（库中可能还有更多）而某类名额仍未填满时，才补一次带过滤的检索。
+        """
+        fetch_k = self._fetch_k(preferred_limit, total_k)
         try:
-            non_preferred_filters = MetadataFilters(
-                filters=[MetadataFilter(key="source_dir", value=self.OFFICIAL_SOURCE_DIRS, operator=FilterOperator.NIN)]
-            )
-            non_preferred_nodes = list(self.rag_engine.retrieve_nodes(
+            candidates = list(self.rag_engine.retrieve_nodes(
+                query,
+                top_k=fetch_k,
+                similarity_cutoff=self.similarity_cutoff,
+                query_embedding=query_embedding,
+                hybrid=self.hybrid,
+            ))
+        except Exception:
+            return self._retrieve_two_phase(query, preferred_limit, total_k, query_embedding)
+        exhausted = len(candidates) < fetch_k
+
+        preferred_nodes = [n for n in candidates if self._is_preferred(n)][:preferred_limit]
+        if len(preferred_nodes) < preferred_limit and not exhausted:
+            preferred_nodes = self._retrieve_filtered(query, self._preferred_filters(), preferred_limit, query_embedding)
+
+        non_preferred_limit = max(total_k - len(preferred_nodes), 1)
+        non_preferred_nodes = [n for n in candidates if not self._is_preferred(n)][:non_preferred_limit]
+        if len(non_preferred_nodes) < non_preferred_limit and not exhausted:
+            non_preferred_nodes = self._retrieve_filtered(query, self._non_preferred_filters(), non_preferred_limit, query_embedding)
+        return preferred_nodes, non_preferred_nodes
+
+    async def _aretrieve_single_pass(self, query: str, preferred_limit: int, total_k: int, query_embedding):
+        """_retrieve_single_pass 的异步版本，名额分配与补充检索逻辑相同。"""
+        fetch_k = self._fetch_k(preferred_limit, total_k)
+        try:
+            candidates = list(await self.rag_engine.aretrieve_nodes(
                 query,
-                filters=non_preferred_filters,
-                top_k=max(non_preferred_k, 1),
+                top_k=fetch_k,
                 similarity_cutoff=self.similarity_cutoff,
+                query_embedding=query_embedding,
+                hybrid=self.hybrid,
             ))
         except Exception:
-            non_preferred_nodes = []
+            return await self._aretrieve_two_phase(query, preferred_limit, total_k, query_embedding)
+        exhausted = len(candidates) < fetch_k
+
+        preferred_nodes = [n for n in candidates if self._is_preferred(n)][:preferred_limit]
+        if len(preferred_nodes) < preferred_limit and not exhausted:
+            preferred_nodes = await self._aretrieve_filtered(query, self._preferred_filters(), preferred_limit, query_embedding)
+
+        non_preferred_limit = max(total_k - len(preferred_nodes), 1)
+        non_preferred_nodes = [n for n in candidates if not self._is_preferred(n)][:non_preferred_limit]
+        if len(non_preferred_nodes) < non_preferred_limit and not exhausted:
+            non_preferred_nodes = await self._aretrieve_filtered(query, self._non_preferred_filters(), non_preferred_limit, query_embedding)
+        return preferred_nodes, non_preferred_nodes
+
+    def _quotas(self):
+        """返回 (total_k, preferred_k, preferred_limit)"""
+        total_k = max(self.total_k, 0)
+        preferred_k = max(min(self.doc_max, total_k), 0)
+        preferred_limit = max(preferred_k, 4) if preferred_k > 0 else 4
+        return total_k, preferred_k, preferred_limit
+
+    @staticmethod
+    def _merge(preferred_nodes, non_preferred_nodes, total_k: int, preferred_k: int):
+        non_preferred_k = total_k - len(preferred_nodes)
 
         combined = []
         seen = set()
@@ -138,9 +254,50 @@ class CombinedRetriever:
 
         return combined[:total_k]
 
-    # 异步适配
+    def retrieve(self, query: str):
+        total_k, preferred_k, preferred_limit = self._quotas()
+
+        # 查询向量只计算一次，多次检索复用（并经 rag_engine 缓存）
+        try:
+            query_embedding = self.rag_engine.get_query_embedding(query)
+        except Exception:
+            query_embedding = None
+
+        if self.mode == MODE_TWO_PHASE:
+            preferred_nodes, non_preferred_nodes = self._retrieve_two_phase(query, preferred_limit, total_k, query_embedding)
+        else:
+            preferred_nodes, non_preferred_nodes = self._retrieve_single_pass(query, preferred_limit, total_k, query_embedding)
+        return self._merge(preferred_nodes, non_preferred_nodes, total_k, preferred_k)
+
     async def aretrieve(self, query: str):
-        return await asyncio.to_thread(self.retrieve, query)
+        """异步检索：查询向量走嵌入模型的异步接口，Chroma 查询在 rag_engine 的专用线程池中执行。"""
+        total_k, preferred_k, preferred_limit = self._quotas()
+
+        try:
+            query_embedding = await self.rag_engine.aget_query_embedding(query)
+        except Exception:
+            query_embedding = None
+
+        if self.mode == MODE_TWO_PHASE:
+            preferred_nodes, non_preferred_nodes = await self._aretrieve_two_phase(query, preferred_limit, total_k, query_embedding)
+        else:
+            preferred_nodes, non_preferred_nodes = await self._aretrieve_single_pass(query, preferred_limit, total_k, query_embedding)
+        return self._merge(preferred_nodes, non_preferred_nodes, total_k, preferred_k)
+
+    def merge_ranked(self, ranked_lists):
+        """按倒数排名融合多次检索的结果（按 node_id 去重），再按与 retrieve 相同的名额分配合并：
+        官方文档最多 preferred_limit 条参与合并，用户内容补齐，两种检索查询策略的来源构成一致。"""
+        total_k, preferred_k, preferred_limit = self._quotas()
+        by_id = {}
+        for nodes in ranked_lists:
+            for node in nodes:
+                by_id.setdefault(node.node_id, node)
+        fused = reciprocal_rank_fusion([[node.node_id for node in nodes] for nodes in ranked_lists])
+        ranked = [by_id[node_id] for node_id, _ in fused]
+
+        preferred_nodes = [n for n in ranked if self._is_preferred(n)][:preferred_limit]
+        non_preferred_nodes = [n for n in ranked if not self._is_preferred(n)][:max(total_k - len(preferred_nodes), 1)]
+        return self._merge(preferred_nodes, non_preferred_nodes, total_k, preferred_k)
 
 
 class ChatEngine:
@@ -149,19 +306,47 @@ class ChatEngine:
     NON_STREAM_OUTPUT_INSTRUCTION = (
         "请直接使用纯文本作答，避免使用 Markdown 标题、列表、表格、代码块或其他格式化语法。"
     )
+
+    # 回放缓存回答时每个 token 事件携带的字符数
+    REPLAY_CHUNK_CHARS = 64
     
-    def __init__(self):
-        """初始化 RAG 索引和 token 计数器"""
-        self.rag_engine = create_rag_engine()
-        if not self.rag_engine.index:
-            raise RuntimeError("知识库未初始化，请先构建索引")
+    def __init__(self, rag_engine=None, tokenizer=None):
+        """初始化 RAG 索引和 token 估算用的分词器
+
+        Args:
+            rag_engine: 检索引擎，默认 create_rag_engine()（测试注入内存假引擎）
+            tokenizer: 分词函数，默认 tiktoken 的 gpt-3.5-turbo 词表
+        """
+        if rag_engine is None:
+            rag_engine = create_rag_engine()
+            if not rag_engine.index:
+                raise RuntimeError("知识库未初始化，请先构建索引")
+        self.rag_engine = rag_engine
         
-        # 初始化 token 计数器（参考官方文档）
-        self.token_counter = TokenCountingHandler(
-            tokenizer=tiktoken.encoding_for_model("gpt-3.5-turbo").encode,
-            verbose=False
+        # 上游未返回 usage 时按此分词器估算 completion tokens（各请求独立统计，见 common.token_usage）
+        self.tokenizer = tokenizer or tiktoken.encoding_for_model("gpt-3.5-turbo").encode
+
+        # 检索查询生成策略（见 rag/query_rewrite.py）
+        self.query_strategy = normalize_strategy(os.getenv("RETRIEVAL_QUERY_STRATEGY"))
+        self.rewrite_timeout = float(os.getenv("RETRIEVAL_REWRITE_TIMEOUT", "1.5"))
+        self.rewrite_cache = RewriteCache(
+            max_size=int(os.getenv("RETRIEVAL_REWRITE_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("RETRIEVAL_REWRITE_CACHE_TTL", "86400")),
         )
 
+        # 回答 prompt 的上下文打包：合并子块、去重并限制 token 数（见 rag/packing.py）
+        self.context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+        self.context_dedup_threshold = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9"))
+
+        # 回答缓存（见 rag/answer_cache.py），默认关闭
+        self.answer_cache = None
+        if os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true":
+            self.answer_cache = AnswerCache(
+                max_size=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+                ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+                similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")),
+            )
+
         self.context_prompt_template = (
             "你是千星沙箱知识库问答助手。千星沙箱是一款游戏 UGC 编辑器，主要通过实体、组件和节点图来实现功能与逻辑。\n"
             "请严格根据给定的知识库片段回答用户问题，不要把未检索到的信息当成已知事实。\n"
@@ -283,8 +468,202 @@ class ChatEngine:
         prompt += build_rag_non_chinese_instruction(answer_language)
         return prompt
     
+    @staticmethod
+    def _limit_conversation(conversation: List[Dict[str, str]], context_length: int) -> List[Dict[str, str]]:
+        """按上下文轮数截取最近的对话历史（每轮 user + assistant 两条）"""
+        if context_length == 0:
+            return []
+        if len(conversation) > context_length * 2:
+            return conversation[-(context_length * 2):]
+        return conversation
+
+    def _create_retriever(self) -> CombinedRetriever:
+        """按环境变量创建检索器（TOP_K/DOC_MAX 等覆盖默认值）"""
+        return CombinedRetriever(
+            rag_engine=self.rag_engine,
+            total_k=int(os.getenv("TOP_K", "12")),
+            doc_max=int(os.getenv("DOC_MAX", "8")),
+            similarity_cutoff=float(os.getenv("SIMILARITY_THRESHOLD", "0.3")),
+            mode=os.getenv("RETRIEVAL_MODE", MODE_SINGLE_PASS),
+            overfetch=float(os.getenv("RETRIEVAL_OVERFETCH", "2.0")),
+            hybrid=os.getenv("RETRIEVAL_HYBRID", "false").lower() == "true"
+        )
+
+    def _pack_context(self, nodes, log_prefix: str = "[ChatEngine]"):
+        """把检索结果打包成回答 prompt 的上下文，返回 (上下文文本, 打包统计)"""
+        context_str, context_stats = pack_context(
+            nodes, self.tokenizer, self.context_token_budget, self.context_dedup_threshold,
+        )
+        print(f"{log_prefix} 上下文打包: {context_stats}")
+        return context_str, context_stats
+
+    def _build_answer_message(self, message: str, context_str: str, plain_text_output: bool, answer_language: str,
+                              image_base64s: Optional[List[str]] = None) -> ChatMessage:
+        """阶段3：用打包后的检索结果构建回答 prompt（图片以 data URI 通过 url 传递）"""
+        fmt_msg = self._build_context_prompt(context_str, plain_text_output=plain_text_output, answer_language=answer_language) + f"\n\n用户问题：{message}"
+
+        blocks: List[Any] = [TextBlock(text=fmt_msg)]
+        for image_base64 in image_base64s or []:
+            blocks.append(ImageBlock(url=image_base64))
+        return ChatMessage(role=MessageRole.USER, blocks=blocks)
+
+    def _build_chat_result(self, response, nodes) -> Dict[str, Any]:
+        """组装非流式对话结果：答案、来源、completion tokens 与推理内容"""
+        result = {
+            "answer": response.message.content,
+            "sources": self._extract_sources(nodes),
+            # 回答调用的 completion tokens（若上游未返回用量则按词表估算）
+            "tokens": completion_tokens(response, response.message.content, self.tokenizer)
+        }
+
+        # 提取推理内容（ThinkingBlock 或 additional_kwargs.reasoning_content）
+        reasoning = extract_reasoning(response.message)
+        if reasoning:
+            result["reasoning"] = reasoning
+        return result
+
+    @staticmethod
+    def _elapsed_ms(started: float) -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    def _cached_rewrite(self, llm, message: str, image_base64s, answer_language: str) -> Optional[str]:
+        """cached 策略下查询改写缓存（带图片的问题不缓存）"""
+        if self.query_strategy != STRATEGY_CACHED or image_base64s:
+            return None
+        return self.rewrite_cache.get(message, answer_language, getattr(llm, "model", ""))
+
+    def _store_rewrite(self, llm, message: str, image_base64s, answer_language: str, query: str) -> None:
+        # 改写失败时返回原问题，不缓存
+        if self.query_strategy == STRATEGY_CACHED and not image_base64s and query != message:
+            self.rewrite_cache.put(message, answer_language, getattr(llm, "model", ""), query)
+
+    def _retrieve_with_strategy(self, llm, message: str, image_base64s, answer_language: str, timings: Dict[str, Any]):
+        """同步版本的检索阶段：parallel 策略按 llm 顺序执行（同步调用无法并行）"""
+        timings["strategy"] = self.query_strategy
+        started = time.perf_counter()
+        if self.query_strategy == STRATEGY_HEURISTIC:
+            retrieval_query = heuristic_query(message)
+        else:
+            retrieval_query = self._cached_rewrite(llm, message, image_base64s, answer_language)
+            timings["rewrite_cached"] = retrieval_query is not None
+            if retrieval_query is None:
+                retrieval_query = self._generate_retrieval_query(llm, message, image_base64s, answer_language)
+                self._store_rewrite(llm, message, image_base64s, answer_language, retrieval_query)
+        timings["rewrite_ms"] = self._elapsed_ms(started)
+
+        started = time.perf_counter()
+        nodes = self._create_retriever().retrieve(retrieval_query)
+        timings["retrieval_ms"] = self._elapsed_ms(started)
+        return nodes
+
+    async def _aretrieve_with_strategy(self, llm, message: str, image_base64s, answer_language: str, timings: Dict[str, Any]):
+        """检索阶段：按 query_strategy 生成检索查询并检索，各阶段耗时（毫秒）写入 timings"""
+        timings["strategy"] = self.query_strategy
+        retriever = self._create_retriever()
+        if self.query_strategy == STRATEGY_PARALLEL:
+            return await self._aretrieve_parallel(retriever, llm, message, image_base64s, answer_language, timings)
+
+        started = time.perf_counter()
+        if self.query_strategy == STRATEGY_HEURISTIC:
+            retrieval_query = await aheuristic_query(message)
+        else:
+            retrieval_query = self._cached_rewrite(llm, message, image_base64s, answer_language)
+            timings["rewrite_cached"] = retrieval_query is not None
+            if retrieval_query is None:
+                retrieval_query = await self._generate_retrieval_query_async(llm, message, image_base64s, answer_language)
+                self._store_rewrite(llm, message, image_base64s, answer_language, retrieval_query)
+        timings["rewrite_ms"] = self._elapsed_ms(started)
+
+        started = time.perf_counter()
+        nodes = await retriever.aretrieve(retrieval_query)
+        timings["retrieval_ms"] = self._elapsed_ms(started)
+        return nodes
+
+    async def _aretrieve_parallel(self, retriever, llm, message: str, image_base64s, answer_language: str, timings: Dict[str, Any]):
+        """parallel 策略：原问题检索与 LLM 改写同时进行，改写超时则只用原问题的结果"""
+        started = time.perf_counter()
+        rewrite_task = asyncio.create_task(
+            self._generate_retrieval_query_async(llm, message, image_base64s, answer_language)
+        )
+        try:
+            raw_nodes = await retriever.aretrieve(message)
+        except BaseException:
+            rewrite_task.cancel()
+            raise
+        timings["retrieval_ms"] = self._elapsed_ms(started)
+
+        remaining = max(self.rewrite_timeout - (time.perf_counter() - started), 0.0)
+        try:
+            retrieval_query = await asyncio.wait_for(rewrite_task, timeout=remaining)
+        except asyncio.TimeoutError:
+            timings["rewrite_timed_out"] = True
+            print(f"[ChatEngine] 检索查询生成超过 {self.rewrite_timeout}s，仅使用原问题检索结果")
+            return raw_nodes
+        timings["rewrite_ms"] = self._elapsed_ms(started)
+        if retrieval_query == message:
+            return raw_nodes
+
+        merge_started = time.perf_counter()
+        rewritten_nodes = await retriever.aretrieve(retrieval_query)
+        timings["rewrite_retrieval_ms"] = self._elapsed_ms(merge_started)
+        return retriever.merge_ranked([rewritten_nodes, raw_nodes])
+
+    def _answer_cache_scope(self, llm, chat_history, image_base64s, answer_language: str, output_format: str):
+        """可复用缓存回答时返回缓存范围 (回答语言, 模型, 索引版本号, 输出格式)，否则返回 None"""
+        if self.answer_cache is None or chat_history or image_base64s:
+            return None
+        return (answer_language, getattr(llm, "model", ""), self.rag_engine.get_index_version(), output_format)
+
+    def _lookup_answer(self, message: str, scope):
+        """回答缓存查找（同步）：先精确匹配，再按问题向量相似度匹配。返回 (命中结果或 None, 问题向量)"""
+        cached = self.answer_cache.get(message, scope)
+        if cached is not None:
+            return cached, None
+        if not self.answer_cache.semantic_enabled:
+            self.answer_cache.record_miss()
+            return None, None
+        embedding = self.rag_engine.get_query_embedding(message)
+        return self.answer_cache.get_similar(embedding, scope), embedding
+
+    async def _alookup_answer(self, message: str, scope):
+        """_lookup_answer 的异步版本，问题向量通过 aget_query_embedding 获取"""
+        cached = self.answer_cache.get(message, scope)
+        if cached is not None:
+            return cached, None
+        if not self.answer_cache.semantic_enabled:
+            self.answer_cache.record_miss()
+            return None, None
+        embedding = await self.rag_engine.aget_query_embedding(message)
+        return self.answer_cache.get_similar(embedding, scope), embedding
+
+    def _store_answer(self, message: str, scope, answer: str, sources, reasoning, embedding) -> None:
+        if scope is not None:
+            self.answer_cache.put(message, scope, answer, sources, reasoning, embedding)
+
+    def _record_cache_hit(self, cached: Dict[str, Any], timings: Dict[str, Any], started: float, log_prefix: str) -> None:
+        timings["cache"] = cached["match"]
+        timings["cache_similarity"] = cached["similarity"]
+        timings["total_ms"] = self._elapsed_ms(started)
+        print(f"{log_prefix} 命中回答缓存: {timings}")
+
+    def _cached_chat_result(self, cached: Dict[str, Any], timings: Dict[str, Any], started: float) -> Dict[str, Any]:
+        """用缓存的回答组装非流式结果（未调用 LLM，tokens 为 0）"""
+        self._record_cache_hit(cached, timings, started, "[ChatEngine]")
+        result = {"answer": cached["answer"], "sources": cached["sources"], "tokens": 0}
+        if cached["reasoning"]:
+            result["reasoning"] = cached["reasoning"]
+        result["timings"] = timings
+        return result
+
+    def _create_llm(self, config: Dict[str, str], log_prefix: str = "[ChatEngine]"):
+        """解析 LLM 配置并取得 LLM 实例（按渠道配置复用，见 common.llm_config.LLMRegistry）"""
+        resolved_config = resolve_llm_config(config)
+        llm = get_llm(resolved_config)
+        print(f"{log_prefix} 使用 LLM 模型: {resolved_config['model']} (API: {resolved_config['api_base_url']})")
+        return llm
+
     def chat(self, message: str, conversation: List[Dict[str, str]], config: Dict[str, str], image_base64s: Optional[List[str]] = None) -> Dict[str, Any]:
-        """执行对话查询
+        """执行对话查询（同步版本，异步端点请使用 achat）
         
         Args:
             message: 用户问题
@@ -295,130 +674,79 @@ class ChatEngine:
         Returns:
             {"answer": str, "sources": List[dict], "tokens": int}
         """
-        # 1. 解析 LLM 配置
-        resolved_config = resolve_llm_config(config)
-        
-        # 2. 获取上下文长度配置
-        context_length = config.get("context_length", 3)
+        # 1. 创建 LLM，截取对话历史（保留 reasoning_content 以便思考模型回传）
+        llm = self._create_llm(config)
         answer_language = normalize_answer_language(config.get("answer_language"))
-        if context_length == 0:
-            limited_conversation = []
-        elif len(conversation) > context_length * 2:
-            limited_conversation = conversation[-(context_length * 2):]
-        else:
-            limited_conversation = conversation
-        
-        # 3. 创建 LLM
-        llm = OpenAILike(
-            api_key=resolved_config["api_key"],
-            api_base=resolved_config["api_base_url"],
-            model=resolved_config["model"],
-            is_chat_model=True
-        )
-        print(f"[ChatEngine] 使用 LLM 模型: {resolved_config['model']}")
-        
-        # 4. 转换对话历史为 ChatMessage 格式（保留 reasoning_content 以便思考模型回传）
-        chat_history = to_chat_messages(limited_conversation)
+        chat_history = to_chat_messages(self._limit_conversation(conversation, config.get("context_length", 3)))
         
-        # 5. 重置 token 计数器
-        self.token_counter.reset_counts()
+        # 2. 阶段1 + 2：生成检索查询并检索（策略见 query_strategy）
+        timings: Dict[str, Any] = {}
+        started = time.perf_counter()
+        cache_scope = self._answer_cache_scope(llm, chat_history, image_base64s, answer_language, "plain")
+        question_embedding = None
+        if cache_scope is not None:
+            cached, question_embedding = self._lookup_answer(message, cache_scope)
+            if cached is not None:
+                return self._cached_chat_result(cached, timings, started)
+        nodes = self._retrieve_with_strategy(llm, message, image_base64s, answer_language, timings)
+        node_ids = [nd.node_id[:12] for nd in nodes]
+        print(f"[ChatEngine] 召回 {len(nodes)} 条, ids={node_ids}")
         
-        # 6. 设置全局 callback manager
-        original_callback_manager = LlamaSettings.callback_manager
-        LlamaSettings.callback_manager = CallbackManager([self.token_counter])
-        
-        try:
-            # 7. 阶段1：让 LLM 生成检索查询
-            retrieval_query = self._generate_retrieval_query(llm, message, image_base64s, answer_language)
-            
-            # 8. 阶段2：执行检索（TOP_K/DOC_MAX 由环境变量覆盖默认值）
-            similarity_top_k = int(os.getenv("TOP_K", "12"))
-            similarity_cutoff = float(os.getenv("SIMILARITY_THRESHOLD", "0.3"))
-            
-            retriever = CombinedRetriever(
-                rag_engine=self.rag_engine,
-                total_k=similarity_top_k,
-                doc_max=int(os.getenv("DOC_MAX", "8")),
-                similarity_cutoff=similarity_cutoff
-            )
-            nodes = retriever.retrieve(retrieval_query)
-            node_ids = [nd.node_id[:12] for nd in nodes]
-            print(f"[ChatEngine] 召回 {len(nodes)} 条, ids={node_ids}")
-            
-            # 9. 阶段3：构建 prompt 和消息，让 LLM 根据检索结果回答
-            context_str = "\n\n".join([n.get_content() for n in nodes])
-            fmt_msg = self._build_context_prompt(context_str, plain_text_output=True, answer_language=answer_language) + f"\n\n用户问题：{message}"
-            
-            blocks: List[Any] = [TextBlock(text=fmt_msg)]
-            for image_base64 in image_base64s or []:
-                # 使用 url 传递 data URI
-                blocks.append(ImageBlock(url=image_base64))
-            
-            last_msg = ChatMessage(role=MessageRole.USER, blocks=blocks)
-            
-            # 9. 执行查询 (直接调用 LLM)
-            response = llm.chat(chat_history + [last_msg])
-            
-            # 10. 提取来源
-            sources = self._extract_sources(nodes)
-            
-            # 11. 获取 completion tokens（若上游未返回用量则按词表估算）
-            completion_tokens = self.token_counter.completion_llm_token_count
-            if completion_tokens == 0 and response.message.content:
-                completion_tokens = len(self.token_counter.tokenizer(response.message.content))
-            
-            result = {
-                "answer": response.message.content,
-                "sources": sources,
-                "tokens": completion_tokens
-            }
-
-            # 提取推理内容（ThinkingBlock 或 additional_kwargs.reasoning_content）
-            reasoning = extract_reasoning(response.message)
+        # 3. 阶段3：根据检索结果回答
+        generation_started = time.perf_counter()
+        context_str, context_stats = self._pack_context(nodes)
+        last_msg = self._build_answer_message(message, context_str, True, answer_language, image_base64s)
+        response = llm.chat(chat_history + [last_msg])
+        timings["generation_ms"] = self._elapsed_ms(generation_started)
+        timings["total_ms"] = self._elapsed_ms(started)
+        print(f"[ChatEngine] 阶段耗时: {timings}")
+        result = self._build_chat_result(response, nodes)
+        self._store_answer(message, cache_scope, result["answer"], result["sources"], result.get("reasoning"), question_embedding)
+        result["timings"] = timings
+        result["context"] = context_stats
+        return result
+
+    async def achat(self, message: str, conversation: List[Dict[str, str]], config: Dict[str, str], image_base64s: Optional[List[str]] = None) -> Dict[str, Any]:
+        """执行对话查询（异步版本）：两次 LLM 调用走 llm.achat，检索走 CombinedRetriever.aretrieve，
+        等待上游响应期间不阻塞事件循环。参数与返回值同 chat。
+        """
+        llm = self._create_llm(config)
+        answer_language = normalize_answer_language(config.get("answer_language"))
+        chat_history = to_chat_messages(self._limit_conversation(conversation, config.get("context_length", 3)))
+
+        timings: Dict[str, Any] = {}
+        started = time.perf_counter()
+        cache_scope = self._answer_cache_scope(llm, chat_history, image_base64s, answer_language, "plain")
+        question_embedding = None
+        if cache_scope is not None:
+            cached, question_embedding = await self._alookup_answer(message, cache_scope)
+            if cached is not None:
+                return self._cached_chat_result(cached, timings, started)
+        nodes = await self._aretrieve_with_strategy(llm, message, image_base64s, answer_language, timings)
+        node_ids = [nd.node_id[:12] for nd in nodes]
+        print(f"[ChatEngine] 召回 {len(nodes)} 条, ids={node_ids}")
+
+        generation_started = time.perf_counter()
+        context_str, context_stats = self._pack_context(nodes)
+        last_msg = self._build_answer_message(message, context_str, True, answer_language, image_base64s)
+        response = await llm.achat(chat_history + [last_msg])
+        timings["generation_ms"] = self._elapsed_ms(generation_started)
+        timings["total_ms"] = self._elapsed_ms(started)
+        print(f"[ChatEngine] 阶段耗时: {timings}")
+        result = self._build_chat_result(response, nodes)
+        self._store_answer(message, cache_scope, result["answer"], result["sources"], result.get("reasoning"), question_embedding)
+        result["timings"] = timings
+        result["context"] = context_stats
+        return result
 
-            if reasoning:
-                result["reasoning"] = reasoning
-            
-            return result
-        finally:
-            # 恢复原来的 callback manager
-            LlamaSettings.callback_manager = original_callback_manager
-    
     async def chat_stream_async(self, message: str, conversation: List[Dict[str, str]], config: Dict[str, str], image_base64s: Optional[List[str]] = None):
-        """执行异步流式对话查询（带心跳机制防止超时）"""
-        # 保存原始 callback manager，确保异常时也能恢复
-        original_callback_manager = LlamaSettings.callback_manager
+        """执行异步流式对话查询（带心跳机制防止超时；token 增量按时间窗口合并写出，见 common.sse）"""
+        writer = SSEWriter()
         try:
-            # 1. 解析 LLM 配置
-            resolved_config = resolve_llm_config(config)
-
-            # 2. 获取上下文长度配置
-            context_length = config.get("context_length", 1)
+            # 1. 创建 LLM，截取对话历史（保留 reasoning_content 以便思考模型回传）
+            llm = self._create_llm(config, "[ChatEngine Stream]")
             answer_language = normalize_answer_language(config.get("answer_language"))
-            if context_length == 0:
-                limited_conversation = []
-            elif len(conversation) > context_length * 2:
-                limited_conversation = conversation[-(context_length * 2):]
-            else:
-                limited_conversation = conversation
-
-            # 3. 创建 LLM
-            llm = OpenAILike(
-                api_key=resolved_config["api_key"],
-                api_base=resolved_config["api_base_url"],
-                model=resolved_config["model"],
-                is_chat_model=True
-            )
-            print(f"[ChatEngine Stream] 使用模型: {resolved_config['model']} (API: {resolved_config['api_base_url']})")
-
-            # 4. 转换对话历史为 ChatMessage 格式（保留 reasoning_content 以便思考模型回传）
-            chat_history = to_chat_messages(limited_conversation)
-
-            # 5. 重置 token 计数器
-            self.token_counter.reset_counts()
-
-            # 6. 设置全局 callback manager
-            LlamaSettings.callback_manager = CallbackManager([self.token_counter])
+            chat_history = to_chat_messages(self._limit_conversation(conversation, config.get("context_length", 1)))
 
             # 步骤1：发送初始心跳
             yield ": connected\n\n"
@@ -426,24 +754,19 @@ class ChatEngine:
             # 步骤1.5：发送对话引擎就绪状态
             yield ": chat_engine_created\n\n"
 
-            # 步骤2：阶段1 - 让 LLM 生成检索查询
+            # 步骤2：阶段1 + 2 - 生成检索查询并检索（策略见 query_strategy）
             yield f"data: {json.dumps({'type': 'status', 'data': '正在分析问题...'}, ensure_ascii=False)}\n\n"
-            retrieval_query = await self._generate_retrieval_query_async(llm, message, image_base64s, answer_language)
-            yield ": query_generated\n\n"
-
-            # 步骤3：阶段2 - 执行检索（TOP_K/DOC_MAX 由环境变量覆盖默认值）
-            similarity_top_k = int(os.getenv("TOP_K", "12"))
-            similarity_cutoff = float(os.getenv("SIMILARITY_THRESHOLD", "0.3"))
-
-            retriever = CombinedRetriever(
-                rag_engine=self.rag_engine,
-                total_k=similarity_top_k,
-                doc_max=int(os.getenv("DOC_MAX", "8")),
-                similarity_cutoff=similarity_cutoff
-            )
-
-            # 使用 LLM 生成的查询进行检索
-            nodes = await asyncio.to_thread(retriever.retrieve, retrieval_query)
+            timings: Dict[str, Any] = {}
+            started = time.perf_counter()
+            cache_scope = self._answer_cache_scope(llm, chat_history, image_base64s, answer_language, "markdown")
+            question_embedding = None
+            if cache_scope is not None:
+                cached, question_embedding = await self._alookup_answer(message, cache_scope)
+                if cached is not None:
+                    for event in self._replay_cached_answer(cached, timings, started):
+                        yield event
+                    return
+            nodes = await self._aretrieve_with_strategy(llm, message, image_base64s, answer_language, timings)
             node_ids = [nd.node_id[:12] for nd in nodes]
             print(f"[ChatEngine Stream] 召回 {len(nodes)} 条, ids={node_ids}")
 
@@ -456,50 +779,73 @@ class ChatEngine:
             yield ": sources_sent\n\n"
 
             # 步骤5：阶段3 - 构建 prompt 和消息，让 LLM 根据检索结果回答
-            context_str = "\n\n".join([n.get_content() for n in nodes])
-            fmt_msg = self._build_context_prompt(context_str, plain_text_output=False, answer_language=answer_language) + f"\n\n用户问题：{message}"
-
-            blocks: List[Any] = [TextBlock(text=fmt_msg)]
-            for image_base64 in image_base64s or []:
-                blocks.append(ImageBlock(url=image_base64))
             if image_base64s:
                 print(f"[ChatEngine Stream] 已加载 {len(image_base64s)} 张图片数据")
-
-            last_msg = ChatMessage(role=MessageRole.USER, blocks=blocks)
+            context_str, context_stats = self._pack_context(nodes, "[ChatEngine Stream]")
+            last_msg = self._build_answer_message(message, context_str, False, answer_language, image_base64s)
 
             # 步骤6：流式发送文本
             stream_gen = await llm.astream_chat(chat_history + [last_msg])
 
             chunk_count = 0
             partial_answer = ""
-            async for response_chunk in stream_gen:
+            partial_reasoning = ""
+            last_chunk = None
+            async for response_chunk in writer.paced(stream_gen):
+                if response_chunk is None:
+                    # 等待下一个增量期间缓冲已到时间窗口，先写出
+                    frame = writer.flush()
+                    if frame:
+                        yield frame
+                    continue
                 # response_chunk 是 ChatResponseChunk，包含 delta
+                last_chunk = response_chunk
                 content = response_chunk.delta
 
                 if content:
+                    if not partial_answer:
+                        timings["first_token_ms"] = self._elapsed_ms(started)
                     partial_answer += content
-                    yield f"data: {json.dumps({'type': 'token', 'data': content}, ensure_ascii=False)}\n\n"
+                    frame = writer.delta("token", content)
+                    if frame:
+                        yield frame
 
                 thinking = reasoning_delta_from_chunk(response_chunk)
                 if thinking:
-                    yield f"data: {json.dumps({'type': 'reasoning', 'data': thinking}, ensure_ascii=False)}\n\n"
+                    partial_reasoning += thinking
+                    frame = writer.delta("reasoning", thinking)
+                    if frame:
+                        yield frame
 
                 chunk_count += 1
                 if chunk_count % 10 == 0:
-                    yield ": generating\n\n"
-
-            # 步骤7：发送完成信号（若上游未返回用量则按已生成文本估算）
-            completion_tokens = self.token_counter.completion_llm_token_count
-            if completion_tokens == 0:
-                completion_tokens = len(self.token_counter.tokenizer(partial_answer or ""))
-            yield f"data: {json.dumps({'type': 'done', 'data': {'tokens': completion_tokens}}, ensure_ascii=False)}\n\n"
+                    # 心跳与缓冲的增量一起写出
+                    yield writer.comment("generating")
+
+            # 步骤7：发送完成信号（用量取自最后一个 chunk，若上游未返回则按已生成文本估算）
+            tokens = completion_tokens(last_chunk, partial_answer, self.tokenizer)
+            timings["total_ms"] = self._elapsed_ms(started)
+            print(f"[ChatEngine Stream] 阶段耗时: {timings}, SSE 写入 {writer.writes} 次")
+            self._store_answer(message, cache_scope, partial_answer, sources, partial_reasoning or None, question_embedding)
+            yield writer.event("done", {"tokens": tokens, "timings": timings, "context": context_stats})
             yield ": completed\n\n"
 
         except Exception as e:
             # 发送详细错误信息（覆盖每日限额、上游 API 429/配额超限等）
             print(f"[ChatEngine Stream] 流式失败: {format_llm_error(e)}")
-            yield f"data: {json.dumps({'type': 'error', 'data': format_llm_error(e)}, ensure_ascii=False)}\n\n"
-
-        finally:
-            # 恢复原来的 callback manager
-            LlamaSettings.callback_manager = original_callback_manager
+            yield writer.event("error", format_llm_error(e))
+
+    def _replay_cached_answer(self, cached: Dict[str, Any], timings: Dict[str, Any], started: float):
+        """按流式事件格式回放缓存的回答：sources → reasoning → token（分片）→ done，token 帧一次写出"""
+        yield sse_event("sources", cached["sources"])
+        yield ": sources_sent\n\n"
+        frames = []
+        if cached["reasoning"]:
+            frames.append(sse_event("reasoning", cached["reasoning"]))
+        answer = cached["answer"]
+        for i in range(0, len(answer), self.REPLAY_CHUNK_CHARS):
+            frames.append(sse_event("token", answer[i:i + self.REPLAY_CHUNK_CHARS]))
+        yield "".join(frames)
+        self._record_cache_hit(cached, timings, started, "[ChatEngine Stream]")
+        yield sse_event("done", {"tokens": 0, "timings": timings})
+        yield ": completed\n\n"
@@ -0,0 +1,163 @@
+"""
+回答 prompt 的上下文打包
+
+检索结果直接拼接时，同一一级标题下的多个子块（SentenceSplitter 二次分割，相邻子块有重叠）会重复出现，
+官方文档被转载到 bbs 的段落也会重复；TOP_K 条完整内容还可能超出免费模型的上下文窗口。
+pack_context 按以下步骤处理检索结果：
+
+    1. 合并：同一文档、同一 chunk_index 下 subchunk_index 连续的子块合并为一段，去掉相邻子块的重叠部分，
+             合并后的段落排在其中排名最高的子块的位置
+    2. 去重：段落的字符 n-gram 有 CONTEXT_DEDUP_THRESHOLD 以上包含在排名更高的段落中时丢弃
+    3. 截断：按排名依次放入，总 token 数不超过 CONTEXT_TOKEN_BUDGET（<= 0 表示不限制），
+             放不下的段落截断到剩余预算（剩余不足 MIN_TRUNCATED_TOKENS 时直接丢弃）
+"""
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+_SHINGLE_SIZE = 5
+# 判定相邻子块重叠时要求的最短公共长度（字符），避免把偶然相同的短句当成重叠
+_MIN_OVERLAP_CHARS = 16
+# 截断后剩余内容少于此 token 数时不再放入
+MIN_TRUNCATED_TOKENS = 64
+SEPARATOR = "\n\n"
+
+
+def _document_key(node) -> Optional[str]:
+    metadata = node.metadata
+    return node.node.ref_doc_id or metadata.get("file_path") or metadata.get("id")
+
+
+def _merge_overlapping(first: str, second: str) -> str:
+    """拼接相邻子块：second 的开头与 first 的结尾重叠时只保留一份"""
+    probe = second[:_MIN_OVERLAP_CHARS]
+    pos = first.find(probe, max(0, len(first) - len(second)))
+    while pos != -1:
+        if second.startswith(first[pos:]):
+            return first + second[len(first) - pos:]
+        pos = first.find(probe, pos + 1)
+    return first + SEPARATOR + second
+
+
+def _merge_subchunks(nodes) -> List[str]:
+    """步骤1：按排名输出段落，subchunk_index 连续的子块合并到排名最高的子块处"""
+    groups: Dict[Tuple[str, Any], List[Tuple[int, str]]] = {}
+    order: List[Any] = []  # 每项为分组键，或无法分组的节点文本
+    for node in nodes:
+        metadata = node.metadata
+        doc_key = _document_key(node)
+        chunk_index = metadata.get("chunk_index")
+        subchunk_index = metadata.get("subchunk_index")
+        if doc_key is None or chunk_index is None or subchunk_index is None:
+            order.append(node.get_content())
+            continue
+        key = (doc_key, chunk_index)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append((int(subchunk_index), node.get_content()))
+
+    passages: List[str] = []
+    for item in order:
+        if isinstance(item, str):
+            passages.append(item)
+            continue
+        subchunks = sorted(set(groups[item]))
+        # 不连续的子块各自成段，仍放在该组的位置
+        text, previous = subchunks[0][1], subchunks[0][0]
+        for index, content in subchunks[1:]:
+            if index == previous + 1:
+                text = _merge_overlapping(text, content)
+            else:
+                passages.append(text)
+                text = content
+            previous = index
+        passages.append(text)
+    return passages
+
+
+def _shingles(text: str) -> Set[str]:
+    text = "".join(unicodedata.normalize("NFKC", text).lower().split())
+    if len(text) <= _SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + _SHINGLE_SIZE] for i in range(len(text) - _SHINGLE_SIZE + 1)}
+
+
+def _drop_duplicates(passages: List[str], threshold: float) -> Tuple[List[str], int]:
+    """步骤2：丢弃大部分内容已包含在排名更高段落中的段落，返回 (保留的段落, 丢弃数)"""
+    kept: List[str] = []
+    kept_shingles: List[Set[str]] = []
+    for passage in passages:
+        shingles = _shingles(passage)
+        if not shingles:
+            continue
+        if any(len(shingles & other) >= threshold * len(shingles) for other in kept_shingles):
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+    return kept, len(passages) - len(kept)
+
+
+def _truncate(text: str, max_tokens: int, tokenizer: Callable[[str], List[Any]]) -> str:
+    """按字符比例估计截断位置，再逐步收缩到不超过 max_tokens"""
+    tokens = len(tokenizer(text))
+    while tokens > max_tokens and text:
+        text = text[:max(int(len(text) * max_tokens / tokens), 1) - 1]
+        tokens = len(tokenizer(text))
+    return text
+
+
+def pack_context(
+    nodes,
+    tokenizer: Callable[[str], List[Any]],
+    token_budget: int = 0,
+    dedup_threshold: float = 0.9,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    把检索结果打包成回答 prompt 的上下文。
+
+    Args:
+        nodes: 按排名排序的 NodeWithScore 列表
+        tokenizer: 计数用的分词函数（与 completion tokens 估算相同的 tiktoken encode）
+        token_budget: 上下文 token 上限，<= 0 表示不限制
+        dedup_threshold: 段落判定为重复的 n-gram 包含比例，>= 1 时只丢弃完全被包含的段落
+
+    Returns:
+        (上下文文本, 统计信息)。统计信息包含原始拼接与打包后的 token 数（original_tokens / tokens）、
+        节省的 token 数（saved_tokens）、段落数、合并的子块数、丢弃的重复段落数、因预算丢弃的段落数与是否截断
+    """
+    original_tokens = len(tokenizer(SEPARATOR.join(n.get_content() for n in nodes)))
+    merged = _merge_subchunks(nodes)
+    passages, duplicates = _drop_duplicates(merged, dedup_threshold)
+
+    packed: List[str] = []
+    used = 0
+    over_budget = 0
+    truncated = False
+    separator_tokens = len(tokenizer(SEPARATOR))
+    for i, passage in enumerate(passages):
+        separator_cost = separator_tokens if packed else 0
+        cost = len(tokenizer(passage)) + separator_cost
+        if token_budget <= 0 or used + cost <= token_budget:
+            packed.append(passage)
+            used += cost
+            continue
+        # 预算不足：截断这一段（剩余预算足够时），之后的段落全部丢弃，保持排名顺序
+        remaining = token_budget - used - separator_cost
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            packed.append(_truncate(passage, remaining, tokenizer))
+            truncated = True
+        over_budget = len(passages) - i - int(truncated)
+        break
+
+    context_str = SEPARATOR.join(packed)
+    tokens = len(tokenizer(context_str))
+    return context_str, {
+        "original_tokens": original_tokens,
+        "tokens": tokens,
+        "saved_tokens": original_tokens - tokens,
+        "passages": len(packed),
+        "merged_subchunks": len(nodes) - len(merged),
+        "dropped_duplicates": duplicates,
+        "dropped_over_budget": over_budget,
+        "truncated": truncated,
+    }
@@ -0,0 +1,153 @@
+"""
+检索查询生成策略
+
+ChatEngine 在检索前通常先让 LLM 把用户问题改写成检索关键词，这次往返会直接计入首个 token 的等待时间。
+策略由环境变量 RETRIEVAL_QUERY_STRATEGY 选择：
+
+    llm:       LLM 改写后再检索（默认，原有行为）
+    parallel:  LLM 改写与原问题检索同时进行；改写在 RETRIEVAL_REWRITE_TIMEOUT 秒内完成时
+               再用改写结果检索并与原问题结果融合，超时则只使用原问题的结果
+    heuristic: 不调用 LLM，用术语表与节点索引在本地匹配关键词
+    cached:    同 llm，但按 (归一化问题, 回答语言, 模型) 缓存改写结果，重复提问跳过 LLM
+"""
+import asyncio
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+STRATEGY_LLM = "llm"
+STRATEGY_PARALLEL = "parallel"
+STRATEGY_HEURISTIC = "heuristic"
+STRATEGY_CACHED = "cached"
+STRATEGIES = (STRATEGY_LLM, STRATEGY_PARALLEL, STRATEGY_HEURISTIC, STRATEGY_CACHED)
+
+# 英文标识符 / 报错码（节点名、参数名、ERR_xxx 等），原样作为关键词
+_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9_]{2,}")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_strategy(value: Optional[str]) -> str:
+    """未知取值退回默认的 llm 策略"""
+    value = (value or "").strip().lower()
+    return value if value in STRATEGIES else STRATEGY_LLM
+
+
+def normalize_question(text: str) -> str:
+    """NFKC 规范化、转小写并合并空白，作为缓存键"""
+    return _WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text)).strip().lower()
+
+
+class RewriteCache:
+    """LLM 改写结果的 LRU + TTL 缓存，键为 (归一化问题, 回答语言, 模型)。线程安全。"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 86400.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Tuple[str, str, str], Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question: str, answer_language: str, model: str) -> Optional[str]:
+        if self.max_size <= 0:
+            return None
+        key = (normalize_question(question), answer_language, model)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                created_at, query = entry
+                if self.ttl <= 0 or now - created_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return query
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, question: str, answer_language: str, model: str, query: str) -> None:
+        if self.max_size <= 0:
+            return
+        key = (normalize_question(question), answer_language, model)
+        with self._lock:
+            self._data[key] = (time.monotonic(), query)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+class KeywordExtractor:
+    """
+    本地关键词提取：在问题中从左到右做最长匹配，命中词表（术语表、节点与文档标题）中的词条；
+    另外保留英文标识符与报错码。词表按首字符分桶，每个位置只比较同首字符的词条。
+    """
+
+    def __init__(self, vocabulary: Iterable[str] = ()):
+        buckets: Dict[str, List[str]] = {}
+        for term in {normalize_question(term) for term in vocabulary}:
+            if len(term) >= 2:
+                buckets.setdefault(term[0], []).append(term)
+        for terms in buckets.values():
+            terms.sort(key=len, reverse=True)
+        self._buckets = buckets
+        self.size = sum(len(terms) for terms in buckets.values())
+
+    def extract(self, message: str, limit: int = 6) -> List[str]:
+        text = normalize_question(message)
+        keywords: List[str] = []
+        i = 0
+        while i < len(text) and len(keywords) < limit:
+            for term in self._buckets.get(text[i], ()):
+                if text.startswith(term, i):
+                    keywords.append(term)
+                    i += len(term)
+                    break
+            else:
+                i += 1
+        for identifier in _IDENTIFIER_PATTERN.findall(text):
+            if len(keywords) >= limit:
+                break
+            keywords.append(identifier)
+        return list(dict.fromkeys(keywords))
+
+
+@lru_cache(maxsize=1)
+def default_keyword_extractor() -> KeywordExtractor:
+    """由术语表（translate.term_service）与知识库索引（skill.service）的标题构建，缺失的数据源跳过。"""
+    vocabulary: List[str] = []
+    try:
+        from translate import term_service
+
+        vocabulary.extend(term_service.terms("chs"))
+    except Exception as e:
+        logging.warning(f"[QueryRewrite] 术语表不可用: {e}")
+    try:
+        from skill.service import index_titles
+
+        vocabulary.extend(index_titles())
+    except Exception as e:
+        logging.warning(f"[QueryRewrite] 知识库索引不可用: {e}")
+    extractor = KeywordExtractor(vocabulary)
+    logging.info(f"[QueryRewrite] 本地关键词词表: {extractor.size} 条")
+    return extractor
+
+
+def heuristic_query(message: str, extractor: Optional[KeywordExtractor] = None) -> str:
+    """原问题 + 本地提取的关键词（与 LLM 改写结果的拼接方式一致）"""
+    keywords = (extractor or default_keyword_extractor()).extract(message)
+    return f"{message} {' '.join(keywords)}" if keywords else message
+
+
+async def aheuristic_query(message: str) -> str:
+    """异步版本：词表在线程中取得（服务启动时已预热，未预热时首次构建不阻塞事件循环）"""
+    extractor = await asyncio.to_thread(default_keyword_extractor)
+    return heuristic_query(message, extractor)
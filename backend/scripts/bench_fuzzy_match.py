@@ -0,0 +1,112 @@
+"""Benchmark the indexed fuzzy matcher against the linear _fuzzy_match scan.
+
+Uses the real knowledge base by default (derived/index.json for node titles,
+official/ for document titles and file stems). Verifies that both approaches
+return the same match sets and reports build and per-query timings.
+
+    python scripts/bench_fuzzy_match.py [--index PATH] [--official DIR] [--queries 200]
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from skill.catalog import DocumentCatalog
+from skill.fuzzy import FuzzyIndex
+from skill.service import INDEX_PATH, OFFICIAL_DIR, _fuzzy_match
+
+
+def _make_queries(titles: list[str], count: int, rng: random.Random) -> list[str]:
+    """Exact titles, prefixes, subsequences (characters dropped) and random misses."""
+    queries: list[str] = []
+    pool = [title for title in titles if title]
+    for i in range(count):
+        title = rng.choice(pool)
+        kind = i % 4
+        if kind == 0:
+            queries.append(title)
+        elif kind == 1:
+            queries.append(title[:rng.randint(1, min(4, len(title)))])
+        elif kind == 2:
+            kept = [char for char in title if rng.random() < 0.6] or [title[0]]
+            queries.append("".join(kept))
+        else:
+            queries.append("".join(rng.choice(rng.choice(pool)) for _ in range(rng.randint(2, 5))))
+    return queries
+
+
+def _bench(name: str, items: list[tuple[str, ...]], queries: list[str], repeat: int) -> None:
+    started = time.perf_counter()
+    index = FuzzyIndex(items)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    def linear(query: str) -> list[int]:
+        return [i for i, fields in enumerate(items) if any(_fuzzy_match(query, field) for field in fields)]
+
+    matches = 0
+    for query in queries:
+        expected = linear(query)
+        result = index.search(query)
+        if set(result) != set(expected):
+            raise SystemExit(f"[{name}] mismatch for query {query!r}")
+        matches += len(result)
+
+    timings = {}
+    for label, search in (("linear", linear), ("indexed", index.search)):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for query in queries:
+                search(query)
+        timings[label] = (time.perf_counter() - started) * 1e6 / (repeat * len(queries))
+
+    print(
+        f"{name}: {len(items)} entries, {len(queries)} queries, {matches / len(queries):.1f} matches/query, "
+        f"index build {build_ms:.1f} ms"
+    )
+    print(
+        f"  linear {timings['linear']:.1f} us/query, indexed {timings['indexed']:.1f} us/query "
+        f"({timings['linear'] / timings['indexed']:.1f}x); 10-name batch "
+        f"{timings['linear'] * 10 / 1000:.2f} ms -> {timings['indexed'] * 10 / 1000:.2f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark indexed fuzzy title matching")
+    parser.add_argument("--index", type=Path, default=INDEX_PATH, help="Path to derived/index.json")
+    parser.add_argument("--official", type=Path, default=OFFICIAL_DIR, help="Path to official/ docs")
+    parser.add_argument("--queries", type=int, default=200, help="Number of generated queries per corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    ran = False
+    if args.index.exists():
+        entries = json.loads(args.index.read_text(encoding="utf-8")).get("entries", [])
+        titles = [entry.get("title", "") for entry in entries if "node/" in entry.get("output_file", "")]
+        if titles:
+            _bench("nodes", [(title,) for title in titles], _make_queries(titles, args.queries, rng), args.repeat)
+            ran = True
+    else:
+        print(f"index not found: {args.index}", file=sys.stderr)
+
+    if args.official.exists():
+        docs = DocumentCatalog(args.official, args.official.parent).entries()
+        if docs:
+            items = [(doc.title, doc.stem) for doc in docs]
+            _bench("documents", items, _make_queries([doc.title for doc in docs], args.queries, rng), args.repeat)
+            ran = True
+    else:
+        print(f"official docs not found: {args.official}", file=sys.stderr)
+
+    if not ran:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Compare MCP server memory and tool latency in local and proxy mode.
+
+Local mode runs the tools in-process through skill.service, as mcp_server.py does without
+--backend-url. Proxy mode forwards them through mcp/skill_proxy.SkillProxy to a backend serving
+the Skill API, as mcp_server.py does with --backend-url. Each mode runs in its own subprocess so
+the RSS numbers are independent; the backend is started as a separate uvicorn process serving
+only the skill router, unless --backend-url points at a running one.
+
+The mcp package is not needed: both modes call the same functions the MCP tools call and return
+the same JSON text, so MCP transport overhead is not included in the latencies.
+
+    python scripts/bench_mcp_modes.py [--knowledge DIR] [--rag-db DIR] [--embedding-base-url URL]
+                                      [--similarity-threshold X] [--repeat 20] [--skip-rag] [--backend-url URL]
+
+RSS is read from /proc/<pid>/status (Linux).
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+MCP_DIR = BACKEND_DIR.parent / "mcp"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _rss_mb(pid: int | str = "self") -> float:
+    with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _configure_service(args: argparse.Namespace):
+    """Point skill.service at an alternative knowledge base / Chroma directory / embeddings API."""
+    from skill import service
+
+    if args.knowledge:
+        root = Path(args.knowledge).resolve()
+        service.KNOWLEDGE_DIR = root
+        service.DERIVED_DIR = root / "derived"
+        service.NODE_DIR = root / "derived" / "node"
+        service.INDEX_PATH = root / "derived" / "index.json"
+        service.OFFICIAL_DIR = root / "official"
+    if args.rag_db:
+        service.RAG_DB_DIR = Path(args.rag_db).resolve()
+    if args.embedding_base_url or args.similarity_threshold is not None:
+        env = dict(service._load_rag_env())
+        if args.embedding_base_url:
+            env["OPENAI_BASE_URL"] = args.embedding_base_url
+            env.setdefault("OPENAI_API_KEY", "bench")  # mocks ignore the key, but the header must not be empty
+        if args.similarity_threshold is not None:
+            env["SIMILARITY_THRESHOLD"] = str(args.similarity_threshold)
+        overridden = tuple(env.items())
+        service._load_rag_env = lambda: overridden
+    return service
+
+
+def _sample_calls(args: argparse.Namespace) -> list[tuple[str, dict]]:
+    """Node names, the largest document and a few document titles taken from the knowledge base."""
+    service = _configure_service(args)
+    node_titles = [title for title in service.index_titles() if title][:3]
+    documents = sorted(service.get_document_catalog().entries(), key=lambda entry: entry.size, reverse=True)
+    if not node_titles or not documents:
+        raise SystemExit("knowledge base has no node index or no official documents")
+    calls = [
+        ("get_node_info", {"names": node_titles}),
+        ("list_documents", {"keywords": []}),
+        ("get_document", {"titles": [documents[0].title]}),
+    ]
+    if not args.skip_rag:
+        calls.append(("rag_search", {"queries": [entry.title for entry in documents[:3]], "top_k": 5}))
+    return calls
+
+
+def _local_tools(args: argparse.Namespace) -> dict:
+    service = _configure_service(args)
+    return {
+        "get_node_info": lambda payload: service.aget_node_info_json(payload["names"]),
+        "list_documents": lambda payload: service.alist_documents_json(payload["keywords"]),
+        "get_document": lambda payload: service.aget_document_json(payload["titles"]),
+        "rag_search": lambda payload: service.arag_search_json(payload["queries"], top_k=payload["top_k"]),
+    }
+
+
+def _proxy_tools(backend_url: str):
+    sys.path.insert(0, str(MCP_DIR))
+    from skill_proxy import SkillProxy
+
+    proxy = SkillProxy(backend_url)
+
+    def dumps(result) -> str:
+        return json.dumps(result, ensure_ascii=False, indent=2)
+
+    async def call(tool: str, payload: dict) -> str:
+        return dumps(await proxy.call(tool, payload))
+
+    async def get_document(payload: dict) -> str:
+        return dumps([result async for result in proxy.iter_documents(payload["titles"])])
+
+    tools = {tool: (lambda payload, tool=tool: call(tool, payload)) for tool in ("get_node_info", "list_documents", "rag_search")}
+    tools["get_document"] = get_document
+    return tools, proxy
+
+
+def _run_worker(args: argparse.Namespace) -> None:
+    """Subprocess entry: time each tool and print one JSON line."""
+    base_rss = _rss_mb()
+    calls = json.loads(args.calls)
+    proxy = None
+    if args.worker == "local":
+        tools = _local_tools(args)
+    else:
+        tools, proxy = _proxy_tools(args.backend_url)
+
+    async def run() -> dict:
+        output = {tool: len(await tools[tool](payload)) for tool, payload in calls}  # warm-up
+        timings = {}
+        for tool, payload in calls:
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                await tools[tool](payload)
+                samples.append((time.perf_counter() - started) * 1000)
+            timings[tool] = statistics.median(samples)
+        if proxy is not None:
+            await proxy.aclose()
+        return {"output_bytes": output, "median_ms": timings}
+
+    result = asyncio.run(run())
+    result.update(base_rss_mb=base_rss, rss_mb=_rss_mb())
+    print(json.dumps(result))
+
+
+def _run_backend(args: argparse.Namespace) -> None:
+    """Subprocess entry: serve only the Skill API router."""
+    import uvicorn
+    from fastapi import FastAPI
+
+    _configure_service(args)
+    from skill.router import router
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def _forwarded(args: argparse.Namespace) -> list[str]:
+    forwarded = ["--repeat", str(args.repeat)]
+    for flag, value in (("--knowledge", args.knowledge), ("--rag-db", args.rag_db), ("--embedding-base-url", args.embedding_base_url)):
+        if value:
+            forwarded += [flag, value]
+    if args.similarity_threshold is not None:
+        forwarded += ["--similarity-threshold", str(args.similarity_threshold)]
+    return forwarded
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("backend exited during startup")
+        try:
+            if httpx.get(f"{url}/api/v1/skills", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit("backend did not become ready")
+
+
+def _worker(mode: str, args: argparse.Namespace, calls: list, backend_url: str = "") -> dict:
+    command = [sys.executable, __file__, "--worker", mode, "--calls", json.dumps(calls, ensure_ascii=False)]
+    command += _forwarded(args)
+    if backend_url:
+        command += ["--backend-url", backend_url]
+    completed = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark MCP local vs proxy mode")
+    parser.add_argument("--knowledge", help="Knowledge root with derived/ and official/ (default: repo knowledge base)")
+    parser.add_argument("--rag-db", help="Chroma directory for rag_search (default: knowledge/rag_v1/db)")
+    parser.add_argument("--embedding-base-url", help="Override OPENAI_BASE_URL of the embeddings API (e.g. a local mock)")
+    parser.add_argument("--similarity-threshold", type=float, help="Override SIMILARITY_THRESHOLD (0 keeps every hit from random mock vectors)")
+    parser.add_argument("--backend-url", default="", help="Use a running backend instead of starting one")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per tool")
+    parser.add_argument("--skip-rag", action="store_true", help="Skip rag_search (no embeddings API available)")
+    parser.add_argument("--worker", choices=["local", "proxy", "backend"], help=argparse.SUPPRESS)
+    parser.add_argument("--calls", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker == "backend":
+        _run_backend(args)
+        return
+    if args.worker:
+        _run_worker(args)
+        return
+
+    calls = _sample_calls(args)
+    local = _worker("local", args, calls)
+
+    backend = None
+    backend_url = args.backend_url
+    if not backend_url:
+        port = _free_port()
+        backend_url = f"http://127.0.0.1:{port}"
+        backend = subprocess.Popen([sys.executable, __file__, "--worker", "backend", "--port", str(port)] + _forwarded(args))
+    try:
+        if backend is not None:
+            _wait_ready(backend_url, backend)
+        proxy = _worker("proxy", args, calls, backend_url)
+        backend_rss = _rss_mb(backend.pid) if backend is not None else None
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait()
+
+    print(f"RSS after warm-up: local {local['rss_mb']:.0f} MB, proxy {proxy['rss_mb']:.0f} MB"
+          + (f", backend {backend_rss:.0f} MB" if backend_rss is not None else ""))
+    print(f"{'tool':<16}{'output':>10}{'local (ms)':>12}{'proxy (ms)':>12}")
+    for tool, _ in calls:
+        if local["output_bytes"][tool] != proxy["output_bytes"][tool]:
+            print(f"  warning: {tool} output differs between modes", file=sys.stderr)
+        print(f"{tool:<16}{local['output_bytes'][tool] // 1024:>8} KB"
+              f"{local['median_ms'][tool]:>12.1f}{proxy['median_ms'][tool]:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
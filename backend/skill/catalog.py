@@ -0,0 +1,155 @@
+"""官方文档目录
+
+list_documents / get_document 原先每次调用都遍历 official/ 并完整读取每篇文档以提取标题，耗时随文档数线性增长。
+DocumentCatalog 在首次使用时扫描一次，保存每篇文档的标题、文件名、相对路径、大小与修改时间：
+
+    刷新:   距上次扫描超过 refresh_interval 秒时重新 stat 目录下的文档（不读取内容），
+            只有大小或修改时间变化的文档重新提取标题，新增 / 删除的文档随之增删；
+            refresh_interval < 0 时只在首次使用时扫描
+    内容:   get_document 只读取匹配到的文档，按字节预算（content_budget）做 LRU 缓存，
+            文档修改后缓存的内容随之失效
+    检索:   标题与文件名的模糊匹配索引（FuzzyIndex）随目录变化重建
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from .fuzzy import FuzzyIndex
+
+_EXCLUDED_NAMES = ("readme.md", "category.md")
+
+
+@dataclass(frozen=True)
+class CatalogEntry:
+    title: str
+    stem: str
+    file: str  # 相对知识库根目录的 posix 路径
+    path: Path
+    size: int
+    mtime_ns: int
+
+
+def extract_title(md_file: Path) -> str:
+    """读取 front matter 中的 title；没有 front matter 或没有 title 时返回文件名。只读取 front matter 部分。"""
+    try:
+        with md_file.open(encoding="utf-8") as f:
+            if f.readline() != "---\n":
+                return md_file.stem
+            title = None
+            for line in f:
+                if line == "---\n":
+                    return title if title is not None else md_file.stem
+                if title is None and line.startswith("title:"):
+                    title = line.split(":", 1)[1].strip()
+    except (OSError, UnicodeDecodeError):
+        pass
+    return md_file.stem
+
+
+class DocumentCatalog:
+    """official/ 下文档的内存目录（线程安全）"""
+
+    def __init__(self, root: Path, base: Path, refresh_interval: float = 5.0, content_budget: int = 16 * 1024 * 1024):
+        self.root = root
+        self.base = base
+        self.refresh_interval = refresh_interval
+        self.content_budget = content_budget
+        self.scans = 0
+        self.title_reads = 0
+        self.content_reads = 0
+        self.content_hits = 0
+        # (按路径排序的文档, 标题索引)，整体替换，并发的 search 总是看到一致的一对
+        self._snapshot: tuple[tuple[CatalogEntry, ...], FuzzyIndex] = ((), FuzzyIndex(()))
+        self._by_path: dict[Path, CatalogEntry] = {}
+        self._scanned_at: float | None = None
+        self._lock = threading.Lock()
+        self._contents: "OrderedDict[Path, tuple[int, int, str]]" = OrderedDict()
+        self._content_bytes = 0
+        self._content_lock = threading.Lock()
+
+    def entries(self) -> tuple[CatalogEntry, ...]:
+        """按路径排序的文档列表，到期时先刷新"""
+        scanned_at = self._scanned_at
+        if scanned_at is None or (self.refresh_interval >= 0 and time.monotonic() - scanned_at >= self.refresh_interval):
+            self.refresh()
+        return self._snapshot[0]
+
+    def search(self, query: str) -> list[CatalogEntry]:
+        """标题或文件名模糊匹配 query 的文档（与 _fuzzy_match 语义一致），按匹配质量排序"""
+        self.entries()
+        entries, index = self._snapshot
+        return [entries[position] for position in index.search(query)]
+
+    def refresh(self) -> bool:
+        """重新 stat 目录下的文档，返回目录是否有变化"""
+        with self._lock:
+            previous = self._by_path
+            by_path: dict[Path, CatalogEntry] = {}
+            for md_file in sorted(self.root.rglob("*.md")):
+                if md_file.name.lower() in _EXCLUDED_NAMES:
+                    continue
+                try:
+                    stat = md_file.stat()
+                except OSError:
+                    continue
+                entry = previous.get(md_file)
+                if entry is None or entry.size != stat.st_size or entry.mtime_ns != stat.st_mtime_ns:
+                    self.title_reads += 1
+                    entry = CatalogEntry(
+                        title=extract_title(md_file),
+                        stem=md_file.stem,
+                        file=md_file.relative_to(self.base).as_posix(),
+                        path=md_file,
+                        size=stat.st_size,
+                        mtime_ns=stat.st_mtime_ns,
+                    )
+                by_path[md_file] = entry
+            changed = by_path != previous
+            self._by_path = by_path
+            if changed or self._scanned_at is None:
+                entries = tuple(by_path.values())
+                self._snapshot = (entries, FuzzyIndex((entry.title, entry.stem) for entry in entries))
+            self._scanned_at = time.monotonic()
+            self.scans += 1
+            return changed
+
+    def read(self, entry: CatalogEntry) -> str:
+        """读取文档内容（LRU 缓存，按文档大小与修改时间校验）"""
+        with self._content_lock:
+            cached = self._contents.get(entry.path)
+            if cached is not None and cached[:2] == (entry.size, entry.mtime_ns):
+                self._contents.move_to_end(entry.path)
+                self.content_hits += 1
+                return cached[2]
+
+        content = entry.path.read_text(encoding="utf-8")
+        with self._content_lock:
+            self.content_reads += 1
+            stale = self._contents.pop(entry.path, None)
+            if stale is not None:
+                self._content_bytes -= stale[0]
+            if entry.size <= self.content_budget:
+                self._contents[entry.path] = (entry.size, entry.mtime_ns, content)
+                self._content_bytes += entry.size
+                while self._content_bytes > self.content_budget:
+                    _, (size, _, _) = self._contents.popitem(last=False)
+                    self._content_bytes -= size
+        return content
+
+    def stats(self) -> dict[str, Any]:
+        with self._content_lock:
+            cached, cached_bytes = len(self._contents), self._content_bytes
+        return {
+            "documents": len(self._snapshot[0]),
+            "scans": self.scans,
+            "title_reads": self.title_reads,
+            "content_reads": self.content_reads,
+            "content_hits": self.content_hits,
+            "cached_documents": cached,
+            "cached_bytes": cached_bytes,
+            "content_budget": self.content_budget,
+        }
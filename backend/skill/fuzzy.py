@@ -0,0 +1,116 @@
+"""标题模糊匹配索引
+
+_fuzzy_match 的语义：小写后的查询是目标的子序列（子串是子序列的特例）。逐条扫描时每个查询都要遍历全部标题，
+批量查询 N 个名称就要扫描 N 遍。FuzzyIndex 预先为标题建立：
+
+    字符位置索引:  字符 -> 含该字符的条目集合，以及每个标题内各字符出现的位置列表；
+                  候选为含查询全部字符的条目交集，再用位置列表（二分查找）确认子序列
+    bigram 倒排:   二元组 -> 含该二元组的条目集合，交集后用 in 确认子串匹配
+
+匹配集合与逐条 _fuzzy_match 完全一致，结果按匹配质量排序：
+完全相同 < 前缀 < 子串 < 子序列（匹配跨度越紧凑越靠前），其次标题越短越靠前，最后保持原顺序。
+"""
+
+from bisect import bisect_right
+from typing import Iterable, Sequence
+
+_EXACT, _PREFIX, _SUBSTRING, _SUBSEQUENCE = range(4)
+
+
+def _bigrams(text: str) -> set[str]:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class FuzzyIndex:
+    """对一组条目建立模糊匹配索引，每个条目可以有多个字段（如文档标题与文件名），任一字段匹配即命中。"""
+
+    def __init__(self, items: Iterable[Sequence[str]]):
+        self._fields: list[tuple[int, str]] = []  # (条目序号, 小写字段)
+        self._positions: list[dict[str, list[int]]] = []
+        self._by_char: dict[str, set[int]] = {}
+        self._by_bigram: dict[str, set[int]] = {}
+        self.size = 0
+        for item_id, fields in enumerate(items):
+            self.size += 1
+            for field in dict.fromkeys(field.lower() for field in fields):
+                field_id = len(self._fields)
+                self._fields.append((item_id, field))
+                positions: dict[str, list[int]] = {}
+                for pos, char in enumerate(field):
+                    positions.setdefault(char, []).append(pos)
+                self._positions.append(positions)
+                for char in positions:
+                    self._by_char.setdefault(char, set()).add(field_id)
+                for bigram in _bigrams(field):
+                    self._by_bigram.setdefault(bigram, set()).add(field_id)
+
+    def _intersect(self, postings: dict[str, set[int]], keys: Iterable[str]) -> set[int]:
+        sets = []
+        for key in keys:
+            ids = postings.get(key)
+            if not ids:
+                return set()
+            sets.append(ids)
+        sets.sort(key=len)
+        result = set(sets[0])
+        for ids in sets[1:]:
+            result &= ids
+            if not result:
+                break
+        return result
+
+    def _subsequence_span(self, field_id: int, query: str) -> int | None:
+        """query 是字段子序列时返回最紧凑的匹配跨度，否则返回 None"""
+        positions = self._positions[field_id]
+        best = None
+        for start in positions[query[0]]:
+            pos = start
+            for char in query[1:]:
+                candidates = positions[char]
+                index = bisect_right(candidates, pos)
+                if index == len(candidates):
+                    return best  # 从更靠后的起点开始同样无法匹配
+                pos = candidates[index]
+            span = pos - start + 1
+            if best is None or span < best:
+                best = span
+                if best == len(query):
+                    break
+        return best
+
+    def search(self, query: str) -> list[int]:
+        """返回匹配的条目序号，按匹配质量排序"""
+        lowered = query.lower()
+        if not lowered:
+            return list(range(self.size))
+
+        scores: dict[int, tuple[int, int, int]] = {}
+
+        def record(field_id: int, score: tuple[int, int, int]) -> None:
+            item_id = self._fields[field_id][0]
+            current = scores.get(item_id)
+            if current is None or score < current:
+                scores[item_id] = score
+
+        substring_ids: set[int] = set()
+        if len(lowered) >= 2:
+            for field_id in self._intersect(self._by_bigram, _bigrams(lowered)):
+                field = self._fields[field_id][1]
+                if lowered in field:
+                    substring_ids.add(field_id)
+                    kind = _EXACT if field == lowered else _PREFIX if field.startswith(lowered) else _SUBSTRING
+                    record(field_id, (kind, 0, len(field)))
+
+        for field_id in self._intersect(self._by_char, set(lowered)):
+            if field_id in substring_ids:
+                continue
+            field = self._fields[field_id][1]
+            if len(lowered) == 1:
+                kind = _EXACT if field == lowered else _PREFIX if field.startswith(lowered) else _SUBSTRING
+                record(field_id, (kind, 0, len(field)))
+                continue
+            span = self._subsequence_span(field_id, lowered)
+            if span is not None:
+                record(field_id, (_SUBSEQUENCE, span - len(lowered), len(field)))
+
+        return sorted(scores, key=lambda item_id: (scores[item_id], item_id))
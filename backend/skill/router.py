@@ -1,17 +1,21 @@
 """Skill discovery and HTTP execution API."""
 
+import json
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from skill.service import (
     SKILL_ID,
     SKILL_VERSION,
-    get_document_data,
-    get_node_info_data,
-    list_documents_data,
-    rag_search_data,
+    aget_document_data,
+    aget_node_info_data,
+    aiter_document_data,
+    alist_documents_data,
+    arag_search_data,
+    atranslate_terms_data,
     read_skill_markdown,
-    translate_terms_data,
 )
 
 router = APIRouter()
@@ -164,28 +168,40 @@ async def get_skill(skill_id: str) -> SkillDetailResponse:
 @router.post("/skills/{skill_id}/tools/get_node_info")
 async def run_get_node_info(skill_id: str, request: GetNodeInfoRequest):
     _assert_skill(skill_id)
-    return {"success": True, "data": {"skill": skill_id, "tool": "get_node_info", "result": get_node_info_data(request.names)}, "error": None}
+    return {"success": True, "data": {"skill": skill_id, "tool": "get_node_info", "result": await aget_node_info_data(request.names)}, "error": None}
 
 
 @router.post("/skills/{skill_id}/tools/list_documents")
 async def run_list_documents(skill_id: str, request: ListDocumentsRequest):
     _assert_skill(skill_id)
-    return {"success": True, "data": {"skill": skill_id, "tool": "list_documents", "result": list_documents_data(request.keywords)}, "error": None}
+    return {"success": True, "data": {"skill": skill_id, "tool": "list_documents", "result": await alist_documents_data(request.keywords)}, "error": None}
+
+
+async def _stream_document_results(skill_id: str, titles: list[str]):
+    """每行一个与非流式响应相同的通用响应包裹；中途出错时写出一行 success=false 后结束，客户端据此区分截断"""
+    try:
+        async for result in aiter_document_data(titles):
+            yield json.dumps({"success": True, "data": {"skill": skill_id, "tool": "get_document", "result": result}, "error": None}, ensure_ascii=False) + "\n"
+    except Exception as e:
+        yield json.dumps({"success": False, "data": None, "error": {"code": "INTERNAL_ERROR", "message": str(e)}}, ensure_ascii=False) + "\n"
 
 
 @router.post("/skills/{skill_id}/tools/get_document")
-async def run_get_document(skill_id: str, request: GetDocumentRequest):
+async def run_get_document(skill_id: str, request: GetDocumentRequest, stream: bool = False):
+    """stream=true 时以 NDJSON 逐行返回每个标题的结果（每行带通用响应包裹），供 MCP 代理转发大文档"""
     _assert_skill(skill_id)
-    return {"success": True, "data": {"skill": skill_id, "tool": "get_document", "result": get_document_data(request.titles)}, "error": None}
+    if stream:
+        return StreamingResponse(_stream_document_results(skill_id, request.titles), media_type="application/x-ndjson")
+    return {"success": True, "data": {"skill": skill_id, "tool": "get_document", "result": await aget_document_data(request.titles)}, "error": None}
 
 
 @router.post("/skills/{skill_id}/tools/rag_search")
 async def run_rag_search(skill_id: str, request: RagSearchRequest):
     _assert_skill(skill_id)
-    return {"success": True, "data": {"skill": skill_id, "tool": "rag_search", "result": rag_search_data(request.queries, top_k=request.top_k)}, "error": None}
+    return {"success": True, "data": {"skill": skill_id, "tool": "rag_search", "result": await arag_search_data(request.queries, top_k=request.top_k)}, "error": None}
 
 
 @router.post("/skills/{skill_id}/tools/translate_terms")
 async def run_translate_terms(skill_id: str, request: TranslateTermsRequest):
     _assert_skill(skill_id)
-    return {"success": True, "data": {"skill": skill_id, "tool": "translate_terms", "result": translate_terms_data(request.terms, request.source_lang, request.target_lang)}, "error": None}
+    return {"success": True, "data": {"skill": skill_id, "tool": "translate_terms", "result": await atranslate_terms_data(request.terms, request.source_lang, request.target_lang)}, "error": None}
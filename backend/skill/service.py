@@ -1,13 +1,28 @@
-"""Miliastra knowledge skill shared service."""
+"""Miliastra knowledge skill shared service.
 
+同步函数供 MCP 与脚本使用；a 前缀的异步版本供 FastAPI 端点与 FunctionAgent 使用：
+磁盘扫描、Chroma 查询和进程内嵌入在有界的 skill-io 线程池中执行，嵌入 API 走共享的 httpx.AsyncClient，
+等待期间不占用事件循环，也不挤占默认线程池。
+"""
+
+import asyncio
+import functools
 import json
+import os
+import sys
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 from pathlib import Path
-from typing import TypedDict
+from typing import Any, AsyncIterator, Callable, TypedDict, TypeVar
 
 import chromadb
 import httpx
 
+from .catalog import DocumentCatalog
+from .fuzzy import FuzzyIndex
+
 TOOLBOX_DIR = Path(__file__).resolve().parent.parent.parent
 KNOWLEDGE_DIR = TOOLBOX_DIR / "knowledge" / "Miliastra-knowledge"
 DERIVED_DIR = KNOWLEDGE_DIR / "derived"
@@ -22,6 +37,19 @@ _SEPARATOR = "___"
 SKILL_ID = "miliastra-knowledge"
 SKILL_VERSION = "1.0.0"
 
+SKILL_IO_WORKERS = int(os.getenv("SKILL_IO_WORKERS", "8"))
+# 文档目录重新扫描的最短间隔（秒）与文档内容缓存的字节预算
+SKILL_CATALOG_REFRESH_INTERVAL = float(os.getenv("SKILL_CATALOG_REFRESH_INTERVAL", "5"))
+SKILL_DOC_CACHE_MB = float(os.getenv("SKILL_DOC_CACHE_MB", "16"))
+EMBEDDING_HTTP_TIMEOUT = 30.0
+
+_T = TypeVar("_T")
+_io_executor = ThreadPoolExecutor(max_workers=SKILL_IO_WORKERS, thread_name_prefix="skill-io")
+# httpx.AsyncClient 的连接池绑定创建它的事件循环，按循环各建一个
+_async_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_rag_collections: dict[str, Any] = {}
+_rag_lock = threading.Lock()
+
 
 class NodeMatch(TypedDict):
     title: str
@@ -102,6 +130,11 @@ def _load_index() -> tuple[dict[str, str], ...]:
     return tuple(entries)
 
 
+def index_titles() -> list[str]:
+    """知识库索引（derived/index.json）中全部条目的标题"""
+    return [entry.get("title", "") for entry in _load_index()]
+
+
 @lru_cache(maxsize=1)
 def _load_rag_env() -> tuple[tuple[str, str], ...]:
     pairs: list[tuple[str, str]] = []
@@ -159,33 +192,32 @@ def _parse_chunks_from_md(file_path: Path) -> dict[str, str]:
     return chunks
 
 
-def _extract_title(md_file: Path) -> str:
-    try:
-        text = md_file.read_text(encoding="utf-8")
-    except OSError:
-        return md_file.stem
-    if not text.startswith("---\n"):
-        return md_file.stem
-    parts = text.split("\n---\n", 1)
-    if len(parts) != 2:
-        return md_file.stem
-    for line in parts[0].splitlines()[1:]:
-        if line.startswith("title:"):
-            return line.split(":", 1)[1].strip()
-    return md_file.stem
+@lru_cache(maxsize=1)
+def get_document_catalog() -> DocumentCatalog:
+    """official/ 文档目录（进程内单例，首次调用时扫描）"""
+    return DocumentCatalog(
+        OFFICIAL_DIR,
+        KNOWLEDGE_DIR,
+        refresh_interval=SKILL_CATALOG_REFRESH_INTERVAL,
+        content_budget=int(SKILL_DOC_CACHE_MB * 1024 * 1024),
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_node_index() -> tuple[tuple[dict[str, str], ...], FuzzyIndex]:
+    """derived/index.json 中的节点条目及其标题的模糊匹配索引"""
+    entries = tuple(entry for entry in _load_index() if "node/" in entry.get("output_file", ""))
+    return entries, FuzzyIndex((entry.get("title", ""),) for entry in entries)
 
 
 def _lookup_node_matches(name: str) -> list[NodeMatch]:
-    entries = _load_index()
+    entries, index = _get_node_index()
     chunk_cache = _load_node_chunks()
     matched: list[NodeMatch] = []
-    for entry in entries:
+    for position in index.search(name):
+        entry = entries[position]
         output_file = entry.get("output_file", "")
         title = entry.get("title", "")
-        if "node/" not in output_file:
-            continue
-        if not _fuzzy_match(name, title):
-            continue
         md_name = Path(output_file).name
         content = chunk_cache.get(md_name, {}).get(title, "")
         matched.append({
@@ -200,19 +232,146 @@ def _lookup_node_matches(name: str) -> list[NodeMatch]:
     return matched
 
 
-def _get_query_embedding(text: str, env: dict[str, str]) -> list[float]:
+def _ensure_rag_v1_path() -> None:
+    rag_v1_dir = str(TOOLBOX_DIR / "knowledge" / "rag_v1")
+    if rag_v1_dir not in sys.path:
+        sys.path.insert(0, rag_v1_dir)
+
+
+@lru_cache(maxsize=2)
+def _get_in_process_embed_model(backend: str):
+    """EMBEDDING_BACKEND=local / stub 时使用 rag_v1 的进程内嵌入模型。
+
+    经 rag_v1 的 create_embed_model 创建，模型名、线程数、批大小、模型缓存目录等与知识库构建时
+    读取同一份配置（rag_v1/.env）。
+    """
+    _ensure_rag_v1_path()
+    from src.embedding import create_embed_model
+
+    return create_embed_model(backend)
+
+
+async def run_blocking(fn: Callable[..., _T], *args: Any, **kwargs: Any) -> _T:
+    """在 skill-io 线程池（SKILL_IO_WORKERS 个线程）中执行阻塞调用。"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_executor, functools.partial(fn, *args, **kwargs))
+
+
+@lru_cache(maxsize=1)
+def _get_http_client() -> httpx.Client:
+    return httpx.Client(timeout=EMBEDDING_HTTP_TIMEOUT)
+
+
+def _get_async_http_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(timeout=EMBEDDING_HTTP_TIMEOUT)
+        _async_http_clients[loop] = client
+    return client
+
+
+def _get_embed_model_for_env(env: dict[str, str]):
+    """EMBEDDING_BACKEND 为 local / stub 时返回进程内模型，否则返回 None（走嵌入 API）"""
+    backend = env.get("EMBEDDING_BACKEND", "openai").lower()
+    if backend not in ("local", "stub"):
+        return None
+    return _get_in_process_embed_model(backend)
+
+
+def _embedding_request(texts: list[str], env: dict[str, str]) -> dict[str, Any]:
     api_key = env.get("OPENAI_API_KEY", "")
     base_url = env.get("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
     model = env.get("EMBEDDING_MODEL", "BAAI/bge-m3")
-    response = httpx.post(
-        f"{base_url}/embeddings",
-        headers={"Authorization": f"Bearer {api_key}"},
-        json={"model": model, "input": text},
-        timeout=30.0,
-    )
+    return {
+        "url": f"{base_url}/embeddings",
+        "headers": {"Authorization": f"Bearer {api_key}"},
+        "json": {"model": model, "input": texts},
+    }
+
+
+def _parse_embedding_response(response: httpx.Response, count: int) -> list[list[float]]:
     response.raise_for_status()
-    payload = response.json()
-    return payload["data"][0]["embedding"]
+    data = response.json()["data"]
+    if len(data) != count:
+        raise ValueError(f"嵌入接口返回 {len(data)} 个向量，期望 {count} 个")
+    # OpenAI 兼容接口按 index 标注每个向量对应的输入，不保证顺序
+    data = sorted(data, key=lambda item: item.get("index", 0))
+    return [item["embedding"] for item in data]
+
+
+def _get_query_embeddings(texts: list[str], env: dict[str, str]) -> list[list[float]]:
+    """多个查询一次嵌入：嵌入 API 一次请求，进程内模型一次推理"""
+    model = _get_embed_model_for_env(env)
+    if model is not None:
+        return model.get_query_embeddings(texts)
+
+    response = _get_http_client().post(**_embedding_request(texts, env))
+    return _parse_embedding_response(response, len(texts))
+
+
+async def _aget_query_embeddings(texts: list[str], env: dict[str, str]) -> list[list[float]]:
+    model = _get_embed_model_for_env(env)
+    if model is not None:
+        return await run_blocking(model.get_query_embeddings, texts)
+
+    response = await _get_async_http_client().post(**_embedding_request(texts, env))
+    return _parse_embedding_response(response, len(texts))
+
+
+def _get_query_embedding(text: str, env: dict[str, str]) -> list[float]:
+    return _get_query_embeddings([text], env)[0]
+
+
+@lru_cache(maxsize=1)
+def _get_chroma_client():
+    return chromadb.PersistentClient(path=str(RAG_DB_DIR))
+
+
+def _resolve_rag_collection_name(collection_name: str) -> str:
+    """经 rag_v1 的集合指针解析实际集合名（强制重建完成后指针指向新集合）"""
+    _ensure_rag_v1_path()
+    from src.pointers import resolve_collection_name
+
+    return resolve_collection_name(str(RAG_DB_DIR), collection_name)
+
+
+def _get_rag_collection(collection_name: str):
+    """按实际集合名缓存句柄，指针切换后自然取到新集合"""
+    physical_name = _resolve_rag_collection_name(collection_name)
+    with _rag_lock:
+        collection = _rag_collections.get(physical_name)
+        if collection is None:
+            collection = _get_chroma_client().get_collection(physical_name)
+            _rag_collections[physical_name] = collection
+        return collection
+
+
+def _query_rag_collection(collection_name: str, embeddings: list[list[float]], top_k: int) -> dict[str, Any]:
+    """用缓存的集合句柄一次查询多个向量（结果按查询顺序分组）；知识库重建后旧句柄失效（集合不存在）时重新获取并重试一次。"""
+    def query(collection) -> dict[str, Any]:
+        return collection.query(
+            query_embeddings=embeddings,
+            n_results=top_k,
+            include=["documents", "metadatas", "distances"],
+        )
+
+    _ensure_rag_v1_path()
+    from src.chroma_errors import is_collection_not_found
+
+    collection = _get_rag_collection(collection_name)
+    try:
+        return query(collection)
+    except Exception as e:
+        # 只有集合已被删除重建（旧句柄失效）时重试；向量维度不符、参数错误等重试无济于事，原样抛出
+        if not is_collection_not_found(e):
+            raise
+        with _rag_lock:
+            for name, cached in list(_rag_collections.items()):
+                if cached is collection:
+                    del _rag_collections[name]
+    # 重试失败时异常原样抛出
+    return query(_get_rag_collection(collection_name))
 
 
 def get_node_info_data(names: list[str]) -> list[NodeQueryResult]:
@@ -230,26 +389,23 @@ def get_node_info_json(names: list[str]) -> str:
     return json.dumps(get_node_info_data(names), ensure_ascii=False, indent=2)
 
 
-def list_documents_data(keywords: list[str] | None = None) -> ListDocumentsResult | list[FilteredDocumentsResult]:
-    candidates: list[DocumentEntry] = []
-    for md_file in sorted(OFFICIAL_DIR.rglob("*.md")):
-        lower_name = md_file.name.lower()
-        if lower_name in ("readme.md", "category.md"):
-            continue
-        candidates.append({
-            "title": _extract_title(md_file),
-            "file": md_file.relative_to(KNOWLEDGE_DIR).as_posix(),
-        })
+async def aget_node_info_data(names: list[str]) -> list[NodeQueryResult]:
+    return await run_blocking(get_node_info_data, names)
+
+
+async def aget_node_info_json(names: list[str]) -> str:
+    return json.dumps(await aget_node_info_data(names), ensure_ascii=False, indent=2)
 
+
+def list_documents_data(keywords: list[str] | None = None) -> ListDocumentsResult | list[FilteredDocumentsResult]:
+    catalog = get_document_catalog()
     if not keywords:
+        candidates: list[DocumentEntry] = [{"title": entry.title, "file": entry.file} for entry in catalog.entries()]
         return {"total": len(candidates), "documents": candidates}
 
     results: list[FilteredDocumentsResult] = []
     for keyword in keywords:
-        filtered = [
-            candidate for candidate in candidates
-            if _fuzzy_match(keyword, candidate["title"]) or _fuzzy_match(keyword, Path(candidate["file"]).stem)
-        ]
+        filtered: list[DocumentEntry] = [{"title": entry.title, "file": entry.file} for entry in catalog.search(keyword)]
         results.append({"keyword": keyword, "total": len(filtered), "documents": filtered})
     return results
 
@@ -258,49 +414,55 @@ def list_documents_json(keywords: list[str] | None = None) -> str:
     return json.dumps(list_documents_data(keywords), ensure_ascii=False, indent=2)
 
 
+async def alist_documents_data(keywords: list[str] | None = None) -> ListDocumentsResult | list[FilteredDocumentsResult]:
+    return await run_blocking(list_documents_data, keywords)
+
+
+async def alist_documents_json(keywords: list[str] | None = None) -> str:
+    return json.dumps(await alist_documents_data(keywords), ensure_ascii=False, indent=2)
+
+
 def get_document_data(titles: list[str]) -> list[DocumentQueryResult]:
-    candidates: list[tuple[str, Path]] = []
-    for md_file in sorted(OFFICIAL_DIR.rglob("*.md")):
-        lower_name = md_file.name.lower()
-        if lower_name in ("readme.md", "category.md"):
-            continue
-        candidates.append((_extract_title(md_file), md_file))
+    catalog = get_document_catalog()
+    entries = catalog.entries()
 
     results: list[DocumentQueryResult] = []
     for title in titles:
         related_nodes = _lookup_node_matches(title)
-        matches: list[DocumentMatch] = []
-        for doc_title, md_file in candidates:
-            if _fuzzy_match(title, doc_title) or _fuzzy_match(title, md_file.stem):
-                matches.append({
-                    "title": doc_title,
-                    "file": md_file.relative_to(KNOWLEDGE_DIR).as_posix(),
-                    "content": md_file.read_text(encoding="utf-8"),
-                    "related_nodes": related_nodes,
-                })
-
-        if not matches:
+        matched = catalog.search(title)
+
+        if not matched:
             results.append({
                 "query": title,
                 "status": "not_found",
                 "message": f"未找到匹配「{title}」的文档",
-                "available_titles_sample": [doc_title for doc_title, _ in candidates][:30],
+                "available_titles_sample": [entry.title for entry in entries[:30]],
                 "related_nodes": related_nodes,
             })
             continue
 
-        if len(matches) > 5:
-            summaries: list[DocumentSummary] = [{"title": item["title"], "file": item["file"]} for item in matches]
+        if len(matched) > 5:
+            summaries: list[DocumentSummary] = [{"title": entry.title, "file": entry.file} for entry in matched]
             results.append({
                 "query": title,
                 "status": "too_many",
-                "message": f"匹配到 {len(matches)} 篇文档，请用更精确的关键词。",
+                "message": f"匹配到 {len(matched)} 篇文档，请用更精确的关键词。",
                 "matches": summaries,
                 "related_nodes": related_nodes,
             })
             continue
 
-        results.append({"query": title, "status": "ok", "documents": matches})
+        # 只读取最终返回的文档内容
+        documents: list[DocumentMatch] = [
+            {
+                "title": entry.title,
+                "file": entry.file,
+                "content": catalog.read(entry),
+                "related_nodes": related_nodes,
+            }
+            for entry in matched
+        ]
+        results.append({"query": title, "status": "ok", "documents": documents})
 
     return results
 
@@ -309,46 +471,63 @@ def get_document_json(titles: list[str]) -> str:
     return json.dumps(get_document_data(titles), ensure_ascii=False, indent=2)
 
 
+async def aget_document_data(titles: list[str]) -> list[DocumentQueryResult]:
+    return await run_blocking(get_document_data, titles)
+
+
+async def aget_document_json(titles: list[str]) -> str:
+    return json.dumps(await aget_document_data(titles), ensure_ascii=False, indent=2)
+
+
+async def aiter_document_data(titles: list[str]) -> AsyncIterator[DocumentQueryResult]:
+    """逐个标题产出 get_document 的结果（供流式响应：前面的文档先写出，不必等全部读完）"""
+    for title in titles:
+        yield (await aget_document_data([title]))[0]
+
+
+def _format_rag_sources(results: dict[str, Any], position: int, threshold: float) -> list[RagSearchResultItem]:
+    """取批量查询结果中第 position 个查询的命中"""
+    docs: list[str] = results["documents"][position]
+    metadatas: list[dict[str, str]] = results["metadatas"][position]
+    distances: list[float] = results["distances"][position]
+
+    sources: list[RagSearchResultItem] = []
+    for index, doc in enumerate(docs):
+        similarity = max(0.0, 1.0 - distances[index] / 2.0)
+        if similarity < threshold:
+            continue
+        metadata = metadatas[index]
+        snippet = doc[:200] + ("..." if len(doc) > 200 else "")
+        sources.append({
+            "title": metadata.get("title", metadata.get("file_name", "未知文档")),
+            "h1_title": metadata.get("h1_title", ""),
+            "file_name": metadata.get("file_name", ""),
+            "similarity": round(similarity, 4),
+            "text_snippet": snippet,
+        })
+    return sources
+
+
+def _split_rag_results(queries: list[str], results: dict[str, Any], threshold: float) -> list[RagSearchQueryResult]:
+    all_results: list[RagSearchQueryResult] = []
+    for position, query in enumerate(queries):
+        sources = _format_rag_sources(results, position, threshold)
+        all_results.append({"query": query, "total_results": len(sources), "results": sources})
+    return all_results
+
+
 def rag_search_data(queries: list[str], top_k: int = 5) -> list[RagSearchQueryResult] | RagErrorResult:
     try:
         env = dict(_load_rag_env())
         collection_name = env.get("CHROMA_COLLECTION_NAME", "docs")
         threshold = float(env.get("SIMILARITY_THRESHOLD", "0.3"))
 
-        db = chromadb.PersistentClient(path=str(RAG_DB_DIR))
-        collection = db.get_collection(collection_name)
-
-        all_results: list[RagSearchQueryResult] = []
-        for query in queries:
-            embedding = _get_query_embedding(query, env)
-            results = collection.query(
-                query_embeddings=[embedding],
-                n_results=top_k,
-                include=["documents", "metadatas", "distances"],
-            )
-
-            docs: list[str] = results["documents"][0]
-            metadatas: list[dict[str, str]] = results["metadatas"][0]
-            distances: list[float] = results["distances"][0]
-
-            sources: list[RagSearchResultItem] = []
-            for index, doc in enumerate(docs):
-                similarity = max(0.0, 1.0 - distances[index] / 2.0)
-                if similarity < threshold:
-                    continue
-                metadata = metadatas[index]
-                snippet = doc[:200] + ("..." if len(doc) > 200 else "")
-                sources.append({
-                    "title": metadata.get("title", metadata.get("file_name", "未知文档")),
-                    "h1_title": metadata.get("h1_title", ""),
-                    "file_name": metadata.get("file_name", ""),
-                    "similarity": round(similarity, 4),
-                    "text_snippet": snippet,
-                })
-
-            all_results.append({"query": query, "total_results": len(sources), "results": sources})
-
-        return all_results
+        if not queries:
+            return []
+        # 所有查询一次嵌入、一次检索，再按查询拆分结果
+        embeddings = _get_query_embeddings(queries, env)
+        results = _query_rag_collection(collection_name, embeddings, top_k)
+        return _split_rag_results(queries, results, threshold)
     except Exception as exc:
         return {"error": f"RAG 检索异常: {exc}"}
 
@@ -357,9 +536,36 @@ def rag_search_json(queries: list[str], top_k: int = 5) -> str:
     return json.dumps(rag_search_data(queries, top_k=top_k), ensure_ascii=False, indent=2)
 
 
+async def arag_search_data(queries: list[str], top_k: int = 5) -> list[RagSearchQueryResult] | RagErrorResult:
+    try:
+        env = dict(_load_rag_env())
+        collection_name = env.get("CHROMA_COLLECTION_NAME", "docs")
+        threshold = float(env.get("SIMILARITY_THRESHOLD", "0.3"))
+
+        if not queries:
+            return []
+        embeddings = await _aget_query_embeddings(queries, env)
+        results = await run_blocking(_query_rag_collection, collection_name, embeddings, top_k)
+        return _split_rag_results(queries, results, threshold)
+    except Exception as exc:
+        return {"error": f"RAG 检索异常: {exc}"}
+
+
+async def arag_search_json(queries: list[str], top_k: int = 5) -> str:
+    return json.dumps(await arag_search_data(queries, top_k=top_k), ensure_ascii=False, indent=2)
+
+
 # ── 术语翻译（委托 translate 模块）──────────────────────────────
 # 重导出以便 Skill API / MCP 与其他工具统一从 skill.service 引入。
 from translate.service import (  # noqa: E402
     translate_terms_data as translate_terms_data,
     translate_terms_json as translate_terms_json,
 )
+
+
+async def atranslate_terms_data(terms: list[str], source_lang: str, target_lang: str) -> list[dict[str, Any]]:
+    return await run_blocking(translate_terms_data, terms, source_lang, target_lang)
+
+
+async def atranslate_terms_json(terms: list[str], source_lang: str, target_lang: str) -> str:
+    return await run_blocking(translate_terms_json, terms, source_lang, target_lang)
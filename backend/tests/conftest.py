@@ -0,0 +1,30 @@
+"""
+测试公共 fixture
+"""
+import pytest
+
+from rag.chatEngine import ChatEngine
+
+
+@pytest.fixture
+def make_chat_engine(monkeypatch):
+    """通过 ChatEngine.__init__ 构建注入假检索引擎与假 LLM 的引擎。
+
+    用法: make_chat_engine(rag_engine, llm=llm, query_strategy=...)；
+    llm_factory(config) 可按请求配置创建 LLM。关键字参数覆盖 __init__ 设置的属性（须已存在）。
+    """
+    monkeypatch.delenv("ANSWER_CACHE_ENABLED", raising=False)
+    monkeypatch.delenv("RETRIEVAL_QUERY_STRATEGY", raising=False)
+
+    def make(rag_engine, llm=None, llm_factory=None, **overrides) -> ChatEngine:
+        engine = ChatEngine(rag_engine=rag_engine, tokenizer=str.split)  # 测试不依赖 tiktoken 词表
+        engine.context_prompt_template = "{context_str}"
+        engine.query_extraction_prompt = "{message}"
+        for name, value in overrides.items():
+            assert hasattr(engine, name), f"ChatEngine 没有属性 {name}"
+            setattr(engine, name, value)
+        factory = llm_factory or (lambda config: llm)
+        engine._create_llm = lambda config, log_prefix="": factory(config)
+        return engine
+
+    return make
@@ -0,0 +1,141 @@
+"""
+回答缓存测试（精确 / 语义匹配、索引版本失效、流式回放）
+
+使用假 LLM 与内存假检索引擎，无需知识库与 LLM API。
+运行命令: cd backend && python3 -m pytest tests/test_answer_cache.py -v
+"""
+import asyncio
+import json
+
+import pytest
+from llama_index.core.llms import ChatMessage, ChatResponse, MessageRole
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from rag.answer_cache import AnswerCache
+from rag.query_rewrite import STRATEGY_HEURISTIC, KeywordExtractor
+
+ANSWER = "定时器节点按固定间隔触发事件，可以配合自定义变量计数。" * 3
+
+# 问题向量：近似问题与原问题几乎同向，无关问题正交
+EMBEDDINGS = {
+    "定时器怎么用": [1.0, 0.0, 0.0],
+    "定时器如何使用": [0.99, 0.1, 0.0],
+    "商店怎么做": [0.0, 1.0, 0.0],
+}
+
+
+class CountingLLM:
+    model = "fake-model"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def achat(self, messages):
+        self.calls += 1
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=ANSWER))
+
+    async def astream_chat(self, messages):
+        self.calls += 1
+
+        async def gen():
+            for i in range(0, len(ANSWER), 10):
+                yield ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=ANSWER[:i + 10]), delta=ANSWER[i:i + 10])
+        return gen()
+
+
+class VersionedRAGEngine:
+    def __init__(self):
+        self.index_version = "v1"
+
+    def get_index_version(self):
+        return self.index_version
+
+    async def aget_query_embedding(self, question):
+        return EMBEDDINGS.get(question, [0.0, 0.0, 1.0])
+
+    async def aretrieve_nodes(self, question, filters=None, top_k=None, **kwargs):
+        return [NodeWithScore(node=TextNode(id_="n1", text="定时器", metadata={"source_dir": "guide"}), score=0.9)]
+
+
+@pytest.fixture
+def make_engine(make_chat_engine, monkeypatch):
+    monkeypatch.setattr("rag.query_rewrite.default_keyword_extractor", lambda: KeywordExtractor())
+
+    def make(similarity_threshold: float = 0.95):
+        llm = CountingLLM()
+        engine = make_chat_engine(
+            VersionedRAGEngine(),
+            llm=llm,
+            query_strategy=STRATEGY_HEURISTIC,
+            answer_cache=AnswerCache(similarity_threshold=similarity_threshold),
+        )
+        return engine, llm
+
+    return make
+
+
+def _achat(engine, message, conversation=()):
+    return asyncio.run(engine.achat(message, list(conversation), {}))
+
+
+def test_exact_and_semantic_hits(make_engine):
+    engine, llm = make_engine()
+
+    first = _achat(engine, "定时器怎么用")
+    assert llm.calls == 1 and "cache" not in first["timings"]
+
+    exact = _achat(engine, "  定时器怎么用 ")
+    assert exact["timings"]["cache"] == "exact"
+    assert exact["answer"] == first["answer"] and exact["sources"] == first["sources"]
+    assert exact["tokens"] == 0
+
+    semantic = _achat(engine, "定时器如何使用")
+    assert semantic["timings"]["cache"] == "semantic"
+    assert semantic["timings"]["cache_similarity"] >= 0.95
+
+    _achat(engine, "商店怎么做")
+    assert llm.calls == 2
+    assert engine.answer_cache.stats()["exact_hits"] == 1
+    assert engine.answer_cache.stats()["semantic_hits"] == 1
+
+
+def test_exact_only_and_uncacheable_requests(make_engine):
+    engine, llm = make_engine(similarity_threshold=1.0)
+    _achat(engine, "定时器怎么用")
+    _achat(engine, "定时器如何使用")  # 只做精确匹配
+    assert llm.calls == 2
+
+    # 带对话历史的追问不读写缓存
+    history = [{"role": "user", "content": "定时器怎么用"}, {"role": "assistant", "content": "回答"}]
+    _achat(engine, "定时器怎么用", history)
+    assert llm.calls == 3
+
+
+def test_rebuild_invalidates_cache(make_engine):
+    engine, llm = make_engine()
+    _achat(engine, "定时器怎么用")
+    engine.rag_engine.index_version = "v2"
+    assert "cache" not in _achat(engine, "定时器怎么用")["timings"]
+    assert llm.calls == 2
+    assert engine.answer_cache.stats()["index_version"] == "v2"
+
+
+def test_stream_replays_cached_answer(make_engine):
+    engine, llm = make_engine()
+
+    async def collect(message):
+        events = []
+        async for chunk in engine.chat_stream_async(message, [], {}):
+            for frame in chunk.split("\n\n"):  # 一次写出可能包含多帧
+                if frame.startswith("data: "):
+                    events.append(json.loads(frame[len("data: "):]))
+        return events
+
+    generated = asyncio.run(collect("定时器怎么用"))
+    replayed = asyncio.run(collect("定时器如何使用"))
+    assert llm.calls == 1
+    assert [e["type"] for e in replayed][:2] == ["status", "sources"]
+    assert replayed[1]["data"] == next(e["data"] for e in generated if e["type"] == "sources")
+    assert "".join(e["data"] for e in replayed if e["type"] == "token") == ANSWER
+    done = replayed[-1]
+    assert done["type"] == "done" and done["data"]["timings"]["cache"] == "semantic"
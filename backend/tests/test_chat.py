@@ -16,7 +16,7 @@ class TestChatEngine:
         engine = ChatEngine()
         assert engine.rag_engine is not None
         assert engine.rag_engine.index is not None
-        assert engine.token_counter is not None
+        assert engine.tokenizer is not None
     
     def test_chat_signature(self):
         """测试 chat 方法签名"""
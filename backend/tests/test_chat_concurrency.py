@@ -0,0 +1,143 @@
+"""
+ChatEngine 并发测试
+
+使用假 LLM（固定延迟）与内存假检索引擎，无需知识库与 LLM API。
+运行命令: cd backend && python3 -m pytest tests/test_chat_concurrency.py -v
+"""
+import asyncio
+import json
+import re
+import time
+
+import pytest
+from llama_index.core.llms import ChatMessage, ChatResponse, MessageRole
+from llama_index.core.schema import NodeWithScore, TextNode
+
+
+
+LLM_DELAY = 0.2
+
+
+class FakeLLM:
+    """每次调用固定等待 LLM_DELAY 秒；同步接口阻塞线程，异步接口只让出事件循环。
+
+    流式接口逐词输出 answer，每个词之间让出事件循环；usage 不为 None 时最后一个 chunk 携带上游用量。
+    """
+
+    def __init__(self, answer: str, usage: int = None):
+        self.answer = answer
+        self.usage = usage
+
+    def chat(self, messages):
+        time.sleep(LLM_DELAY)
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=self.answer))
+
+    async def achat(self, messages):
+        await asyncio.sleep(LLM_DELAY)
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=self.answer))
+
+    async def astream_chat(self, messages):
+        async def gen():
+            words = self.answer.split()
+            for i, word in enumerate(words):
+                await asyncio.sleep(0)
+                raw = {"usage": {"completion_tokens": self.usage}} if self.usage and i == len(words) - 1 else {}
+                yield ChatResponse(
+                    message=ChatMessage(role=MessageRole.ASSISTANT, content=" ".join(words[:i + 1])),
+                    delta=(" " if i else "") + word,
+                    raw=raw,
+                )
+        return gen()
+
+
+class FakeRAGEngine:
+    def __init__(self):
+        self.nodes = [
+            NodeWithScore(node=TextNode(id_=f"n{i}", text=f"text {i}", metadata={"source_dir": "guide"}), score=0.9)
+            for i in range(3)
+        ]
+
+    def get_query_embedding(self, question):
+        return [0.0]
+
+    async def aget_query_embedding(self, question):
+        return [0.0]
+
+    def retrieve_nodes(self, question, filters=None, top_k=None, **kwargs):
+        return self.nodes[:top_k]
+
+    async def aretrieve_nodes(self, question, filters=None, top_k=None, **kwargs):
+        return self.nodes[:top_k]
+
+
+@pytest.fixture
+def engine(make_chat_engine):
+    # 每个请求按 config 创建自己的假 LLM，回答长度与上游用量各不相同
+    return make_chat_engine(
+        FakeRAGEngine(),
+        llm_factory=lambda config: FakeLLM(config.get("answer", "小地图标识可以在节点图中设置。"), config.get("usage")),
+    )
+
+
+def test_achat_returns_same_result_as_chat(engine):
+    expected = engine.chat("小地图", [], {})
+    result = asyncio.run(engine.achat("小地图", [], {}))
+    assert set(result.pop("timings")) == set(expected.pop("timings"))
+    assert result == expected
+    assert [source["doc_id"] for source in result["sources"]] == [source["doc_id"] for source in expected["sources"]]
+
+
+def test_concurrent_achat_calls_overlap(engine):
+
+    async def run(n):
+        return await asyncio.gather(*(engine.achat(f"问题 {i}", [], {}) for i in range(n)))
+
+    started = time.perf_counter()
+    results = asyncio.run(run(10))
+    elapsed = time.perf_counter() - started
+    assert len(results) == 10
+    # 每个请求串行需要 2 * LLM_DELAY；10 个请求并发执行时总耗时应接近单个请求
+    assert elapsed < 2 * LLM_DELAY * 3
+
+
+async def _collect_done_tokens(stream) -> int:
+    tokens = None
+    async for chunk in stream:
+        for frame in chunk.split("\n\n"):  # 一次写出可能包含多帧
+            if frame.startswith("data: "):
+                event = json.loads(frame[len("data: "):])
+                assert event["type"] != "error", event
+                if event["type"] == "done":
+                    tokens = event["data"]["tokens"]
+    return tokens
+
+
+class SharedStreamLLM(FakeLLM):
+    """所有请求共用的一个 LLM 实例（与 LLMRegistry 按渠道复用实例一致）。
+
+    回答调用按 prompt 末尾的“问题 i”生成 i + 1 个词；偶数请求最后一个 chunk 携带上游用量 1000 + i。
+    """
+
+    def __init__(self):
+        super().__init__("")
+
+    async def astream_chat(self, messages):
+        i = int(re.search(r"问题 (\d+)$", messages[-1].content).group(1))
+        answer = " ".join(["词"] * (i + 1))
+        return await FakeLLM(answer, 1000 + i if i % 2 == 0 else None).astream_chat(messages)
+
+
+def test_parallel_streams_report_their_own_token_counts(make_chat_engine):
+    llm = SharedStreamLLM()
+    engine = make_chat_engine(FakeRAGEngine(), llm=llm)
+
+    async def run():
+        return await asyncio.gather(*(
+            _collect_done_tokens(engine.chat_stream_async(f"问题 {i}", [], {}))
+            for i in range(50)
+        ))
+
+    reported = asyncio.run(run())
+    # 50 个流共用同一个 LLM 实例、逐词交错输出；每个请求只统计自己的生成（上游用量或 i + 1 个词）
+    assert reported == [1000 + i if i % 2 == 0 else i + 1 for i in range(50)]
+    assert len(set(reported)) == 50
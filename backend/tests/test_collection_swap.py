@@ -0,0 +1,129 @@
+"""
+强制重建的集合替换测试（集合指针切换、旧集合延迟删除、元数据合并写入、失效句柄重试、并发检查只重新加载一次）
+
+使用临时目录中的 Chroma 集合，无需嵌入 API。
+运行命令: cd backend && python3 -m pytest tests/test_collection_swap.py -v
+"""
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+rag_v1_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "knowledge", "rag_v1"))
+if rag_v1_path not in sys.path:
+    sys.path.insert(0, rag_v1_path)
+
+from src import db
+from src.pointers import resolve_collection_name
+
+
+def _fill(persist_dir, name, node_id, metadata=None):
+    collection = db.get_client(persist_dir).get_or_create_collection(name=name, metadata=metadata)
+    collection.add(ids=[node_id], embeddings=[[1.0, 0.0]], documents=[node_id])
+    return collection
+
+
+@pytest.fixture
+def persist_dir(tmp_path):
+    yield str(tmp_path)
+    db.invalidate_collection(str(tmp_path))
+
+
+def test_swap_repoints_name_and_keeps_old_collection(persist_dir, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(db.time, "time", lambda: now[0])
+    _fill(persist_dir, "docs", "old")
+    old_handle = db.get_collection(persist_dir, "docs")
+    shadow = _fill(persist_dir, "docs__v1", "new", metadata={"owner": "guide"})
+
+    db.swap_in_collection(persist_dir, "docs", "docs__v1", "v1", grace=60)
+    # 名称立即指向新集合，中间不存在查不到正式集合的时刻
+    assert resolve_collection_name(persist_dir, "docs") == "docs__v1"
+    assert db.get_collection_id(persist_dir, "docs") == str(shadow.id)
+    assert db.get_collection(persist_dir, "docs").get()["ids"] == ["new"]
+    # 写入版本号时保留已有的元数据
+    assert db.get_index_version(persist_dir, "docs") == "v1"
+    assert db.get_client(persist_dir).get_collection("docs__v1").metadata["owner"] == "guide"
+    # 旧集合在重新加载间隔内保留，旧句柄仍可查询
+    assert old_handle.get()["ids"] == ["old"]
+    assert db.drop_retired_collections(persist_dir, "docs", grace=60) == []
+
+    now[0] += 61
+    assert db.drop_retired_collections(persist_dir, "docs", grace=60) == ["docs"]
+    assert [c.name for c in db.get_client(persist_dir).list_collections()] == ["docs__v1"]
+    assert db.get_collection(persist_dir, "docs").get()["ids"] == ["new"]
+
+
+def test_set_index_version_merges_metadata(persist_dir):
+    _fill(persist_dir, "docs", "a", metadata={"owner": "guide"})
+    db.set_index_version(persist_dir, "docs", "v2")
+    metadata = db.get_client(persist_dir).get_collection("docs").metadata
+    assert metadata["owner"] == "guide"
+    assert metadata["index_version"] == "v2"
+
+
+def test_with_collection_retries_only_stale_handles(persist_dir):
+    _fill(persist_dir, "docs", "a")
+    stale = db.get_collection(persist_dir, "docs")
+    # 其他进程删除重建后，登记的句柄失效：重新获取并重试一次
+    client = db.get_client(persist_dir)
+    client.delete_collection("docs")
+    _fill(persist_dir, "docs", "b")
+    assert db.get_collection(persist_dir, "docs") is stale
+    assert db._with_collection(persist_dir, "docs", lambda c: c.get()["ids"]) == ["b"]
+
+    calls = []
+
+    def failing(collection):
+        calls.append(collection)
+        raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError):
+        db._with_collection(persist_dir, "docs", failing)
+    assert len(calls) == 1
+
+
+def test_concurrent_reload_checks_reload_once(monkeypatch):
+    from src import rag_engine
+    from src.config import config
+
+    monkeypatch.setattr(config, "INDEX_RELOAD_INTERVAL", 30.0)
+    loads = []
+    started = threading.Barrier(4)
+
+    class Store:
+        def __init__(self, collection_id):
+            self.vector_store = SimpleNamespace(client=SimpleNamespace(id=collection_id))
+
+    def load_storage(persist_dir, name):
+        loads.append(name)
+        time.sleep(0.05)  # 重新加载较慢时，其他线程不应再次加载
+        return Store("new")
+
+    monkeypatch.setattr(rag_engine, "get_index_version", lambda persist_dir, name: "v2")
+    monkeypatch.setattr(rag_engine, "get_collection_id", lambda persist_dir, name: "new")
+    monkeypatch.setattr(rag_engine, "get_storage_context", load_storage)
+
+    engine = object.__new__(rag_engine.RAGEngine)
+    engine.storage_context = Store("old")
+    engine.index = "old-index"
+    engine._index_checked_at = time.monotonic() - 60
+    engine._reload_lock = threading.Lock()
+    engine.lexical_index = SimpleNamespace(invalidate_if_stale=lambda: None)
+    engine._load_index = lambda storage_context=None: f"index-{storage_context.vector_store.client.id}"
+
+    def check():
+        started.wait()
+        engine._reload_index_if_swapped()
+
+    threads = [threading.Thread(target=check) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert engine.index == "index-new"
+    assert engine.storage_context.vector_store.client.id == "new"
@@ -0,0 +1,114 @@
+"""
+CombinedRetriever 名额分配测试
+
+使用内存假引擎模拟 rag_engine.retrieve_nodes，无需真实知识库与嵌入 API。
+运行命令: cd backend && python3 -m pytest tests/test_combined_retriever.py -v
+"""
+import asyncio
+
+import pytest
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.vector_stores.types import FilterOperator
+
+from rag.chatEngine import CombinedRetriever, MODE_SINGLE_PASS, MODE_TWO_PHASE
+
+
+class FakeRAGEngine:
+    """按分数排序返回节点，支持 source_dir 的 IN / NIN 过滤，并记录检索次数"""
+
+    def __init__(self, source_dirs):
+        count = len(source_dirs)
+        self.nodes = [
+            NodeWithScore(
+                node=TextNode(id_=f"n{i}", text=f"text {i}", metadata={"source_dir": source_dir}),
+                score=1.0 - i / (count + 1),
+            )
+            for i, source_dir in enumerate(source_dirs)
+        ]
+        self.retrieve_calls = 0
+        self.embedding_calls = 0
+        self.hybrid_calls = 0
+
+    def get_query_embedding(self, question):
+        self.embedding_calls += 1
+        return [0.0]
+
+    def retrieve_nodes(self, question, filters=None, top_k=None, similarity_cutoff=None, query_embedding=None, hybrid=False):
+        self.retrieve_calls += 1
+        self.hybrid_calls += int(hybrid)
+        nodes = self.nodes
+        if filters is not None:
+            flt = filters.filters[0]
+            if flt.operator == FilterOperator.IN:
+                nodes = [n for n in nodes if n.metadata["source_dir"] in flt.value]
+            else:
+                nodes = [n for n in nodes if n.metadata["source_dir"] not in flt.value]
+        return nodes[:top_k]
+
+    async def aget_query_embedding(self, question):
+        return self.get_query_embedding(question)
+
+    async def aretrieve_nodes(self, question, filters=None, top_k=None, similarity_cutoff=None, query_embedding=None, hybrid=False):
+        return self.retrieve_nodes(question, filters, top_k, similarity_cutoff, query_embedding, hybrid)
+
+
+def _ids(nodes):
+    return [n.node_id for n in nodes]
+
+
+CORPORA = [
+    ["guide", "bbs", "tutorial", "user", "faq", "guide", "bbs", "user", "guide", "tutorial"] * 3,
+    ["guide"] * 20 + ["user"] * 5,
+    ["user"] * 20 + ["guide"] * 5,
+    ["bbs", "guide", "user"],
+    ["guide"] * 40,
+]
+
+
+@pytest.mark.parametrize("source_dirs", CORPORA)
+@pytest.mark.parametrize("total_k,doc_max", [(12, 8), (5, 4), (6, 0), (3, 3)])
+def test_single_pass_matches_two_phase(source_dirs, total_k, doc_max):
+    two_phase = CombinedRetriever(FakeRAGEngine(source_dirs), total_k=total_k, doc_max=doc_max, mode=MODE_TWO_PHASE)
+    single_pass = CombinedRetriever(FakeRAGEngine(source_dirs), total_k=total_k, doc_max=doc_max, mode=MODE_SINGLE_PASS)
+    assert _ids(single_pass.retrieve("q")) == _ids(two_phase.retrieve("q"))
+
+
+def test_single_pass_issues_one_query_when_quotas_fill():
+    engine = FakeRAGEngine(["guide", "bbs", "tutorial", "user"] * 10)
+    retriever = CombinedRetriever(engine, total_k=12, doc_max=8, mode=MODE_SINGLE_PASS)
+    assert len(retriever.retrieve("q")) == 12
+    assert engine.retrieve_calls == 1
+    assert engine.embedding_calls == 1
+
+
+def test_single_pass_falls_back_when_quota_unfilled():
+    # 非官方内容排在 24 名之后，超量召回取不到，需补一次过滤检索
+    engine = FakeRAGEngine(["guide"] * 30 + ["user"] * 5)
+    retriever = CombinedRetriever(engine, total_k=12, doc_max=8, mode=MODE_SINGLE_PASS, overfetch=2.0)
+    nodes = retriever.retrieve("q")
+    assert engine.retrieve_calls == 2
+    assert sum(1 for n in nodes if n.metadata["source_dir"] == "user") == 4
+
+
+def test_two_phase_issues_two_queries():
+    engine = FakeRAGEngine(["guide", "user"] * 10)
+    CombinedRetriever(engine, total_k=12, doc_max=8, mode=MODE_TWO_PHASE).retrieve("q")
+    assert engine.retrieve_calls == 2
+    assert engine.embedding_calls == 1
+
+
+@pytest.mark.parametrize("mode", [MODE_SINGLE_PASS, MODE_TWO_PHASE])
+def test_hybrid_is_passed_to_every_retrieval(mode):
+    engine = FakeRAGEngine(["guide"] * 30 + ["user"] * 5)
+    CombinedRetriever(engine, total_k=12, doc_max=8, mode=mode, hybrid=True).retrieve("q")
+    assert engine.hybrid_calls == engine.retrieve_calls > 0
+
+
+@pytest.mark.parametrize("mode", [MODE_SINGLE_PASS, MODE_TWO_PHASE])
+@pytest.mark.parametrize("source_dirs", CORPORA)
+def test_aretrieve_matches_retrieve(mode, source_dirs):
+    sync_engine, async_engine = FakeRAGEngine(source_dirs), FakeRAGEngine(source_dirs)
+    expected = CombinedRetriever(sync_engine, total_k=12, doc_max=8, mode=mode).retrieve("q")
+    nodes = asyncio.run(CombinedRetriever(async_engine, total_k=12, doc_max=8, mode=mode).aretrieve("q"))
+    assert _ids(nodes) == _ids(expected)
+    assert async_engine.retrieve_calls == sync_engine.retrieve_calls
@@ -0,0 +1,66 @@
+"""
+回答 prompt 上下文打包测试（子块合并、去重、token 预算）
+
+使用 DocumentParser 生成的真实子块，按字符计数 token，无需 tiktoken 词表。
+运行命令: cd backend && python3 -m pytest tests/test_context_packing.py -v
+"""
+import os
+import sys
+
+from llama_index.core import Document
+from llama_index.core.schema import NodeWithScore, TextNode
+
+rag_v1_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "knowledge", "rag_v1"))
+if rag_v1_path not in sys.path:
+    sys.path.insert(0, rag_v1_path)
+
+from src.parser import DocumentParser
+from rag.packing import pack_context
+
+SECTION = "# 定时器\n" + "。".join(f"第{i}句说明定时器节点的触发间隔与参数" for i in range(40)) + "。"
+
+
+def _subchunks():
+    parser = DocumentParser(chunk_size=300, chunk_overlap=60)
+    nodes = parser._create_nodes_from_chunks([SECTION], Document(text=SECTION, doc_id="timer.md"))
+    assert len(nodes) > 2
+    return [NodeWithScore(node=node, score=0.9 - i * 0.01) for i, node in enumerate(nodes)]
+
+
+def _node(node_id, text, **metadata):
+    return NodeWithScore(node=TextNode(id_=node_id, text=text, metadata=metadata), score=0.5)
+
+
+def test_adjacent_subchunks_are_merged_without_overlap():
+    subchunks = _subchunks()
+    # 检索结果顺序被打乱，另有一条无关节点排在中间
+    other = _node("other", "背包与货币与商店系统共同管理道具。")
+    nodes = [subchunks[1], other, subchunks[0]] + subchunks[2:]
+    context, stats = pack_context(nodes, list)
+
+    first, second = context.split("\n\n")
+    assert first.replace("\n", "") == SECTION.replace("\n", "")  # 重叠部分只保留一份
+    assert second == other.get_content()
+    assert stats["merged_subchunks"] == len(subchunks) - 1
+    assert stats["saved_tokens"] == stats["original_tokens"] - stats["tokens"] > 0
+
+
+def test_near_duplicate_passages_are_dropped():
+    text = "在节点图中使用【设置小地图标识】节点修改标识的显示状态，标识可以按阵营分别显示。"
+    nodes = [
+        _node("official", text),
+        _node("repost", "转载：" + text),
+        _node("different", "定时器节点按固定间隔触发事件。"),
+    ]
+    context, stats = pack_context(nodes, list)
+    assert stats["dropped_duplicates"] == 1
+    assert "转载" not in context and "定时器" in context
+
+
+def test_token_budget_truncates_in_rank_order():
+    nodes = [_node(f"n{i}", f"第{i}段" + "内容" * 100) for i in range(4)]
+    context, stats = pack_context(nodes, list, token_budget=350)
+    assert len(context) <= 350
+    assert stats["truncated"] is True
+    assert stats["passages"] == 2 and stats["dropped_over_budget"] == 2
+    assert context.startswith("第0段")
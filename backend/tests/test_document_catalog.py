@@ -0,0 +1,87 @@
+"""
+官方文档目录测试（标题提取、增量刷新、按需读取与内容缓存预算）
+
+使用临时目录中的文档，无需知识库数据。
+运行命令: cd backend && python3 -m pytest tests/test_document_catalog.py -v
+"""
+import os
+
+import pytest
+
+from skill import service
+from skill.catalog import DocumentCatalog
+
+
+def _write(path, title, body="正文"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    front = f"---\ntitle: {title}\n---\n" if title else ""
+    path.write_text(f"{front}{body}\n", encoding="utf-8")
+
+
+@pytest.fixture
+def official(tmp_path, monkeypatch):
+    official = tmp_path / "official"
+    _write(official / "guide" / "timer.md", "定时器")
+    _write(official / "guide" / "shop.md", "商店")
+    _write(official / "guide" / "README.md", "说明")
+    _write(official / "misc" / "背包.md", None)
+    for i in range(7):
+        _write(official / "nodes" / f"node{i}.md", f"节点{i}")
+    monkeypatch.setattr(service, "OFFICIAL_DIR", official)
+    monkeypatch.setattr(service, "KNOWLEDGE_DIR", tmp_path)
+    monkeypatch.setattr(service, "_lookup_node_matches", lambda name: [])
+    service.get_document_catalog.cache_clear()
+    yield official
+    service.get_document_catalog.cache_clear()
+
+
+def test_list_and_get_documents_read_only_matched_files(official):
+    listing = service.list_documents_data()
+    assert listing["total"] == 10
+    titles = [doc["title"] for doc in listing["documents"]]
+    assert titles[:3] == ["商店", "定时器", "背包"]  # README 排除，无 front matter 时用文件名
+    assert service.list_documents_data(["商店"])[0]["documents"] == [{"title": "商店", "file": "official/guide/shop.md"}]
+
+    catalog = service.get_document_catalog()
+    ok, too_many, missing = service.get_document_data(["定时器", "节点", "不存在"])
+    assert ok["status"] == "ok" and ok["documents"][0]["content"].endswith("正文\n")
+    assert too_many["status"] == "too_many" and len(too_many["matches"]) == 7
+    assert missing["status"] == "not_found"
+    # 只读取了最终返回的一篇文档；重复查询命中内容缓存，目录不重新扫描
+    assert catalog.stats()["content_reads"] == 1
+    service.get_document_data(["定时器"])
+    assert catalog.stats()["content_hits"] == 1
+    assert catalog.scans == 1
+
+
+def test_refresh_rereads_only_changed_documents(official):
+    catalog = DocumentCatalog(official, official.parent, refresh_interval=0)
+    entries = catalog.entries()
+    assert catalog.title_reads == 10
+    timer = next(entry for entry in entries if entry.stem == "timer")
+    assert catalog.read(timer).endswith("正文\n")
+
+    _write(official / "guide" / "timer.md", "计时器", body="新的正文")
+    stat = os.stat(official / "guide" / "timer.md")
+    os.utime(official / "guide" / "timer.md", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    (official / "guide" / "shop.md").unlink()
+    _write(official / "guide" / "bag.md", "背包")
+
+    entries = catalog.entries()
+    assert catalog.title_reads == 12  # 修改与新增的两篇
+    assert [entry.title for entry in entries if entry.file.startswith("official/guide")] == ["背包", "计时器"]
+    timer = next(entry for entry in entries if entry.stem == "timer")
+    assert catalog.read(timer).endswith("新的正文\n")
+    assert catalog.content_reads == 2
+
+
+def test_content_cache_respects_byte_budget(official):
+    catalog = DocumentCatalog(official, official.parent, refresh_interval=-1, content_budget=60)
+    entries = [entry for entry in catalog.entries() if entry.stem.startswith("node")]
+    for entry in entries[:3]:
+        catalog.read(entry)
+    stats = catalog.stats()
+    assert stats["cached_bytes"] <= 60
+    assert stats["cached_documents"] == 60 // entries[0].size
+    catalog.read(entries[2])  # 最近读取的仍在缓存中
+    assert catalog.content_hits == 1
@@ -0,0 +1,64 @@
+"""
+嵌入后端选择测试（stub 后端，无需网络与模型文件）
+
+运行命令: cd backend && python3 -m pytest tests/test_embedding_backends.py -v
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+rag_v1_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "knowledge", "rag_v1"))
+if rag_v1_path not in sys.path:
+    sys.path.insert(0, rag_v1_path)
+
+from src.config import config
+from src.embedding import LocalEmbedding, QueryEmbeddingCache, StubEmbedding, create_embed_model
+from skill import service
+
+
+def test_stub_backend_is_deterministic_unit_vectors():
+    model = create_embed_model("stub")
+    assert isinstance(model, StubEmbedding)
+    first = model.get_query_embedding("小地图标识")
+    assert first == create_embed_model("stub").get_query_embedding("小地图标识")
+    assert first != model.get_query_embedding("定时器")
+    assert sum(v * v for v in first) == pytest.approx(1.0)
+    batch = asyncio.run(model.aget_text_embedding_batch(["小地图标识", "定时器"]))
+    assert batch[0] == first
+
+
+def test_backend_selection():
+    assert isinstance(create_embed_model("local"), LocalEmbedding)  # 模型在首次使用时才加载
+    with pytest.raises(ValueError):
+        create_embed_model("unknown")
+
+
+def test_skill_service_uses_configured_backend():
+    embedding = service._get_query_embedding("小地图标识", {"EMBEDDING_BACKEND": "stub"})
+    assert embedding == create_embed_model("stub").get_query_embedding("小地图标识")
+    embeddings = service._get_query_embeddings(["小地图标识", "定时器"], {"EMBEDDING_BACKEND": "stub"})
+    assert embeddings[0] == embedding and len(embeddings) == 2
+
+
+def test_skill_service_local_model_uses_shared_factory(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "LOCAL_EMBED_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "EMBED_BATCH_SIZE", 7)
+    service._get_in_process_embed_model.cache_clear()
+    try:
+        model = service._get_embed_model_for_env({"EMBEDDING_BACKEND": "local"})
+    finally:
+        service._get_in_process_embed_model.cache_clear()
+    assert isinstance(model, LocalEmbedding)
+    assert model.cache_dir == str(tmp_path)
+    assert model.embed_batch_size == 7
+
+
+def test_disabled_query_cache_does_not_count_misses():
+    cache = QueryEmbeddingCache(max_size=0)
+    computed = []
+    for _ in range(3):
+        cache.get_or_compute("stub", "小地图标识", lambda: computed.append(1) or [1.0])
+    assert len(computed) == 3
+    assert cache.stats() == {"size": 0, "max_size": 0, "ttl": 3600.0, "hits": 0, "misses": 0, "hit_rate": 0.0}
@@ -0,0 +1,35 @@
+"""
+标题模糊匹配索引测试（与逐条 _fuzzy_match 的匹配集合一致、按匹配质量排序）
+
+运行命令: cd backend && python3 -m pytest tests/test_fuzzy_index.py -v
+"""
+import random
+
+from skill.fuzzy import FuzzyIndex
+from skill.service import _fuzzy_match
+
+ALPHABET = "定时器节点事件触发背包商店Ab_cD2"
+
+
+def test_matches_equal_linear_fuzzy_match():
+    rng = random.Random(7)
+    titles = ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 12))) for _ in range(300)]
+    stems = ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 6))) for _ in titles]
+    index = FuzzyIndex(zip(titles, stems))
+    queries = ["", "a", "AB", "定时", "时器触", "Ab_cD2", "不存在"]
+    queries += ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 4))) for _ in range(200)]
+    for query in queries:
+        expected = {i for i, (title, stem) in enumerate(zip(titles, stems)) if _fuzzy_match(query, title) or _fuzzy_match(query, stem)}
+        result = index.search(query)
+        assert len(result) == len(set(result))
+        assert set(result) == expected, query
+
+
+def test_results_are_ranked_by_match_quality():
+    titles = ["定时触发器组件", "获取定时器当前时间", "定时器", "定时器暂停", "定制的计时器"]
+    index = FuzzyIndex((title,) for title in titles)
+    # 完全相同 > 前缀 > 子串 > 子序列（跨度越紧凑越靠前）
+    assert [titles[i] for i in index.search("定时器")] == ["定时器", "定时器暂停", "获取定时器当前时间", "定时触发器组件", "定制的计时器"]
+    # 多个字段取最好的一个：文件名完全相同优先于标题中的子串
+    index = FuzzyIndex([("碰撞触发器说明", "collision"), ("Collision Box", "box")])
+    assert index.search("COLLISION") == [0, 1]
@@ -0,0 +1,84 @@
+"""
+BM25 词法索引与倒数排名融合测试
+
+使用临时目录中的 Chroma 集合（固定向量），无需嵌入 API。
+运行命令: cd backend && python3 -m pytest tests/test_hybrid_retrieval.py -v
+"""
+import os
+import sys
+
+import pytest
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilter, MetadataFilters
+
+rag_v1_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "knowledge", "rag_v1"))
+if rag_v1_path not in sys.path:
+    sys.path.insert(0, rag_v1_path)
+
+from src import db
+from src.hybrid import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+
+DOCS = [
+    ("n1", "guide", "小地图标识", "在节点图中使用【设置小地图标识】节点修改标识的显示状态。"),
+    ("n2", "guide", "定时器", "定时器节点按固定间隔触发事件，可配合自定义变量计数。"),
+    ("n3", "user", "报错排查", "运行时出现 ERR_NODE_GRAPH_1024 时检查节点图的输入端口。"),
+    ("n4", "bbs", "背包", "背包与货币与商店系统共同管理道具。"),
+]
+
+
+@pytest.fixture
+def collection_dir(tmp_path):
+    persist_dir = str(tmp_path)
+    collection = db.get_collection(persist_dir, "knowledge", create=True)
+    collection.add(
+        ids=[node_id for node_id, *_ in DOCS],
+        embeddings=[[float(i), 1.0] for i in range(len(DOCS))],
+        documents=[text for *_, text in DOCS],
+        metadatas=[{"source_dir": source_dir, "h1_title": title} for _, source_dir, title, _ in DOCS],
+    )
+    yield persist_dir
+    db.invalidate_collection(persist_dir)
+
+
+def test_tokenize_keeps_identifiers_and_cjk_bigrams():
+    tokens = tokenize("小地图 ERR_Node_1024，ＡＢＣ")
+    assert "err_node_1024" in tokens
+    assert "abc" in tokens  # 全角转半角
+    assert {"小", "地", "图", "小地", "地图"} <= set(tokens)
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60)
+    assert [item_id for item_id, _ in fused] == ["b", "a", "d", "c"]
+
+
+def test_exact_error_text_ranks_first(collection_dir):
+    index = LexicalIndex(collection_dir, "knowledge")
+    hits = index.search("ERR_NODE_GRAPH_1024", top_k=3)
+    assert hits[0][0] == "n3"
+    assert index.search("zzz", top_k=3) == []
+
+
+def test_filters_are_applied(collection_dir):
+    index = LexicalIndex(collection_dir, "knowledge")
+    official = MetadataFilters(filters=[MetadataFilter(key="source_dir", value=["guide"], operator=FilterOperator.IN)])
+    others = MetadataFilters(filters=[MetadataFilter(key="source_dir", value=["guide"], operator=FilterOperator.NIN)])
+    assert {node_id for node_id, _ in index.search("节点", top_k=4, filters=official)} <= {"n1", "n2"}
+    assert {node_id for node_id, _ in index.search("节点", top_k=4, filters=others)} <= {"n3", "n4"}
+    # 词法索引没有保存的字段无法过滤，交给调用方退化为纯向量检索
+    unknown = MetadataFilters(filters=[MetadataFilter(key="title", value="x", operator=FilterOperator.EQ)])
+    assert index.search("节点", top_k=4, filters=unknown) is None
+
+
+def test_index_is_persisted_and_rebuilt_when_collection_changes(collection_dir):
+    assert LexicalIndex(collection_dir, "knowledge").refresh() is True
+    assert LexicalIndex(collection_dir, "knowledge").refresh() is False  # 磁盘上的索引仍然有效
+
+    index = LexicalIndex(collection_dir, "knowledge")
+    assert index.search("定时器", top_k=2)[0][0] == "n2"
+
+    db.get_collection(collection_dir, "knowledge").add(
+        ids=["n5"], embeddings=[[9.0, 1.0]], documents=["投射运动器"], metadatas=[{"source_dir": "guide"}],
+    )
+    index.invalidate_if_stale()
+    assert index.search("投射运动器", top_k=2)[0][0] == "n5"
@@ -0,0 +1,91 @@
+"""
+LLM 实例注册表测试（只创建实例，不发起网络请求）
+
+运行命令: cd backend && python3 -m pytest tests/test_llm_registry.py -v
+"""
+import asyncio
+
+from common.llm_config import LLMRegistry
+
+
+def _config(api_key="sk-a", model="m", channel_id=0):
+    return {"api_key": api_key, "api_base_url": "https://example.com/v1", "model": model, "channel_id": channel_id}
+
+
+def test_same_config_reuses_instance():
+    registry = LLMRegistry()
+    llm = registry.get(_config())
+    assert registry.get(_config()) is llm
+    assert registry.get(_config(api_key="sk-b")) is not llm
+    assert registry.get(_config(), is_function_calling_model=True) is not llm
+    assert registry.stats()["hits"] == 1
+
+
+def test_user_entries_are_lru_capped_but_channels_are_not():
+    registry = LLMRegistry(max_user_entries=2)
+    first = registry.get(_config(api_key="sk-1"))
+    registry.get(_config(api_key="sk-2"))
+    registry.get(_config(api_key="sk-1"))  # sk-1 变为最近使用
+    registry.get(_config(api_key="sk-3"))  # 淘汰 sk-2
+    assert registry.get(_config(api_key="sk-1")) is first
+    for channel_id in range(1, 6):
+        registry.get(_config(model=f"free-{channel_id}", channel_id=channel_id))
+    stats = registry.stats()
+    assert stats["user_clients"] == 2
+    assert stats["channel_clients"] == 5
+    assert stats["evictions"] == 1
+
+
+def test_idle_user_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("common.llm_config.time.monotonic", lambda: now[0])
+    registry = LLMRegistry(idle_ttl=60)
+    llm = registry.get(_config())
+    now[0] += 30
+    assert registry.get(_config()) is llm
+    now[0] += 61
+    assert registry.get(_config()) is not llm
+
+
+def test_clients_have_explicit_timeout():
+    registry = LLMRegistry(timeout=42)
+    llm = registry.get(_config())
+    assert llm.timeout == 42
+    entry = next(iter(registry._user_entries.values()))
+    assert entry.http_client.timeout.read == 42
+    assert entry.async_http_client.timeout.read == 42
+
+
+def test_evicted_entries_are_closed_after_grace(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("common.llm_config.time.monotonic", lambda: now[0])
+    registry = LLMRegistry(max_user_entries=1, close_grace=30)
+    registry.get(_config(api_key="sk-1"))
+    evicted = next(iter(registry._user_entries.values()))
+    registry.get(_config(api_key="sk-2"))  # 淘汰 sk-1，仍可能被进行中的请求使用
+    assert not evicted.http_client.is_closed
+    assert registry.stats()["retired_clients"] == 1
+    now[0] += 31
+    registry.get(_config(api_key="sk-2"))
+    assert evicted.http_client.is_closed
+    assert registry.stats()["closed"] == 1
+
+
+def test_instances_are_per_event_loop():
+    registry = LLMRegistry()
+
+    async def get():
+        return registry.get(_config(channel_id=2))
+
+    sync_llm = registry.get(_config(channel_id=2))
+    loop = asyncio.new_event_loop()
+    first = loop.run_until_complete(get())
+    assert loop.run_until_complete(get()) is first
+    assert first is not sync_llm
+    second = asyncio.run(get())  # 另一个事件循环
+    assert second is not first
+    loop.close()
+    registry.get(_config(channel_id=2))  # 移除已关闭循环上的实例
+    assert registry.stats()["channel_clients"] == 1
+    registry.clear()
+    assert registry.stats()["channel_clients"] == 0
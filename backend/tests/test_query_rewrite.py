@@ -0,0 +1,167 @@
+"""
+检索查询生成策略测试（llm / parallel / heuristic / cached）
+
+使用假 LLM 与内存假检索引擎，无需知识库与 LLM API。
+运行命令: cd backend && python3 -m pytest tests/test_query_rewrite.py -v
+"""
+import asyncio
+import threading
+
+import pytest
+from llama_index.core.llms import ChatMessage, ChatResponse, MessageRole
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.vector_stores.types import FilterOperator
+
+from rag.query_rewrite import (
+    STRATEGY_CACHED,
+    STRATEGY_HEURISTIC,
+    STRATEGY_LLM,
+    STRATEGY_PARALLEL,
+    KeywordExtractor,
+    RewriteCache,
+    normalize_strategy,
+)
+
+
+class RewriteLLM:
+    """改写调用返回固定关键词（等待 delay 秒），回答调用立即返回；记录改写次数"""
+
+    model = "fake-model"
+
+    def __init__(self, keywords: str = "定时器 节点", delay: float = 0.0):
+        self.keywords = keywords
+        self.delay = delay
+        self.rewrite_calls = 0
+
+    async def achat(self, messages):
+        if "用户问题：" not in messages[-1].content:  # 回答请求的 prompt 以“用户问题：”结尾
+            self.rewrite_calls += 1
+            await asyncio.sleep(self.delay)
+            return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=self.keywords))
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content="回答"))
+
+
+class QueryRAGEngine:
+    """每个查询返回以查询文本命名的节点，便于断言实际使用了哪些检索查询"""
+
+    def __init__(self):
+        self.queries = []
+
+    async def aget_query_embedding(self, question):
+        return [0.0]
+
+    async def aretrieve_nodes(self, question, filters=None, top_k=None, **kwargs):
+        self.queries.append(question)
+        return [
+            NodeWithScore(node=TextNode(id_=f"{question}#{i}", text=question, metadata={"source_dir": "guide"}), score=1.0)
+            for i in range(2)
+        ][:top_k]
+
+
+@pytest.fixture
+def make_engine(make_chat_engine):
+    def make(strategy: str, llm: RewriteLLM, rewrite_timeout: float = 1.5):
+        return make_chat_engine(QueryRAGEngine(), llm=llm, query_strategy=strategy, rewrite_timeout=rewrite_timeout)
+
+    return make
+
+
+def test_keyword_extractor_prefers_longest_terms():
+    extractor = KeywordExtractor(["定时器", "自定义变量", "变量", "小地图标识", "x"])
+    assert extractor.extract("怎么用定时器修改自定义变量？报错 ERR_TIMER_01") == ["定时器", "自定义变量", "err_timer_01"]
+    assert extractor.extract("完全无关") == []
+
+
+def test_rewrite_cache_normalizes_question():
+    cache = RewriteCache(max_size=1)
+    cache.put("怎么用 定时器", "chs", "m", "q1")
+    assert cache.get("怎么用　定时器 ", "chs", "m") == "q1"  # 全角空格与首尾空白
+    assert cache.get("怎么用 定时器", "en", "m") is None
+    cache.put("另一个问题", "chs", "m", "q2")
+    assert cache.get("怎么用 定时器", "chs", "m") is None  # LRU 淘汰
+
+
+def test_disabled_rewrite_cache_does_not_count_misses():
+    cache = RewriteCache(max_size=0)
+    cache.put("怎么用定时器", "chs", "m", "q1")
+    assert cache.get("怎么用定时器", "chs", "m") is None
+    assert cache.stats() == {"size": 0, "max_size": 0, "hits": 0, "misses": 0}
+
+
+def test_unknown_strategy_falls_back_to_llm():
+    assert normalize_strategy("PARALLEL") == STRATEGY_PARALLEL
+    assert normalize_strategy("bogus") == STRATEGY_LLM
+    assert normalize_strategy(None) == STRATEGY_LLM
+
+
+def test_heuristic_strategy_skips_llm(monkeypatch, make_engine):
+    built_in = []
+
+    def extractor():
+        built_in.append(threading.current_thread())
+        return KeywordExtractor(["定时器"])
+
+    monkeypatch.setattr("rag.query_rewrite.default_keyword_extractor", extractor)
+    llm = RewriteLLM()
+    engine = make_engine(STRATEGY_HEURISTIC, llm)
+    result = asyncio.run(engine.achat("定时器怎么用", [], {}))
+    assert llm.rewrite_calls == 0
+    assert threading.main_thread() not in built_in  # 词表不在事件循环线程中构建
+    assert engine.rag_engine.queries == ["定时器怎么用 定时器"]
+    assert {"strategy", "rewrite_ms", "retrieval_ms", "generation_ms", "total_ms"} <= set(result["timings"])
+
+
+def test_cached_strategy_reuses_rewrite(make_engine):
+    llm = RewriteLLM()
+    engine = make_engine(STRATEGY_CACHED, llm)
+    first = asyncio.run(engine.achat("定时器怎么用", [], {}))
+    second = asyncio.run(engine.achat("定时器怎么用 ", [], {}))
+    assert llm.rewrite_calls == 1
+    assert first["timings"]["rewrite_cached"] is False
+    assert second["timings"]["rewrite_cached"] is True
+    assert engine.rag_engine.queries[0] == engine.rag_engine.queries[1] == "定时器怎么用 定时器 节点"
+
+
+def test_parallel_strategy_merges_raw_and_rewritten_results(make_engine):
+    engine = make_engine(STRATEGY_PARALLEL, RewriteLLM(delay=0.01))
+    result = asyncio.run(engine.achat("定时器怎么用", [], {}))
+    assert engine.rag_engine.queries == ["定时器怎么用", "定时器怎么用 定时器 节点"]
+    titles = {source["text_snippet"][:-3] for source in result["sources"]}
+    assert titles == {"定时器怎么用", "定时器怎么用 定时器 节点"}
+
+
+def test_parallel_strategy_uses_raw_results_when_rewrite_is_slow(make_engine):
+    engine = make_engine(STRATEGY_PARALLEL, RewriteLLM(delay=5.0), rewrite_timeout=0.05)
+    result = asyncio.run(engine.achat("定时器怎么用", [], {}))
+    assert engine.rag_engine.queries == ["定时器怎么用"]
+    assert result["timings"]["rewrite_timed_out"] is True
+    assert result["timings"]["total_ms"] < 1000
+
+
+class MixedSourceRAGEngine(QueryRAGEngine):
+    """每个查询返回 6 条官方文档与 3 条社区内容（官方文档相似度更高），支持 source_dir 过滤"""
+
+    async def aretrieve_nodes(self, question, filters=None, top_k=None, **kwargs):
+        self.queries.append(question)
+        nodes = [
+            NodeWithScore(node=TextNode(id_=f"{question}#{source}{i}", text=question, metadata={"source_dir": source}), score=1.0)
+            for source, count in (("guide", 6), ("bbs", 3)) for i in range(count)
+        ]
+        if filters is not None:
+            official = filters.filters[0].operator == FilterOperator.IN
+            nodes = [n for n in nodes if (n.node.metadata["source_dir"] == "guide") == official]
+        return nodes[:top_k]
+
+
+def test_parallel_strategy_keeps_source_quota(monkeypatch, make_chat_engine):
+    monkeypatch.setenv("TOP_K", "6")
+    monkeypatch.setenv("DOC_MAX", "4")
+
+    def source_mix(strategy):
+        engine = make_chat_engine(MixedSourceRAGEngine(), llm=RewriteLLM(), query_strategy=strategy)
+        nodes = asyncio.run(engine._aretrieve_with_strategy(engine._create_llm({}), "定时器怎么用", None, "zh", {}))
+        return sorted(node.node.metadata["source_dir"] for node in nodes)
+
+    # 官方文档命中数超过 DOC_MAX 时，parallel 与 llm 策略都只放入 DOC_MAX 条，其余名额留给社区内容
+    assert source_mix(STRATEGY_PARALLEL) == ["bbs", "bbs", "guide", "guide", "guide", "guide"]
+    assert source_mix(STRATEGY_PARALLEL) == source_mix(STRATEGY_LLM)
@@ -0,0 +1,151 @@
+"""
+Skill 工具异步版本测试（共享 AsyncClient、缓存的 Chroma 集合、并发会话互不阻塞）
+
+使用临时目录中的 Chroma 集合与 httpx.MockTransport 模拟的嵌入 API，无需网络。
+运行命令: cd backend && python3 -m pytest tests/test_skill_async.py -v
+"""
+import asyncio
+import json
+import time
+
+import chromadb
+import httpx
+import pytest
+from chromadb.errors import InvalidArgumentError, NotFoundError
+
+from agent.agentEngine import AGENT_TOOLS
+from skill import service
+
+EMBED_DELAY = 0.2
+
+
+@pytest.fixture
+def rag_db(tmp_path, monkeypatch):
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    collection = client.create_collection("docs")
+    collection.add(
+        ids=["n1", "n2"],
+        embeddings=[[1.0, 0.0], [0.0, 1.0]],
+        documents=["定时器节点按固定间隔触发事件。", "背包与货币与商店系统共同管理道具。"],
+        metadatas=[{"title": "定时器"}, {"title": "背包"}],
+    )
+    monkeypatch.setattr(service, "RAG_DB_DIR", tmp_path)
+    monkeypatch.setattr(service, "_load_rag_env", lambda: (
+        ("CHROMA_COLLECTION_NAME", "docs"), ("SIMILARITY_THRESHOLD", "0.3"), ("OPENAI_BASE_URL", "http://embed.test/v1"),
+    ))
+    service._get_chroma_client.cache_clear()
+    service._rag_collections.clear()
+
+    calls = []
+
+    async def handler(request):
+        texts = json.loads(request.content)["input"]
+        calls.append(texts)
+        await asyncio.sleep(EMBED_DELAY)
+        # 含“背包”的查询指向第二篇文档；倒序返回，检验按 index 还原顺序
+        data = [
+            {"index": i, "embedding": [0.0, 1.0] if "背包" in text else [1.0, 0.0]}
+            for i, text in enumerate(texts)
+        ]
+        return httpx.Response(200, json={"data": data[::-1]})
+
+    monkeypatch.setattr(service, "_get_async_http_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    yield client, calls
+    service._get_chroma_client.cache_clear()
+    service._rag_collections.clear()
+
+
+def test_agent_tools_use_native_async_functions():
+    for tool in AGENT_TOOLS:
+        assert tool.async_fn.__module__ in ("skill.service", "agent.agentEngine"), tool.metadata.name
+
+
+def test_concurrent_searches_do_not_block_each_other(rag_db):
+    async def run():
+        lags = []
+
+        async def ticker():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - started - 0.01)
+
+        tick = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        results = await asyncio.gather(*(service.arag_search_data([f"定时器 {i}"], top_k=1) for i in range(10)))
+        elapsed = time.perf_counter() - started
+        tick.cancel()
+        return results, elapsed, max(lags)
+
+    results, elapsed, max_lag = asyncio.run(run())
+    assert all(result[0]["results"][0]["title"] == "定时器" for result in results)
+    # 10 次嵌入请求并发等待，总耗时接近单次；事件循环始终可以调度其他任务
+    assert elapsed < EMBED_DELAY * 3
+    assert max_lag < 0.1
+
+
+def test_multiple_queries_share_one_embedding_request_and_query(rag_db, monkeypatch):
+    _, calls = rag_db
+    query_calls = []
+    original = service._query_rag_collection
+
+    def counting_query(collection_name, embeddings, top_k):
+        query_calls.append(len(embeddings))
+        return original(collection_name, embeddings, top_k)
+
+    monkeypatch.setattr(service, "_query_rag_collection", counting_query)
+    queries = ["定时器怎么用", "背包容量", "定时器循环"]
+    results = asyncio.run(service.arag_search_data(queries, top_k=1))
+
+    assert calls == [queries]
+    assert query_calls == [3]
+    assert [r["query"] for r in results] == queries
+    assert [r["results"][0]["title"] for r in results] == ["定时器", "背包", "定时器"]
+    assert asyncio.run(service.arag_search_data([], top_k=1)) == []
+    assert calls == [queries]
+
+
+def test_collection_handle_is_cached_and_refreshed_after_rebuild(rag_db):
+    client, _ = rag_db
+    assert asyncio.run(service.arag_search_data(["定时器"], top_k=1))[0]["total_results"] == 1
+    cached = service._rag_collections["docs"]
+    assert asyncio.run(service.arag_search_data(["定时器"], top_k=1))[0]["total_results"] == 1
+    assert service._rag_collections["docs"] is cached
+
+    # 知识库重建：集合被删除后以同名重新创建，旧句柄失效后自动重新获取
+    client.delete_collection("docs")
+    client.create_collection("docs").add(
+        ids=["n3"], embeddings=[[1.0, 0.0]], documents=["投射运动器"], metadatas=[{"title": "投射运动器"}],
+    )
+    result = asyncio.run(service.arag_search_data(["定时器"], top_k=1))
+    assert result[0]["results"][0]["title"] == "投射运动器"
+    assert service._rag_collections["docs"] is not cached
+
+
+def test_query_failure_after_retry_raises_original_error(monkeypatch):
+    class StaleCollection:
+        def query(self, **kwargs):
+            raise NotFoundError("Collection [docs] does not exist")
+
+    fetched = []
+    monkeypatch.setattr(service, "_get_rag_collection", lambda name: fetched.append(name) or StaleCollection())
+    with pytest.raises(NotFoundError):
+        service._query_rag_collection("docs", [[1.0, 0.0]], 1)
+    assert fetched == ["docs", "docs"]
+
+
+def test_query_is_not_retried_on_other_errors(monkeypatch):
+    calls = []
+
+    class MismatchedCollection:
+        def query(self, **kwargs):
+            calls.append(kwargs)
+            raise InvalidArgumentError("Collection expecting embedding with dimension of 2, got 3")
+
+    collection = MismatchedCollection()
+    monkeypatch.setattr(service, "_get_rag_collection", lambda name: collection)
+    monkeypatch.setitem(service._rag_collections, "docs", collection)
+    with pytest.raises(InvalidArgumentError):
+        service._query_rag_collection("docs", [[1.0, 0.0, 0.0]], 1)
+    assert len(calls) == 1
+    assert service._rag_collections["docs"] is collection  # 句柄仍有效，不丢弃
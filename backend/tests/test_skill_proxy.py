@@ -0,0 +1,99 @@
+"""
+MCP 代理模式测试（SkillProxy 经 Skill API 转发的结果与本地调用一致，get_document 走 NDJSON 流式响应，出错或截断时抛出而不是返回不完整的列表）
+
+使用临时目录中的文档与 httpx.ASGITransport，无需启动服务。
+运行命令: cd backend && python3 -m pytest tests/test_skill_proxy.py -v
+"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from skill import router as router_module
+from skill import service
+from skill.router import router
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "mcp"))
+from skill_proxy import SkillProxy, SkillProxyError  # noqa: E402
+
+
+@pytest.fixture
+def proxy(tmp_path, monkeypatch):
+    official = tmp_path / "official" / "guide"
+    official.mkdir(parents=True)
+    for name, title in (("timer", "定时器"), ("shop", "商店")):
+        (official / f"{name}.md").write_text(f"---\ntitle: {title}\n---\n{title}正文" * 50, encoding="utf-8")
+    monkeypatch.setattr(service, "OFFICIAL_DIR", tmp_path / "official")
+    monkeypatch.setattr(service, "KNOWLEDGE_DIR", tmp_path)
+    monkeypatch.setattr(service, "_lookup_node_matches", lambda name: [])
+    service.get_document_catalog.cache_clear()
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+    proxy = SkillProxy("http://backend.test")
+    proxy._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=proxy.base_url)
+    yield proxy
+    service.get_document_catalog.cache_clear()
+
+
+def test_proxy_results_match_local_service(proxy):
+    async def run():
+        documents = [result async for result in proxy.iter_documents(["定时器", "商店", "不存在"])]
+        listing = await proxy.call("list_documents", {"keywords": ["商店"]})
+        with pytest.raises(SkillProxyError):
+            await proxy.call("get_document", {"titles": []})  # 请求校验失败（422）
+        await proxy.aclose()
+        return documents, listing
+
+    documents, listing = asyncio.run(run())
+    assert json.dumps(documents) == json.dumps(service.get_document_data(["定时器", "商店", "不存在"]))
+    assert [result["status"] for result in documents] == ["ok", "ok", "not_found"]
+    assert listing == service.list_documents_data(["商店"])
+
+
+def test_stream_lines_keep_envelope(proxy):
+    async def run():
+        async with proxy._get_client().stream(
+            "POST", "/api/v1/skills/miliastra-knowledge/tools/get_document", params={"stream": "true"}, json={"titles": ["定时器"]},
+        ) as response:
+            return [json.loads(line) async for line in response.aiter_lines() if line]
+
+    lines = asyncio.run(run())
+    assert lines == [{"success": True, "data": {"skill": "miliastra-knowledge", "tool": "get_document", "result": service.get_document_data(["定时器"])[0]}, "error": None}]
+
+
+def test_mid_stream_failure_raises(proxy, monkeypatch):
+    async def failing(titles):
+        yield (await service.aget_document_data(titles[:1]))[0]
+        raise OSError("磁盘错误")
+
+    monkeypatch.setattr(router_module, "aiter_document_data", failing)
+
+    async def run():
+        received = []
+        with pytest.raises(SkillProxyError, match="磁盘错误"):
+            async for result in proxy.iter_documents(["定时器", "商店"]):
+                received.append(result)
+        await proxy.aclose()
+        return received
+
+    assert [result["status"] for result in asyncio.run(run())] == ["ok"]
+
+
+def test_truncated_stream_raises(proxy, monkeypatch):
+    async def truncated(titles):
+        yield (await service.aget_document_data(titles[:1]))[0]
+
+    monkeypatch.setattr(router_module, "aiter_document_data", truncated)
+
+    async def run():
+        with pytest.raises(SkillProxyError, match="截断"):
+            async for _ in proxy.iter_documents(["定时器", "商店"]):
+                pass
+        await proxy.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,66 @@
+"""
+SSE 写出器测试（帧格式、token 合并、时间窗口 flush）
+
+运行命令: cd backend && python3 -m pytest tests/test_sse.py -v
+"""
+import asyncio
+import json
+
+from common.sse import SSEWriter, sse_event
+
+
+def _events(chunks):
+    events = []
+    for chunk in chunks:
+        for frame in chunk.split("\n\n"):
+            if frame.startswith("data: "):
+                events.append(json.loads(frame[len("data: "):]))
+    return events
+
+
+def test_frames_match_json_dumps():
+    writer = SSEWriter(interval_ms=0)
+    text = '引号"与\\换行\n'
+    assert writer.delta("token", text) == sse_event("token", text)
+    assert sse_event("token", text) == f"data: {json.dumps({'type': 'token', 'data': text}, ensure_ascii=False)}\n\n"
+
+
+def test_deltas_are_coalesced_in_order():
+    writer = SSEWriter(interval_ms=10_000, max_chars=8)
+    chunks = [writer.delta("token", ch) for ch in "一二三"]
+    chunks.append(writer.delta("reasoning", "想"))  # 类型切换，写出之前的 token
+    chunks += [writer.delta("token", ch) for ch in "四五六七八九十"]  # 累计 8 个字符时写出
+    chunks.append(writer.comment("generating"))
+    chunks.append(writer.event("done", {"tokens": 10}))
+    written = [chunk for chunk in chunks if chunk]
+
+    assert [(e["type"], e["data"]) for e in _events(written)] == [
+        ("token", "一二三"), ("reasoning", "想"), ("token", "四五六七八九十"), ("done", {"tokens": 10}),
+    ]
+    # 11 个增量 + 心跳 + done 共 4 次写入，心跳与缓冲的 token 在同一次写入中
+    assert writer.writes == len(written) == 4
+    assert written[2].startswith('data: {"type": "token", "data": "四五六七八九十"}') and ": generating" in written[2]
+
+
+def test_paced_flushes_buffer_while_upstream_stalls():
+    async def upstream():
+        yield "快"
+        await asyncio.sleep(0.2)  # 上游停顿，缓冲的增量不应等到下一个 token
+        yield "慢"
+
+    async def run():
+        writer = SSEWriter(interval_ms=20)
+        written = []
+        started = asyncio.get_running_loop().time()
+        async for delta in writer.paced(upstream()):
+            chunk = writer.flush() if delta is None else writer.delta("token", delta)
+            if chunk:
+                written.append((asyncio.get_running_loop().time() - started, chunk))
+        written.append((None, writer.flush()))
+        return written
+
+    written = asyncio.run(run())
+    first_at, first = written[0]
+    assert _events([first]) == [{"type": "token", "data": "快"}]
+    assert first_at < 0.15
+    assert [e["data"] for e in _events(chunk for _, chunk in written)] == ["快", "慢"]
@@ -35,6 +35,10 @@ class TermService:
     def is_available(self) -> bool:
         return self._available
 
+    def terms(self, lang: str = "chs") -> list[str]:
+        """All non-empty terms of one language column (empty when unavailable)."""
+        return [term for term in self._term_lists.get(lang.lower(), []) if term]
+
     def initialise(self, csv_path: str, db_path: str | None = None) -> None:
         """Build (if needed) and open the SQLite DB, then load term indexes."""
         try:
@@ -31,15 +31,22 @@ class RAGAPI:
     def init_knowledge_base(
         self,
         force_rebuild: bool = False,
-        source_directories: Optional[List[str]] = None
+        source_directories: Optional[List[str]] = None,
+        resume: bool = True
     ) -> Dict[str, Any]:
         """
         初始化或重建知识库。
+
+        Args:
+            force_rebuild: 是否在影子集合中全量重建
+            source_directories: 覆盖默认知识源目录
+            resume: 是否从上次未完成的强制重建继续
         """
         try:
             result = self.rag_engine.build_knowledge_base(
                 force_rebuild=force_rebuild,
-                source_directories=source_directories
+                source_directories=source_directories,
+                resume=resume
             )
             return {"success": True, "data": result}
         except Exception as e:
@@ -149,6 +156,32 @@ class RAGAPI:
             self.logger.error(f"嵌入文档失败: {e}", exc_info=True)
             return {"success": False, "message": str(e)}
 
+    def get_embedding_cache_stats(self) -> Dict[str, Any]:
+        """
+        获取文档块向量磁盘缓存的统计信息。
+        """
+        try:
+            return {"success": True, "data": self.rag_engine.embedding_cache.stats()}
+        except Exception as e:
+            self.logger.error(f"获取嵌入缓存状态失败: {e}", exc_info=True)
+            return {"success": False, "message": str(e)}
+
+    def prune_embedding_cache(self, max_mb: Optional[float] = None, clear: bool = False) -> Dict[str, Any]:
+        """
+        清理文档块向量磁盘缓存。
+
+        Args:
+            max_mb: 淘汰最久未使用的条目直到不超过该大小（MB），默认使用 EMBED_CACHE_MAX_MB
+            clear: 是否清空全部缓存
+        """
+        try:
+            max_bytes = int(max_mb * 1024 * 1024) if max_mb is not None else None
+            result = self.rag_engine.embedding_cache.prune(max_bytes=max_bytes, clear=clear)
+            return {"success": True, "data": result}
+        except Exception as e:
+            self.logger.error(f"清理嵌入缓存失败: {e}", exc_info=True)
+            return {"success": False, "message": str(e)}
+
 _api_instance: Optional[RAGAPI] = None
 
 def get_rag_api() -> RAGAPI:
@@ -0,0 +1,20 @@
+"""
+chromadb 异常判断
+
+只依赖 chromadb，backend 的 skill.service / MCP Server 与 db.py 共用同一判断：
+只有集合不存在（含句柄指向的集合已被删除重建）时才值得重新获取句柄重试。
+"""
+import chromadb.errors
+
+# 集合不存在 / 句柄指向的集合已被删除时 chromadb 抛出的异常（不同版本类型不同）
+_NOT_FOUND_ERRORS = tuple(
+    error for error in (getattr(chromadb.errors, name, None) for name in ("NotFoundError", "InvalidCollectionException"))
+    if isinstance(error, type)
+)
+
+
+def is_collection_not_found(error: Exception) -> bool:
+    """异常是否表示集合不存在（含句柄指向的集合已被删除）；旧版 chromadb 抛出带 "does not exist" 的 ValueError。"""
+    if _NOT_FOUND_ERRORS and isinstance(error, _NOT_FOUND_ERRORS):
+        return True
+    return isinstance(error, ValueError) and "does not exist" in str(error)
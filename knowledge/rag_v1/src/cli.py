@@ -45,12 +45,13 @@ def cli():
     pass
 
 @cli.command()
-@click.option('--force', '-f', is_flag=True, help='清空集合并重新嵌入所有文档')
+@click.option('--force', '-f', is_flag=True, help='在影子集合中重新嵌入所有文档，完成后替换正式集合')
 @click.option('--source-dirs', '-d', multiple=True, help='指定要处理的源目录，可多次使用')
-def init(force, source_dirs):
-    """初始化或更新知识库（支持增量更新）"""
+@click.option('--no-resume', is_flag=True, help='丢弃上次未完成的强制重建，重新开始')
+def init(force, source_dirs, no_resume):
+    """初始化或更新知识库（支持增量更新与断点续建）"""
     if force:
-        click.echo("🚀 强制模式：将清空集合并重新嵌入所有文档...")
+        click.echo("🚀 强制模式：将在影子集合中重新嵌入所有文档，完成后替换正式集合...")
     else:
         click.echo("🚀 开始处理知识库（增量模式）...")
     
@@ -60,24 +61,31 @@ def init(force, source_dirs):
     
     result = api.init_knowledge_base(
         force_rebuild=force,
-        source_directories=source_directories
+        source_directories=source_directories,
+        resume=not no_resume
     )
 
     if result["success"]:
         data = result.get('data', {})
         summary = data.get('summary', {})
         
-        click.echo("\n✅ 知识库处理完成!")
+        if data.get('status') == 'incomplete':
+            click.echo("\n⚠️  强制重建未完成：部分文档嵌入失败，正式集合保持不变。重新运行 init 将从断点继续。")
+        else:
+            click.echo("\n✅ 知识库处理完成!")
         click.echo(f"\n📊 处理摘要:")
         click.echo(f"  - 总文档数: {summary.get('total_documents', 0)}")
         click.echo(f"  - 已处理: {summary.get('processed', 0)}")
         click.echo(f"  - 已更新: {summary.get('updated', 0)}")
         click.echo(f"  - 已跳过: {summary.get('skipped', 0)}")
+        click.echo(f"  - 已删除: {summary.get('deleted', 0)}")
         click.echo(f"  - 失败: {summary.get('errors', 0)}")
+        click.echo(f"  - 节点嵌入 / 复用: {summary.get('embedded_nodes', 0)} / {summary.get('reused_nodes', 0)}（嵌入缓存命中 {summary.get('cache_hits', 0)}）")
         
         stats = data.get('stats', {})
         click.echo(f"\n📈 知识库状态:")
         click.echo(f"  - 总节点数: {stats.get('total_documents', 0)}")
+        click.echo(f"  - 索引版本: {data.get('index_version') or 'N/A'}")
     else:
         click.echo(f"❌ 处理失败: {result.get('message', '未知错误')}")
         sys.exit(1)
@@ -204,5 +212,44 @@ def embed(doc_path, force):
         click.echo(f"❌ 处理失败: {data.get('message', '未知错误')}")
         sys.exit(1)
 
+@cli.group()
+def cache():
+    """文档块向量磁盘缓存管理"""
+    pass
+
+@cache.command('stats')
+def cache_stats():
+    """查看嵌入缓存大小与命中率"""
+    api = get_rag_api()
+    result = api.get_embedding_cache_stats()
+
+    if not result.get("success"):
+        click.echo(f"❌ 获取缓存状态失败: {result.get('message', '未知错误')}")
+        sys.exit(1)
+
+    data = result.get("data", {})
+    click.echo("📦 嵌入缓存:")
+    click.echo(f"  - 路径: {data.get('path', 'N/A')}")
+    click.echo(f"  - 条目数: {data.get('entries', 0)}")
+    click.echo(f"  - 大小: {data.get('size_bytes', 0) / 1024 / 1024:.1f} MB / {data.get('max_bytes', 0) / 1024 / 1024:.0f} MB")
+    click.echo(f"  - 命中 / 未命中: {data.get('hits', 0)} / {data.get('misses', 0)}（命中率 {data.get('hit_rate', 0.0):.1%}）")
+    for model, count in data.get("models", {}).items():
+        click.echo(f"  - 模型 {model}: {count} 条")
+
+@cache.command('prune')
+@click.option('--max-mb', type=float, default=None, help='淘汰最久未使用的条目直到不超过该大小（默认使用 EMBED_CACHE_MAX_MB）')
+@click.option('--clear', is_flag=True, help='清空全部缓存')
+def cache_prune(max_mb, clear):
+    """清理嵌入缓存"""
+    api = get_rag_api()
+    result = api.prune_embedding_cache(max_mb=max_mb, clear=clear)
+
+    if not result.get("success"):
+        click.echo(f"❌ 清理缓存失败: {result.get('message', '未知错误')}")
+        sys.exit(1)
+
+    data = result.get("data", {})
+    click.echo(f"🧹 已删除 {data.get('removed', 0)} 条，剩余 {data.get('size_bytes', 0) / 1024 / 1024:.1f} MB")
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -28,9 +28,37 @@ class Config:
     MAX_CHUNK_SIZE: int = int(os.getenv("MAX_CHUNK_SIZE", "2048"))  # 增大chunk_size以保持一级标题内容完整性
     CHUNK_OVERLAP: int = int(os.getenv("CHUNK_OVERLAP", "200"))  # 增加重叠以保持上下文连贯性
     USE_H1_ONLY: bool = os.getenv("USE_H1_ONLY", "True").lower() == "true"  # 只按一级标题分块
+    PARSE_WORKERS: int = int(os.getenv("PARSE_WORKERS", "1"))  # 构建时解析分块的进程数，1 表示在主进程中串行解析
+
+    # 查询向量缓存（LRU + TTL），键为 (嵌入模型, 归一化查询文本)
+    QUERY_EMBED_CACHE_SIZE: int = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "1024"))  # 最大条目数，0 表示禁用
+    QUERY_EMBED_CACHE_TTL: float = float(os.getenv("QUERY_EMBED_CACHE_TTL", "3600"))  # 过期秒数，0 表示不过期
+
+    # 构建时的批量嵌入：跨文档凑满 EMBED_BATCH_SIZE 条文本为一个请求，最多 EMBED_CONCURRENCY 个请求同时在途
+    EMBED_BATCH_SIZE: int = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+    EMBED_CONCURRENCY: int = int(os.getenv("EMBED_CONCURRENCY", "4"))
+    # 文档块向量的磁盘缓存（SQLite，位于 KNOWLEDGE_BASE_PATH 下），超出上限按最近使用时间淘汰，0 表示禁用
+    EMBED_CACHE_MAX_MB: int = int(os.getenv("EMBED_CACHE_MAX_MB", "512"))
+
+    # 混合检索（retrieve_nodes(hybrid=True)）：向量与 BM25 各取的候选数、倒数排名融合常数
+    HYBRID_CANDIDATES: int = int(os.getenv("HYBRID_CANDIDATES", "30"))
+    HYBRID_RRF_K: int = int(os.getenv("HYBRID_RRF_K", "60"))
+
+    # 异步检索（aretrieve_nodes）执行 Chroma 查询与 BM25 检索的专用线程数，不占用事件循环的默认线程池
+    RETRIEVAL_EXECUTOR_WORKERS: int = int(os.getenv("RETRIEVAL_EXECUTOR_WORKERS", "4"))
+
+    # 服务进程检查正式集合是否被强制重建替换的间隔（秒），0 表示不检查
+    INDEX_RELOAD_INTERVAL: float = float(os.getenv("INDEX_RELOAD_INTERVAL", "30"))
 
     # 模型配置
     EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "BAAI/bge-m3")  # 嵌入模型，默认BAAI/bge-m3
+    # 嵌入后端：openai（远端接口，使用 EMBEDDING_MODEL）/ local（进程内 CPU 模型）/ stub（确定性哈希向量，测试用）
+    # 切换后端后需要 init --force 重建知识库
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "openai")
+    LOCAL_EMBEDDING_MODEL: str = os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-zh-v1.5")  # fastembed 支持的模型名
+    LOCAL_EMBED_THREADS: int = int(os.getenv("LOCAL_EMBED_THREADS", "4"))  # 本地模型异步推理线程池大小
+    LOCAL_EMBED_CACHE_DIR: str = os.getenv("LOCAL_EMBED_CACHE_DIR", "")  # 模型文件缓存目录，留空使用 fastembed 默认目录
+    STUB_EMBED_DIM: int = int(os.getenv("STUB_EMBED_DIM", "64"))
     CHAT_MODEL: str = os.getenv("CHAT_MODEL", "gpt-3.5-turbo")  # 对话模型，默认gpt-3.5-turbo
     
     # 文档路径配置 - 指向 Miliastra-knowledge 子目录
@@ -58,6 +86,7 @@ class Config:
     ]
     
     KNOWLEDGE_BASE_PATH: str = os.path.join(os.path.dirname(__file__), "..", "db")
+    EMBED_CACHE_FILENAME: str = "embedding_cache.sqlite3"
     
     @classmethod
     def validate(cls) -> bool:
@@ -1,28 +1,107 @@
 """
 知识库存储模块。
+
+进程内复用 Chroma 客户端与集合句柄（按持久化目录 + 实际集合名登记），避免增量构建时
+每次调用都重新打开 SQLite / HNSW；clear_collection 删除集合后会显式失效对应句柄。
+
+传入的集合名称先经集合指针（见 pointers.py）解析为实际的 Chroma 集合，强制重建完成后
+swap_in_collection 只替换指针，不改名集合。
 """
-from typing import Optional
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 import chromadb
+from chromadb.api import ClientAPI
+from chromadb.api.models.Collection import Collection
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.core import StorageContext, VectorStoreIndex, Settings
 from llama_index.core.embeddings import BaseEmbedding
 
+from .chroma_errors import is_collection_not_found
 from .config import config
+from .pointers import read_pointers, resolve_collection_name, write_pointers
+
+_registry_lock = threading.RLock()
+_clients: Dict[str, ClientAPI] = {}
+_collections: Dict[Tuple[str, str], Collection] = {}
+
+
+def _registry_key(persist_dir: str) -> str:
+    return os.path.abspath(persist_dir)
+
+
+def get_client(persist_dir: str) -> ClientAPI:
+    """获取指定目录的进程级共享 Chroma 客户端。"""
+    key = _registry_key(persist_dir)
+    with _registry_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = chromadb.PersistentClient(path=persist_dir)
+            _clients[key] = client
+        return client
+
+
+def get_collection(persist_dir: str, collection_name: str, create: bool = False) -> Collection:
+    """
+    获取共享的集合句柄。
+
+    Args:
+        persist_dir: 数据库目录
+        collection_name: 集合名称
+        create: 集合不存在时是否创建；为 False 时集合不存在会抛出异常
+    """
+    physical_name = resolve_collection_name(persist_dir, collection_name)
+    key = (_registry_key(persist_dir), physical_name)
+    with _registry_lock:
+        collection = _collections.get(key)
+        if collection is None:
+            client = get_client(persist_dir)
+            if create:
+                collection = client.get_or_create_collection(name=physical_name)
+            else:
+                collection = client.get_collection(name=physical_name)
+            _collections[key] = collection
+        return collection
+
+
+def invalidate_collection(persist_dir: str, collection_name: Optional[str] = None) -> None:
+    """
+    使已登记的集合句柄失效（集合被删除或重建后调用）。
+
+    collection_name 为 None 时失效该目录下的全部集合句柄；否则同时失效该名称当前指向的实际集合。
+    """
+    path_key = _registry_key(persist_dir)
+    names = None if collection_name is None else {collection_name, resolve_collection_name(persist_dir, collection_name)}
+    with _registry_lock:
+        for key in list(_collections):
+            if key[0] == path_key and (names is None or key[1] in names):
+                del _collections[key]
+
+
+def _with_collection(persist_dir: str, collection_name: str, fn: Callable[[Collection], Any], create: bool = False) -> Any:
+    """
+    使用共享句柄执行集合操作。
+
+    若句柄已失效（集合被其他进程删除重建），失效登记后重新获取并重试一次；其他异常（参数错误、
+    磁盘错误等）直接抛出，不重复执行可能有副作用的操作。
+    """
+    collection = get_collection(persist_dir, collection_name, create=create)
+    try:
+        return fn(collection)
+    except Exception as e:
+        if not is_collection_not_found(e):
+            raise
+    invalidate_collection(persist_dir, collection_name)
+    return fn(get_collection(persist_dir, collection_name, create=create))
+
 
 def get_storage_context(persist_dir: str, collection_name: str) -> StorageContext:
     """
     获取或创建StorageContext。
     确保collection在使用前已正确创建。
     """
-    db = chromadb.PersistentClient(path=persist_dir)
-    
-    # 先尝试获取collection，如果不存在则创建
-    try:
-        chroma_collection = db.get_collection(collection_name)
-    except Exception:
-        # Collection不存在，创建新的
-        chroma_collection = db.create_collection(collection_name)
-    
+    chroma_collection = get_collection(persist_dir, collection_name, create=True)
     vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
     return StorageContext.from_defaults(vector_store=vector_store)
 
@@ -56,21 +135,21 @@ def get_vector_store_index(
 
 def clear_collection(persist_dir: str, collection_name: str):
     """
-    清空指定的集合。
+    清空指定的集合（删除名称当前指向的实际集合）。
     """
-    db = chromadb.PersistentClient(path=persist_dir)
-    # 这将删除集合及其所有数据
-    db.delete_collection(name=collection_name)
+    try:
+        # 这将删除集合及其所有数据
+        get_client(persist_dir).delete_collection(name=resolve_collection_name(persist_dir, collection_name))
+    finally:
+        invalidate_collection(persist_dir, collection_name)
 
 def get_collection_stats(persist_dir: str, collection_name: str) -> dict:
     """
     获取集合的统计信息。
     """
     try:
-        db = chromadb.PersistentClient(path=persist_dir)
         # 使用get_or_create_collection确保collection存在
-        collection = db.get_or_create_collection(name=collection_name)
-        count = collection.count()
+        count = _with_collection(persist_dir, collection_name, lambda c: c.count(), create=True)
         return {"total_documents": count}
     except Exception as e:
         # 如果集合不存在或其他错误，返回0
@@ -89,14 +168,11 @@ def get_collection_data(persist_dir: str, collection_name: str, limit: int = 10)
         包含文档ID、文本和元数据的字典
     """
     try:
-        db = chromadb.PersistentClient(path=persist_dir)
-        collection = db.get_collection(name=collection_name)
-        
         # 获取集合中的数据
-        results = collection.get(
+        results = _with_collection(persist_dir, collection_name, lambda c: c.get(
             limit=limit,
             include=['documents', 'metadatas', 'embeddings']
-        )
+        ))
         
         return {
             "count": len(results['ids']),
@@ -121,14 +197,11 @@ def check_document_exists(persist_dir: str, collection_name: str, doc_id: str) -
         如果文档ID存在返回True，否则返回False
     """
     try:
-        db = chromadb.PersistentClient(path=persist_dir)
-        collection = db.get_collection(name=collection_name)
-        
         # 查询所有元数据中包含指定 ref_doc_id 的文档
-        results = collection.get(
+        results = _with_collection(persist_dir, collection_name, lambda c: c.get(
             where={"ref_doc_id": doc_id},
             include=['metadatas']
-        )
+        ))
         
         return len(results['ids']) > 0
     except Exception as e:
@@ -148,12 +221,10 @@ def get_document_crawled_at(persist_dir: str, collection_name: str, doc_id: str)
         crawledAt 字符串（如存在），否则返回 None
     """
     try:
-        db = chromadb.PersistentClient(path=persist_dir)
-        collection = db.get_collection(name=collection_name)
-        results = collection.get(
+        results = _with_collection(persist_dir, collection_name, lambda c: c.get(
             where={"ref_doc_id": doc_id},
             include=['metadatas']
-        )
+        ))
         if results['ids'] and results['metadatas']:
             return results['metadatas'][0].get('crawledAt')
         return None
@@ -173,14 +244,11 @@ def delete_document_by_id(persist_dir: str, collection_name: str, doc_id: str) -
     Returns:
         删除的节点数量
     """
-    try:
-        db = chromadb.PersistentClient(path=persist_dir)
-        collection = db.get_collection(name=collection_name)
-        
+    def _delete(collection) -> int:
         # 查询所有包含指定 ref_doc_id 的文档
         results = collection.get(
             where={"ref_doc_id": doc_id},
-            include=['metadatas']
+            include=[]
         )
         
         if len(results['ids']) > 0:
@@ -189,5 +257,249 @@ def delete_document_by_id(persist_dir: str, collection_name: str, doc_id: str) -
             return len(results['ids'])
         
         return 0
+
+    try:
+        return _with_collection(persist_dir, collection_name, _delete)
     except Exception as e:
         raise Exception(f"删除文档失败: {str(e)}")
+
+
+def _manifest_from_results(manifest: Dict[str, Dict[str, Any]], ids, metadatas) -> None:
+    """将 collection.get 的结果按 ref_doc_id 归并进清单。"""
+    for node_id, metadata in zip(ids, metadatas or []):
+        metadata = metadata or {}
+        ref_doc_id = metadata.get("ref_doc_id") or metadata.get("document_id")
+        if not ref_doc_id:
+            continue
+        entry = manifest.setdefault(ref_doc_id, {
+            "crawledAt": metadata.get("crawledAt"),
+            "content_hash": metadata.get("content_hash"),
+            "file_path": metadata.get("file_path"),
+            "node_ids": [],
+            "chunk_hashes": {},
+        })
+        entry["node_ids"].append(node_id)
+        if metadata.get("chunk_hash"):
+            entry["chunk_hashes"][node_id] = metadata["chunk_hash"]
+
+
+def get_collection_manifest(persist_dir: str, collection_name: str, page_size: int = 5000) -> Dict[str, Dict[str, Any]]:
+    """
+    一次性获取整个集合的文档清单，供增量构建在内存中计算新增/更新/跳过/删除。
+
+    Args:
+        persist_dir: 数据库目录
+        collection_name: 集合名称
+        page_size: 分页读取的每页节点数
+
+    Returns:
+        {ref_doc_id: {"crawledAt", "content_hash", "file_path", "node_ids", "chunk_hashes"}}；集合不存在时返回空字典
+    """
+    manifest: Dict[str, Dict[str, Any]] = {}
+    try:
+        collection = get_collection(persist_dir, collection_name)
+    except Exception:
+        return manifest
+
+    offset = 0
+    while True:
+        results = collection.get(limit=page_size, offset=offset, include=['metadatas'])
+        ids = results['ids']
+        _manifest_from_results(manifest, ids, results['metadatas'])
+        if len(ids) < page_size:
+            break
+        offset += page_size
+    return manifest
+
+
+def iter_collection_texts(
+    persist_dir: str,
+    collection_name: str,
+    page_size: int = 5000,
+) -> Iterator[Tuple[List[str], List[str], List[Dict[str, Any]]]]:
+    """
+    分页读取集合中所有节点的 ID、文本与元数据（不含向量），供构建词法索引使用。
+
+    Yields:
+        (ids, documents, metadatas) 每页一组；集合不存在时不产出
+    """
+    try:
+        collection = get_collection(persist_dir, collection_name)
+    except Exception:
+        return
+
+    offset = 0
+    while True:
+        results = collection.get(limit=page_size, offset=offset, include=['documents', 'metadatas'])
+        ids = results['ids']
+        if ids:
+            yield ids, results['documents'], results['metadatas']
+        if len(ids) < page_size:
+            break
+        offset += page_size
+
+
+def get_document_manifest(persist_dir: str, collection_name: str, doc_id: str) -> Optional[Dict[str, Any]]:
+    """
+    获取单个文档的清单条目（一次查询同时得到是否存在、crawledAt、content_hash 和节点 ID）。
+
+    Returns:
+        清单条目；文档不存在或集合不存在时返回 None
+    """
+    try:
+        results = _with_collection(persist_dir, collection_name, lambda c: c.get(
+            where={"ref_doc_id": doc_id},
+            include=['metadatas']
+        ))
+    except Exception:
+        return None
+    manifest: Dict[str, Dict[str, Any]] = {}
+    _manifest_from_results(manifest, results['ids'], results['metadatas'])
+    return manifest.get(doc_id)
+
+
+def delete_nodes_by_ids(persist_dir: str, collection_name: str, node_ids: list) -> int:
+    """
+    按节点 ID 批量删除。
+
+    Returns:
+        删除的节点数量
+    """
+    if not node_ids:
+        return 0
+    try:
+        _with_collection(persist_dir, collection_name, lambda c: c.delete(ids=list(node_ids)))
+        return len(node_ids)
+    except Exception as e:
+        raise Exception(f"删除节点失败: {str(e)}")
+
+
+def get_embeddings_by_ids(persist_dir: str, collection_name: str, node_ids: list) -> Dict[str, list]:
+    """
+    按节点 ID 读取已存储的向量，供未变化的块复用。
+
+    Returns:
+        {node_id: embedding}
+    """
+    if not node_ids:
+        return {}
+    results = _with_collection(persist_dir, collection_name, lambda c: c.get(
+        ids=list(node_ids),
+        include=['embeddings']
+    ))
+    return {node_id: list(embedding) for node_id, embedding in zip(results['ids'], results['embeddings'])}
+
+
+def collection_exists(persist_dir: str, collection_name: str) -> bool:
+    """集合是否存在（不创建）。"""
+    try:
+        get_collection(persist_dir, collection_name)
+        return True
+    except Exception:
+        return False
+
+
+def get_collection_id(persist_dir: str, collection_name: str) -> Optional[str]:
+    """
+    直接从客户端读取名称当前指向的集合 ID（绕过句柄登记）。
+
+    其他进程交换集合后名称会指向新的集合，用于判断已加载的索引是否过期；集合不存在时返回 None。
+    """
+    try:
+        return str(get_client(persist_dir).get_collection(name=resolve_collection_name(persist_dir, collection_name)).id)
+    except Exception:
+        return None
+
+
+def get_index_version(persist_dir: str, collection_name: str) -> Optional[str]:
+    """读取集合元数据中的索引版本号；集合不存在或未标记时返回 None。"""
+    try:
+        metadata = get_client(persist_dir).get_collection(name=resolve_collection_name(persist_dir, collection_name)).metadata or {}
+    except Exception:
+        return None
+    return metadata.get("index_version")
+
+
+def _set_metadata(collection: Collection, **updates: Any) -> None:
+    """合并写入集合元数据：modify(metadata=...) 会整体替换，先带上已有的自定义字段（hnsw:* 创建后不可修改）。"""
+    metadata = {k: v for k, v in (collection.metadata or {}).items() if not k.startswith("hnsw:")}
+    metadata.update(updates)
+    collection.modify(metadata=metadata)
+
+
+def set_index_version(persist_dir: str, collection_name: str, version: str) -> None:
+    """在集合元数据中写入索引版本号（保留其他自定义元数据）。"""
+    collection = get_client(persist_dir).get_collection(name=resolve_collection_name(persist_dir, collection_name))
+    _set_metadata(collection, index_version=version)
+    invalidate_collection(persist_dir, collection_name)
+
+
+def _drop_retired(persist_dir: str, pointers: Dict[str, Dict[str, Any]], collection_name: str, grace: float) -> List[str]:
+    """从指针表中移除到期的旧集合并删除之，返回被删除的集合名（调用方持有 _registry_lock）。"""
+    entry = pointers.get(collection_name)
+    retired = list(entry.get("retired", [])) if entry else []
+    if not retired:
+        return []
+    if grace > 0:
+        now = time.time()
+        expired = [item for item in retired if now - item["retired_at"] >= grace]
+    else:
+        # 服务进程不重新加载：保留最近一个，与重新加载前持有的句柄对应
+        expired = retired[:-1]
+    if not expired:
+        return []
+    pointers[collection_name] = {**entry, "retired": [item for item in retired if item not in expired]}
+    write_pointers(persist_dir, pointers)
+    client = get_client(persist_dir)
+    dropped = []
+    for item in expired:
+        try:
+            client.delete_collection(name=item["collection"])
+            dropped.append(item["collection"])
+        except Exception:
+            pass  # 已被删除
+        path_key = (_registry_key(persist_dir), item["collection"])
+        _collections.pop(path_key, None)
+    return dropped
+
+
+def drop_retired_collections(persist_dir: str, collection_name: str, grace: float) -> List[str]:
+    """
+    删除被替换下来超过 grace 秒的旧集合（只由构建进程调用）。
+
+    grace 应不短于服务进程的重新加载间隔，保证各进程都已切换到新集合、旧句柄上的查询已结束；
+    grace <= 0 时（服务进程不检查替换）只保留最近被替换的一个。
+
+    Returns:
+        被删除的集合名
+    """
+    with _registry_lock:
+        return _drop_retired(persist_dir, dict(read_pointers(persist_dir)), collection_name, grace)
+
+
+def swap_in_collection(persist_dir: str, collection_name: str, shadow_name: str, version: str, grace: float = 0.0) -> None:
+    """
+    用构建完成的影子集合替换正式集合。
+
+    影子集合写入索引版本号后，原子替换集合指针使 collection_name 指向它；原先的集合记入
+    retired 列表，继续保留给已打开旧句柄、尚未重新加载的服务进程查询，被替换超过 grace 秒后
+    由之后的构建删除（见 drop_retired_collections）。不改名、不复制向量数据。
+    """
+    client = get_client(persist_dir)
+    with _registry_lock:
+        pointers = dict(read_pointers(persist_dir))
+        current_name = resolve_collection_name(persist_dir, collection_name)
+        shadow = client.get_collection(name=shadow_name)
+        _set_metadata(shadow, index_version=version)
+        entry = pointers.get(collection_name, {})
+        retired = list(entry.get("retired", []))
+        now = time.time()
+        if current_name != shadow_name and collection_exists(persist_dir, current_name):
+            retired.append({"collection": current_name, "retired_at": now})
+        legacy_name = f"{collection_name}__prev"  # 改名方式交换时留下的旧集合
+        if collection_exists(persist_dir, legacy_name) and all(item["collection"] != legacy_name for item in retired):
+            retired.append({"collection": legacy_name, "retired_at": now})
+        pointers[collection_name] = {"collection": shadow_name, "retired": retired}
+        write_pointers(persist_dir, pointers)
+        _drop_retired(persist_dir, pointers, collection_name, grace)
+        invalidate_collection(persist_dir, collection_name)
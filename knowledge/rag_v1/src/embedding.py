@@ -0,0 +1,398 @@
+"""
+嵌入模块：嵌入后端（远端 / 本地 / 测试桩）、查询向量缓存、文档块向量的磁盘缓存
+"""
+import asyncio
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.embeddings.openai import OpenAIEmbedding
+from pydantic import Field, PrivateAttr
+
+from .config import config
+
+
+# EMBEDDING_BACKEND 可选值
+BACKEND_OPENAI = "openai"  # OpenAI 兼容的远端嵌入接口（默认）
+BACKEND_LOCAL = "local"    # 进程内 CPU 模型（fastembed / ONNX Runtime）
+BACKEND_STUB = "stub"      # 确定性哈希向量，供测试与离线调试
+
+
+class LocalEmbedding(BaseEmbedding):
+    """
+    进程内 CPU 嵌入模型（fastembed，ONNX Runtime 推理）。
+
+    模型在首次使用时加载（首次运行会下载到 cache_dir）。文本嵌入按 embed_batch_size 分批推理；
+    异步接口在有界线程池中执行推理，不阻塞事件循环，多个请求可以并发使用同一个模型会话。
+    """
+
+    threads: int = Field(default=4, description="异步推理线程池大小")
+    cache_dir: Optional[str] = Field(default=None, description="模型文件缓存目录")
+
+    _model: Any = PrivateAttr(default=None)
+    _executor: Optional[ThreadPoolExecutor] = PrivateAttr(default=None)
+    _load_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalEmbedding"
+
+    def _get_model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    try:
+                        from fastembed import TextEmbedding
+                    except ImportError as e:
+                        raise ImportError("EMBEDDING_BACKEND=local 需要安装 fastembed：pip install fastembed") from e
+                    self._model = TextEmbedding(model_name=self.model_name, cache_dir=self.cache_dir)
+        return self._model
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._load_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=max(1, self.threads), thread_name_prefix="local-embed")
+        return self._executor
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return next(iter(self._get_model().query_embed([query]))).tolist()
+
+    def get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """多个查询一次推理（BaseEmbedding 没有批量查询接口）"""
+        return [vector.tolist() for vector in self._get_model().query_embed(queries)]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [vector.tolist() for vector in self._get_model().embed(texts, batch_size=self.embed_batch_size)]
+
+    async def _run_in_pool(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._run_in_pool(self._get_query_embedding, query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await self._run_in_pool(self._get_text_embedding, text)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._run_in_pool(self._get_text_embeddings, texts)
+
+
+class StubEmbedding(BaseEmbedding):
+    """
+    确定性的哈希向量：同一文本总是得到同一个单位向量，不同文本近似正交。
+
+    不反映语义，只用于测试和离线调试（构建与检索流程可完整运行且结果可复现）。
+    """
+
+    dimension: int = Field(default=64, description="向量维度")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StubEmbedding"
+
+    def _vector(self, text: str) -> List[float]:
+        values: List[float] = []
+        counter = 0
+        while len(values) < self.dimension:
+            digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+            values.extend(v / 2147483648.0 for v in struct.unpack("<8i", digest))
+            counter += 1
+        values = values[:self.dimension]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._vector(query)
+
+    def get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        return [self._vector(query) for query in queries]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._vector(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+def create_embed_model(backend: Optional[str] = None) -> BaseEmbedding:
+    """
+    按 EMBEDDING_BACKEND 创建嵌入模型。
+
+    知识库中的向量与构建时使用的模型绑定：切换后端（或模型）后需要 init --force 重建，
+    否则查询向量与库中向量不在同一空间。
+    """
+    backend = (backend or config.EMBEDDING_BACKEND).lower()
+    if backend == BACKEND_LOCAL:
+        return LocalEmbedding(
+            model_name=config.LOCAL_EMBEDDING_MODEL,
+            embed_batch_size=config.EMBED_BATCH_SIZE,
+            threads=config.LOCAL_EMBED_THREADS,
+            cache_dir=config.LOCAL_EMBED_CACHE_DIR or None,
+        )
+    if backend == BACKEND_STUB:
+        return StubEmbedding(model_name=f"stub-{config.STUB_EMBED_DIM}", dimension=config.STUB_EMBED_DIM)
+    if backend != BACKEND_OPENAI:
+        raise ValueError(f"未知的 EMBEDDING_BACKEND: {backend}（可选 openai / local / stub）")
+    return OpenAIEmbedding(
+        api_key=config.OPENAI_API_KEY,
+        api_base=config.OPENAI_BASE_URL,
+        model_name=config.EMBEDDING_MODEL,
+        embed_batch_size=config.EMBED_BATCH_SIZE,
+    )
+
+
+def normalize_query_text(text: str) -> str:
+    """归一化查询文本：NFKC 规范化（全角转半角）并压缩空白。"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class QueryEmbeddingCache:
+    """
+    查询向量的 LRU + TTL 缓存。
+
+    键为 (嵌入模型名, 归一化查询文本)，同一问题在多次过滤检索或重复提问时
+    只调用一次嵌入 API。线程安全，供同步检索与异步检索并发使用。
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        """
+        Args:
+            max_size: 最大缓存条目数，<= 0 时禁用缓存
+            ttl: 条目存活秒数，<= 0 表示永不过期
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str, text: str) -> Optional[List[float]]:
+        """查询缓存，命中时刷新 LRU 顺序；未命中或过期返回 None（计入 miss）。禁用时直接返回 None，不计数。"""
+        if self.max_size <= 0:
+            return None
+        key = (model_name, normalize_query_text(text))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                created_at, embedding = entry
+                if self.ttl <= 0 or now - created_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, model_name: str, text: str, embedding: List[float]) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目。"""
+        if self.max_size <= 0:
+            return
+        key = (model_name, normalize_query_text(text))
+        with self._lock:
+            self._data[key] = (time.monotonic(), embedding)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, model_name: str, text: str, compute: Callable[[], List[float]]) -> List[float]:
+        """命中直接返回，否则调用 compute() 计算并写入缓存。"""
+        embedding = self.get(model_name, text)
+        if embedding is None:
+            embedding = compute()
+            self.put(model_name, text, embedding)
+        return embedding
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中统计，用于观察节省的嵌入调用量。"""
+        with self._lock:  # 在锁内一次性读取，size 与计数来自同一时刻
+            size, hits, misses = len(self._data), self.hits, self.misses
+        total = hits + misses
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+
+def hash_embedding_text(text: str) -> str:
+    """嵌入输入文本的 SHA-256，作为磁盘缓存键的一部分。"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    文档块向量的 SQLite 磁盘缓存。
+
+    键为 (嵌入模型名, 嵌入输入文本哈希)，向量以 float32 存储。init --force、更换集合名
+    或调整分块参数后，文本未变的块直接命中缓存，不再请求远端嵌入服务。
+    超过 max_bytes 时按最近使用时间淘汰；命中统计持久化在同一数据库中。
+    """
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Args:
+            path: SQLite 文件路径
+            max_bytes: 向量数据总字节数上限，<= 0 时禁用缓存
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+                " size INTEGER NOT NULL, last_used REAL NOT NULL,"
+                " PRIMARY KEY (model, text_hash))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, model_name: str, text_hashes: Iterable[str]) -> Dict[str, List[float]]:
+        """批量查询，返回命中的 {text_hash: embedding}，并累计命中 / 未命中次数。"""
+        keys = list(dict.fromkeys(text_hashes))
+        if not self.enabled or not keys:
+            return {}
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            conn = self._connect()
+            # SQLite 单条语句的变量数有限，分段查询
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(part))})",
+                    [model_name, *part],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+            now = time.time()
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(now, model_name, text_hash) for text_hash in found],
+            )
+            self._bump(conn, hits=len(found), misses=len(keys) - len(found))
+            conn.commit()
+        return found
+
+    def put_many(self, model_name: str, items: Dict[str, List[float]]) -> None:
+        """批量写入 {text_hash: embedding}，写入后超出容量则淘汰。"""
+        if not self.enabled or not items:
+            return
+        now = time.time()
+        rows = []
+        for text_hash, embedding in items.items():
+            blob = array("f", embedding).tobytes()
+            rows.append((model_name, text_hash, blob, len(blob), now))
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn, self.max_bytes)
+            conn.commit()
+
+    def prune(self, max_bytes: Optional[int] = None, clear: bool = False) -> Dict[str, Any]:
+        """
+        淘汰最久未使用的条目直到不超过 max_bytes（默认使用配置上限），clear=True 时清空。
+
+        Returns:
+            {"removed": 删除条目数, "size_bytes": 剩余字节数}
+        """
+        with self._lock:
+            conn = self._connect()
+            if clear:
+                removed = conn.execute("DELETE FROM embeddings").rowcount
+                conn.execute("DELETE FROM counters")
+            else:
+                removed = self._evict(conn, self.max_bytes if max_bytes is None else max_bytes)
+            conn.commit()
+            conn.execute("VACUUM")
+            size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        return {"removed": removed, "size_bytes": size}
+
+    def stats(self) -> Dict[str, Any]:
+        """返回条目数、占用字节、各模型条目数与累计命中率。"""
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+            models = dict(conn.execute("SELECT model, COUNT(*) FROM embeddings GROUP BY model").fetchall())
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        total = hits + misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "models": models,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+    @staticmethod
+    def _bump(conn: sqlite3.Connection, hits: int, misses: int) -> None:
+        conn.executemany(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            [("hits", hits), ("misses", misses)],
+        )
+
+    @staticmethod
+    def _evict(conn: sqlite3.Connection, max_bytes: int) -> int:
+        """按 last_used 从旧到新删除，直到总字节数不超过 max_bytes，返回删除条目数。"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= max_bytes:
+            return 0
+        excess = total - max(max_bytes, 0)
+        victims = []
+        for rowid, size in conn.execute("SELECT rowid, size FROM embeddings ORDER BY last_used"):
+            victims.append((rowid,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM embeddings WHERE rowid = ?", victims)
+        return len(victims)
@@ -0,0 +1,273 @@
+"""
+混合检索模块：BM25 词法索引 + 倒数排名融合（RRF）
+
+纯向量检索容易漏掉用户原样粘贴的节点名、参数名和报错文本。词法索引与 Chroma 集合
+一一对应，持久化在 KNOWLEDGE_BASE_PATH/lexical_<集合名>/ 下，首次混合检索时才加载；
+集合的 (ID, 索引版本号, 节点数) 变化后自动重建。
+"""
+import json
+import logging
+import operator
+import os
+import re
+import shutil
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.vector_stores.types import FilterCondition, FilterOperator, MetadataFilters
+
+from .db import get_collection_id, get_collection_stats, get_index_version, iter_collection_texts
+
+try:
+    import bm25s
+except ImportError:  # 仅混合检索需要
+    bm25s = None
+
+
+# 英文 / 数字标识符（节点名、参数名、错误码）与连续的中日韩字符
+_TOKEN_PATTERN = re.compile(r"[a-z0-9_]+|[぀-ヿ㐀-鿿豈-﫿]+")
+
+# 词法索引保存的元数据字段，检索时支持对这些字段做 EQ / NE / IN / NIN 过滤
+FILTER_KEYS = ("source_dir",)
+
+_META_FILENAME = "lexical_meta.json"
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    BM25 分词：NFKC 规范化并转小写；英文数字按标识符整体成词，
+    中文等连续字符输出单字与相邻二元组（不依赖分词词典，节点名的任意子串都能命中）。
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+    for run in _TOKEN_PATTERN.findall(text):
+        if run[0] < "぀":
+            tokens.append(run)
+            continue
+        tokens.extend(run)
+        tokens.extend(map(operator.add, run, run[1:]))
+    return tokens
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    倒数排名融合：score(id) = Σ 1 / (k + rank)，rank 从 1 开始。
+
+    Returns:
+        按融合分数降序的 [(id, score)]；同分时保持首次出现的顺序
+    """
+    scores: Dict[str, float] = {}
+    for ranked in ranked_lists:
+        for rank, item_id in enumerate(ranked, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    与 Chroma 集合对应的 BM25 索引（bm25s，稀疏矩阵存储）。
+
+    key 为 "集合 ID:索引版本号:节点数"，磁盘上的索引 key 与集合当前状态一致时直接加载，
+    否则从集合读取全部文本重建并保存。线程安全。
+    """
+
+    def __init__(self, persist_dir: str, collection_name: str):
+        self.persist_dir = persist_dir
+        self.collection_name = collection_name
+        self.path = os.path.join(persist_dir, f"lexical_{collection_name}")
+        self._lock = threading.Lock()
+        self._retriever = None
+        self._key: Optional[str] = None
+        self._node_ids: List[str] = []
+        self._fields: Dict[str, np.ndarray] = {}
+        self._masks: Dict[tuple, np.ndarray] = {}
+
+    @property
+    def available(self) -> bool:
+        return bm25s is not None
+
+    def current_key(self) -> Optional[str]:
+        """集合当前状态对应的 key；集合不存在时返回 None。"""
+        collection_id = get_collection_id(self.persist_dir, self.collection_name)
+        if collection_id is None:
+            return None
+        count = get_collection_stats(self.persist_dir, self.collection_name).get("total_documents", 0)
+        return f"{collection_id}:{get_index_version(self.persist_dir, self.collection_name)}:{count}"
+
+    def invalidate_if_stale(self) -> None:
+        """已加载的索引与集合当前状态不一致时丢弃，下次检索时重新加载或重建。"""
+        if self._key is not None and self._key != self.current_key():
+            with self._lock:
+                self._retriever = None
+                self._key = None
+
+    def refresh(self) -> bool:
+        """
+        知识库构建后调用：磁盘上的索引与集合当前状态不一致时重建并保存。
+
+        Returns:
+            是否重建
+        """
+        if not self.available:
+            return False
+        key = self.current_key()
+        if key is None:
+            return False
+        with self._lock:
+            if self._saved_key() == key:
+                return False
+            self._build(key)
+            return True
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[MetadataFilters] = None,
+    ) -> Optional[List[Tuple[str, float]]]:
+        """
+        BM25 检索。
+
+        Returns:
+            按分数降序的 [(node_id, score)]，只包含分数大于 0 的节点；
+            bm25s 未安装、集合不存在或过滤条件无法在词法索引上执行时返回 None（调用方退化为纯向量检索）
+        """
+        if not self.available:
+            return None
+        with self._lock:
+            if self._retriever is None and not self._ensure_loaded():
+                return None
+            retriever = self._retriever
+            node_ids = self._node_ids
+            mask = self._filter_mask(filters)
+        if mask is False:
+            return None
+        if not node_ids:
+            return []
+
+        vocab = retriever.vocab_dict
+        tokens = [token for token in tokenize(query) if token in vocab]
+        if not tokens:
+            return []
+        k = min(max(top_k, 1), len(node_ids))
+        documents, scores = retriever.retrieve(
+            [tokens], k=k, show_progress=False, weight_mask=mask, n_threads=1,
+        )
+        return [
+            (node_ids[index], float(score))
+            for index, score in zip(documents[0], scores[0])
+            if score > 0
+        ]
+
+    def _ensure_loaded(self) -> bool:
+        key = self.current_key()
+        if key is None:
+            return False
+        if self._load(key):
+            return True
+        logging.info(f"词法索引不存在或已过期，从集合 {self.collection_name} 重建...")
+        self._build(key)
+        return True
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.path, _META_FILENAME), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _saved_key(self) -> Optional[str]:
+        meta = self._read_meta()
+        return meta.get("key") if meta else None
+
+    def _load(self, key: str) -> bool:
+        meta = self._read_meta()
+        if meta is None or meta.get("key") != key:
+            return False
+        try:
+            retriever = bm25s.BM25.load(self.path, mmap=True, show_progress=False)
+        except (OSError, ValueError):
+            return False
+        self._set_state(key, retriever, meta["node_ids"], meta["fields"])
+        logging.info(f"已加载词法索引: {len(self._node_ids)} 个节点")
+        return True
+
+    def _build(self, key: Optional[str]) -> None:
+        node_ids: List[str] = []
+        fields: Dict[str, List[str]] = {name: [] for name in FILTER_KEYS}
+        corpus: List[List[str]] = []
+        for ids, documents, metadatas in iter_collection_texts(self.persist_dir, self.collection_name):
+            for node_id, text, metadata in zip(ids, documents, metadatas):
+                metadata = metadata or {}
+                node_ids.append(node_id)
+                # 标题参与索引，按节点名 / 文档标题检索时更容易命中
+                corpus.append(tokenize(f"{metadata.get('title', '')}\n{metadata.get('h1_title', '')}\n{text or ''}"))
+                for name in FILTER_KEYS:
+                    fields[name].append(str(metadata.get(name, "")))
+
+        retriever = bm25s.BM25()
+        if corpus:
+            retriever.index(corpus, show_progress=False)
+
+        # 先写临时目录再替换，读取方不会看到写了一半的索引
+        tmp_path = f"{self.path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        if corpus:
+            retriever.save(tmp_path, show_progress=False)
+        with open(os.path.join(tmp_path, _META_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({"key": key, "node_ids": node_ids, "fields": fields}, f, ensure_ascii=False)
+        old_path = f"{self.path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.replace(self.path, old_path)
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        self._set_state(key, retriever, node_ids, fields)
+        logging.info(f"词法索引已重建: {len(node_ids)} 个节点")
+
+    def _set_state(self, key: Optional[str], retriever, node_ids: List[str], fields: Dict[str, List[str]]) -> None:
+        self._key = key
+        self._retriever = retriever
+        self._node_ids = node_ids
+        self._fields = {name: np.asarray(values, dtype=object) for name, values in fields.items()}
+        self._masks = {}
+
+    def _filter_mask(self, filters: Optional[MetadataFilters]):
+        """
+        把元数据过滤条件转换为 bm25s 的 weight_mask（按条件缓存）。
+
+        Returns:
+            None 表示不过滤；False 表示条件无法在词法索引上执行
+        """
+        if filters is None or not filters.filters:
+            return None
+        if filters.condition not in (None, FilterCondition.AND):
+            return False
+        cache_key = tuple(
+            (f.key, f.operator, tuple(f.value) if isinstance(f.value, list) else f.value)
+            for f in filters.filters
+            if hasattr(f, "key")
+        )
+        if len(cache_key) != len(filters.filters):
+            return False  # 嵌套的 MetadataFilters
+        if cache_key in self._masks:
+            return self._masks[cache_key]
+
+        mask = np.ones(len(self._node_ids), dtype=bool)
+        for key, op, value in cache_key:
+            if key not in self._fields:
+                return False
+            column = self._fields[key]
+            values = [str(v) for v in value] if isinstance(value, tuple) else [str(value)]
+            if op in (FilterOperator.EQ, FilterOperator.IN):
+                mask &= np.isin(column, values)
+            elif op in (FilterOperator.NE, FilterOperator.NIN):
+                mask &= ~np.isin(column, values)
+            else:
+                return False
+        self._masks[cache_key] = mask.astype(np.float32)
+        return self._masks[cache_key]
@@ -0,0 +1,105 @@
+"""
+构建进度日志模块
+
+记录一次知识库构建的目标集合、已完成的文档和已提交但尚未确认写入的节点 ID。
+构建中断后，下一次构建据此清理写到一半的文档并从断点继续。
+"""
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class BuildJournal:
+    """
+    构建进度日志（JSON 文件，原子替换写入）。
+
+    字段：
+        collection: 正式集合名称
+        target: 实际写入的集合（--force 时为影子集合）
+        mode: "force" / "incremental"
+        completed: 已完成写入（并已删除旧节点）的文档 ID
+        in_flight: {doc_id: [新节点 ID]}，已提交到嵌入流水线、尚未确认完成的文档
+        written_nodes / rounds: 已写入的节点数与流水线轮次，用于观察进度
+    """
+
+    def __init__(self, path: str, state: Dict[str, Any]):
+        self.path = path
+        self.state = state
+        self._completed = set(state.get("completed", []))
+
+    @classmethod
+    def start(cls, path: str, collection: str, target: str, mode: str) -> "BuildJournal":
+        now = datetime.now(timezone.utc).isoformat()
+        journal = cls(path, {
+            "collection": collection,
+            "target": target,
+            "mode": mode,
+            "started_at": now,
+            "updated_at": now,
+            "completed": [],
+            "in_flight": {},
+            "written_nodes": 0,
+            "rounds": 0,
+        })
+        journal.save()
+        return journal
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BuildJournal"]:
+        """读取已有日志；不存在或损坏时返回 None。"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(path, json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def mode(self) -> str:
+        return self.state.get("mode", "incremental")
+
+    @property
+    def target(self) -> str:
+        return self.state["target"]
+
+    @property
+    def completed(self) -> set:
+        return self._completed
+
+    def in_flight_node_ids(self) -> List[str]:
+        return [node_id for node_ids in self.state["in_flight"].values() for node_id in node_ids]
+
+    def mark_in_flight(self, doc_id: str, node_ids: Iterable[str]) -> None:
+        self.state["in_flight"][doc_id] = list(node_ids)
+
+    def mark_completed(self, doc_id: str) -> None:
+        self.state["in_flight"].pop(doc_id, None)
+        if doc_id not in self._completed:
+            self._completed.add(doc_id)
+            self.state["completed"].append(doc_id)
+
+    def mark_abandoned(self, doc_id: str) -> None:
+        """文档处理失败且已清理新节点，下次构建会重新处理。"""
+        self.state["in_flight"].pop(doc_id, None)
+
+    def clear_in_flight(self) -> None:
+        self.state["in_flight"] = {}
+
+    def record_round(self, written_nodes: int) -> None:
+        self.state["rounds"] = self.state.get("rounds", 0) + 1
+        self.state["written_nodes"] = written_nodes
+
+    def save(self) -> None:
+        self.state["updated_at"] = datetime.now(timezone.utc).isoformat()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def finish(self) -> None:
+        """构建完成，删除日志文件。"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -6,14 +6,46 @@
 2. 保持每个一级标题下的所有内容（包括二三级标题）在同一个块中
 3. 配置足够大的 chunk_size 以保持内容完整性
 """
-from typing import List, Dict, Any, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Tuple
 from pathlib import Path
+import hashlib
+import logging
+import multiprocessing
+import os
 import re
 import yaml
+from fsspec.implementations.local import make_path_posix
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.readers import SimpleDirectoryReader
 from llama_index.core.schema import Document, BaseNode, TextNode, NodeRelationship, RelatedNodeInfo
 
+# 一级标题行
+_H1_LINE_PATTERN = re.compile(r'^# [^#].*$')
+
+# 仅用于增量更新判定的内部元数据：写入 Chroma，但不参与嵌入文本和 LLM 上下文
+INTERNAL_METADATA_KEYS = ["content_hash", "chunk_hash"]
+
+
+def compute_content_hash(text: str, settings_signature: str = "") -> str:
+    """
+    计算文本的内容哈希。
+
+    settings_signature 为分块参数签名，参数变化时哈希随之变化，从而触发重新分块与嵌入。
+    """
+    return hashlib.sha256(f"{settings_signature}\n{text}".encode("utf-8")).hexdigest()
+
+
+def _exclude_internal_metadata(node: BaseNode) -> None:
+    """把内部元数据加入节点的嵌入 / LLM 排除列表。"""
+    for key in INTERNAL_METADATA_KEYS:
+        if key not in node.excluded_embed_metadata_keys:
+            node.excluded_embed_metadata_keys.append(key)
+        if key not in node.excluded_llm_metadata_keys:
+            node.excluded_llm_metadata_keys.append(key)
+
+
 def extract_yaml_frontmatter(text: str) -> Tuple[Dict[str, Any], str]:
     """
     从 Markdown 文本中提取 YAML frontmatter。
@@ -44,39 +76,68 @@ def extract_yaml_frontmatter(text: str) -> Tuple[Dict[str, Any], str]:
     
     return {}, text
 
-def file_metadata_func(file_path: str) -> dict:
+def iter_markdown_files(directory_path: str) -> Iterator[str]:
     """
-    自定义元数据提取函数，用于提取文件基础信息和 YAML frontmatter。
-    这个函数会被 SimpleDirectoryReader 调用来生成文档的元数据。
-    
+    递归列出目录下的 .md 文件（包含隐藏文件）。
+
+    路径形式与排序与原先使用的 SimpleDirectoryReader 一致（绝对路径、不折叠 ".."、按路径排序），
+    保证没有 YAML id 的文档以 file_path 作为 doc_id 时与已入库数据相同。
+    """
+    root = make_path_posix(directory_path).rstrip("/") or "/"
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = Path(dirpath, filename)
+            if path.suffix == ".md":
+                paths.append(path)
+    for path in sorted(paths):
+        yield str(path)
+
+
+def read_markdown_file(file_path: str) -> Tuple[Dict[str, Any], str]:
+    """
+    读取 Markdown 文件（只读一次），提取文件基础信息和 YAML frontmatter（只解析一次）。
+
     提取的元数据包括：
     - file_name: 文件名
     - file_path: 文件完整路径
     - source_dir: 源目录名
     - 来自 YAML frontmatter 的所有字段（包括 id, title, crawledAt 等）
+
+    Returns:
+        (metadata, cleaned_text) 元组，cleaned_text 为移除 frontmatter 后的正文
     """
     path_obj = Path(file_path)
-    
-    # 基础文件元数据
+    # newline='' 保留原始换行符，正文与 content_hash 与原先的读取方式一致
+    with open(file_path, 'r', encoding='utf-8', errors='ignore', newline='') as f:
+        content = f.read()
+
+    # 基础文件元数据，YAML 元数据合并在后（包括 crawledAt 时间戳）
     metadata = {
         "file_name": path_obj.name,
         "file_path": file_path,
         "source_dir": path_obj.parent.name
     }
-    
-    # 读取文件并提取 YAML frontmatter
+    yaml_metadata, cleaned_text = extract_yaml_frontmatter(content)
+    metadata.update(yaml_metadata)
+    return metadata, cleaned_text
+
+
+def file_metadata_func(file_path: str) -> dict:
+    """
+    提取文件基础信息和 YAML frontmatter 作为文档元数据（字段见 read_markdown_file）。
+    """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        yaml_metadata, _ = extract_yaml_frontmatter(content)
-        # 合并 YAML 元数据到基础元数据中（包括 crawledAt 时间戳）
-        metadata.update(yaml_metadata)
-    except Exception as e:
-        # 如果提取失败，只返回基础元数据
-        pass
-    
-    return metadata
+        metadata, _ = read_markdown_file(file_path)
+        return metadata
+    except Exception:
+        # 如果读取失败，只返回基础元数据
+        path_obj = Path(file_path)
+        return {
+            "file_name": path_obj.name,
+            "file_path": file_path,
+            "source_dir": path_obj.parent.name
+        }
 
 class DocumentParser:
     """
@@ -102,6 +163,8 @@ class DocumentParser:
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.use_h1_only = use_h1_only
+        # 分块参数签名，参与 content_hash / chunk_hash 计算
+        self.settings_signature = f"chunk_size={chunk_size};chunk_overlap={chunk_overlap};use_h1_only={use_h1_only}"
         
         # 只在需要二次分割时使用 SentenceSplitter
         self.sentence_splitter = SentenceSplitter(
@@ -123,7 +186,7 @@ class DocumentParser:
         """
         # 匹配一级标题：以 # 开头，后面不是 #（排除二级及以上标题）
         # 使用正则表达式匹配行首的 # 加空格
-        h1_pattern = r'^# [^#].*$'
+        h1_pattern = _H1_LINE_PATTERN
         
         lines = text.split('\n')
         chunks = []
@@ -131,7 +194,7 @@ class DocumentParser:
         
         for line in lines:
             # 检查是否是一级标题
-            if re.match(h1_pattern, line):
+            if h1_pattern.match(line):
                 # 如果当前chunk不为空，保存它
                 if current_chunk:
                     chunks.append('\n'.join(current_chunk))
@@ -187,6 +250,8 @@ class DocumentParser:
                         "subchunk_index": subchunk_index,
                         "subchunk_count": subchunk_count,
                     })
+                for sub_node in sub_nodes:
+                    _exclude_internal_metadata(sub_node)
                 nodes.extend(sub_nodes)
             else:
                 # 直接创建节点
@@ -201,13 +266,40 @@ class DocumentParser:
                         NodeRelationship.SOURCE: RelatedNodeInfo(node_id=doc.doc_id)
                     }
                 )
+                _exclude_internal_metadata(node)
                 nodes.append(node)
         
         return nodes
 
+    def iter_documents(self, directory_path: str) -> Iterator[Document]:
+        """
+        逐个加载目录中的 Markdown 文档（生成器）。
+
+        每个文件只读取一次、frontmatter 只解析一次；调用方逐个消费，无需一次性持有整个语料。
+        无法读取的文件记录警告后跳过。
+
+        Args:
+            directory_path (str): 目录路径。
+
+        Yields:
+            Document: 已移除 frontmatter 的文档，metadata 包含 YAML 元数据
+        """
+        for file_path in iter_markdown_files(directory_path):
+            try:
+                yield self._build_document(file_path)
+            except OSError as e:
+                logging.warning(f"读取文件失败，跳过: {file_path} - {e}")
+
+    def load_document(self, file_path: str) -> Document:
+        """
+        加载单个 Markdown 文档。file_path 的规范化方式与加载其所在目录时一致。
+        """
+        directory = make_path_posix(os.path.dirname(file_path) or ".").rstrip("/") or "/"
+        return self._build_document(str(Path(directory, os.path.basename(file_path))))
+
     def load_documents(self, directory_path: str) -> List[Document]:
         """
-        从目录加载文档。file_metadata_func 会提取 YAML frontmatter 到元数据中。
+        从目录加载文档。YAML frontmatter 会提取到元数据中。
 
         Args:
             directory_path (str): The path to the directory.
@@ -215,35 +307,24 @@ class DocumentParser:
         Returns:
             List[Document]: A list of loaded documents with YAML metadata.
         """
-        reader = SimpleDirectoryReader(
-            input_dir=directory_path,
-            required_exts=[".md"],
-            recursive=True,
-            file_metadata=file_metadata_func,
-            exclude_hidden=False,
+        return list(self.iter_documents(directory_path))
+
+    def _build_document(self, file_path: str) -> Document:
+        metadata, cleaned_text = read_markdown_file(file_path)
+
+        # 使用 YAML 中的 id 或文件路径作为 doc_id，用于文档级别的管理
+        doc_id = metadata['id'] if 'id' in metadata else metadata['file_path']
+
+        # 正文内容哈希，用于增量构建时判断文档内容是否变化
+        metadata["content_hash"] = compute_content_hash(cleaned_text, self.settings_signature)
+
+        document = Document(
+            text=cleaned_text,
+            metadata=metadata,
+            doc_id=doc_id  # 设置 Document 的 doc_id 属性
         )
-        docs = reader.load_data()
-        
-        # 从文档文本中移除 YAML frontmatter（已提取到 metadata 中）
-        # 同时设置 doc_id 属性用于文档级别的管理
-        cleaned_docs = []
-        for doc in docs:
-            _, cleaned_text = extract_yaml_frontmatter(doc.text)
-            
-            # 使用 YAML 中的 id 或文件路径作为 doc_id
-            if 'id' in doc.metadata:
-                doc_id = doc.metadata['id']
-            else:
-                doc_id = doc.metadata.get('file_path', str(Path(directory_path).absolute()))
-            
-            cleaned_doc = Document(
-                text=cleaned_text,
-                metadata=doc.metadata,
-                doc_id=doc_id  # 设置 Document 的 doc_id 属性
-            )
-            cleaned_docs.append(cleaned_doc)
-        
-        return cleaned_docs
+        _exclude_internal_metadata(document)
+        return document
 
     def parse_documents(self, documents: List[Document]) -> List[BaseNode]:
         """
@@ -257,7 +338,7 @@ class DocumentParser:
         """
         if not self.use_h1_only:
             # 如果不使用一级标题分块，使用标准的 SentenceSplitter
-            return self.sentence_splitter.get_nodes_from_documents(documents)
+            return self._assign_chunk_hashes(self.sentence_splitter.get_nodes_from_documents(documents))
         
         all_nodes = []
         for doc in documents:
@@ -271,7 +352,61 @@ class DocumentParser:
             nodes = self._create_nodes_from_chunks(chunks, doc)
             all_nodes.extend(nodes)
         
-        return all_nodes
+        return self._assign_chunk_hashes(all_nodes)
+
+    def _assign_chunk_hashes(self, nodes: List[BaseNode]) -> List[BaseNode]:
+        """为每个节点写入 chunk_hash（块文本 + 分块参数），增量构建据此复用未变化块的向量。"""
+        for node in nodes:
+            node.metadata["chunk_hash"] = compute_content_hash(node.get_content(), self.settings_signature)
+            _exclude_internal_metadata(node)
+        return nodes
+
+    def iter_parsed_documents(
+        self,
+        documents: Iterable[Document],
+        workers: int = 1,
+        batch_size: int = 16,
+    ) -> Iterator[Tuple[Document, Optional[List[BaseNode]], Optional[str]]]:
+        """
+        逐个解析文档（生成器），workers > 1 时在进程池中并行分块。
+
+        产出顺序与输入顺序一致，与 workers 无关。文档按 batch_size 个一组提交到进程池，
+        同时在途的组数有上限，输入可以是惰性加载的生成器，不会一次性读入整个语料。
+        单个文档解析失败不影响其他文档。
+
+        Args:
+            documents: 待解析的文档
+            workers: 解析进程数，<= 1 时在当前进程中串行解析
+            batch_size: 每次提交到工作进程的文档数
+
+        Yields:
+            (document, nodes, error)：成功时 error 为 None，失败时 nodes 为 None
+        """
+        if workers <= 1:
+            for document in documents:
+                yield (document, *_parse_one(self, document))
+            return
+
+        # spawn 启动工作进程：父进程中已有 Chroma / asyncio 的线程，fork 不安全
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_parse_worker,
+            initargs=(self.chunk_size, self.chunk_overlap, self.use_h1_only),
+        ) as executor:
+            in_flight = deque()
+            iterator = iter(documents)
+            while True:
+                batch = list(islice(iterator, max(1, batch_size)))
+                if batch:
+                    in_flight.append((batch, executor.submit(_parse_document_batch, batch)))
+                # 在途组数达到上限或输入已耗尽时，按提交顺序取回最早的一组
+                while in_flight and (len(in_flight) >= workers * 2 or not batch):
+                    done_batch, future = in_flight.popleft()
+                    for document, (nodes, error) in zip(done_batch, future.result()):
+                        yield document, nodes, error
+                if not batch:
+                    break
 
     def load_and_parse(self, directory_path: str) -> List[BaseNode]:
         """
@@ -284,4 +419,24 @@ class DocumentParser:
             List[BaseNode]: 解析后的节点列表。
         """
         documents = self.load_documents(directory_path)
-        return self.parse_documents(documents)
\ No newline at end of file
+        return self.parse_documents(documents)
+
+def _parse_one(parser: DocumentParser, document: Document) -> Tuple[Optional[List[BaseNode]], Optional[str]]:
+    try:
+        return parser.parse_documents([document]), None
+    except Exception as e:
+        logging.error(f"解析文档失败: {document.doc_id} - {e}")
+        return None, str(e)
+
+
+# 工作进程内的解析器，由 _init_parse_worker 按父进程的分块参数创建
+_worker_parser: Optional[DocumentParser] = None
+
+
+def _init_parse_worker(chunk_size: int, chunk_overlap: int, use_h1_only: bool) -> None:
+    global _worker_parser
+    _worker_parser = DocumentParser(chunk_size=chunk_size, chunk_overlap=chunk_overlap, use_h1_only=use_h1_only)
+
+
+def _parse_document_batch(documents: List[Document]) -> List[Tuple[Optional[List[BaseNode]], Optional[str]]]:
+    return [_parse_one(_worker_parser, document) for document in documents]
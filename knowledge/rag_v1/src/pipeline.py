@@ -0,0 +1,180 @@
+"""
+嵌入流水线模块
+
+跨文档收集待嵌入节点，凑满 embed_batch_size 后通过异步嵌入 API 并发请求，
+结果按轮次批量写入 Chroma。逐文档 insert_nodes 时一个只有两个一级标题的文档
+只能发出大小为 2 的批次，全量构建会被逐文档的请求延迟拖慢。
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from llama_index.core.async_utils import asyncio_run
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+
+from .embedding import EmbeddingCache, hash_embedding_text
+
+
+class EmbeddingPipeline:
+    """
+    跨文档批量嵌入并写入向量库。
+
+    用法：逐个文档调用 submit(key, nodes)，最后调用 flush()。待嵌入节点达到
+    batch_size * concurrency 时触发一轮：所有满批次并发嵌入（信号量限制同时在途的
+    请求数），随后本轮节点一次性写入向量库。已带向量的节点（复用的块）与磁盘缓存命中的
+    节点不调用嵌入 API，新得到的向量写回磁盘缓存。
+
+    某批嵌入失败时，该批涉及的 key 记入 failed，其后续节点不再写入；
+    已写入的节点 ID 可通过 written 取回，由调用方清理。
+    """
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        vector_store: BasePydanticVectorStore,
+        batch_size: int = 32,
+        concurrency: int = 4,
+        cache: Optional[EmbeddingCache] = None,
+        before_write: Optional[Callable[[], None]] = None,
+        after_write: Optional[Callable[[], None]] = None,
+    ):
+        """
+        Args:
+            embed_model: 嵌入模型（使用其异步批量接口）
+            vector_store: 写入目标向量库
+            batch_size: 每次嵌入请求的文本数
+            concurrency: 同时在途的嵌入请求数上限
+            cache: 可选的磁盘向量缓存，键为 (embed_model.model_name, 嵌入输入文本哈希)
+            before_write / after_write: 每轮写入向量库前后的回调（用于记录构建进度日志）
+        """
+        self.embed_model = embed_model
+        self.vector_store = vector_store
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.cache = cache
+        self.before_write = before_write
+        self.after_write = after_write
+
+        self.failed: Dict[Hashable, str] = {}
+        self.written: Dict[Hashable, List[str]] = {}
+        self.embedded_nodes = 0
+        self.embed_requests = 0
+        self.cache_hits = 0
+
+        # 待嵌入 / 已有向量待写入的 (key, node)
+        self._pending: List[Tuple[Hashable, BaseNode]] = []
+        self._ready: List[Tuple[Hashable, BaseNode]] = []
+        # node_id -> 嵌入输入文本哈希，用于嵌入完成后写回缓存
+        self._text_hashes: Dict[str, str] = {}
+
+    def submit(self, key: Hashable, nodes: List[BaseNode]) -> None:
+        """提交一个文档的节点；key 用于归属失败与写入记录（通常为 doc_id）。"""
+        missing = [node for node in nodes if node.embedding is None]
+        if missing and self.cache is not None and self.cache.enabled:
+            for node in missing:
+                self._text_hashes[node.node_id] = hash_embedding_text(node.get_content(metadata_mode=MetadataMode.EMBED))
+            try:
+                cached = self.cache.get_many(self.embed_model.model_name, [self._text_hashes[n.node_id] for n in missing])
+            except Exception as e:
+                logging.warning(f"读取嵌入缓存失败: {e}")
+                cached = {}
+            for node in missing:
+                embedding = cached.get(self._text_hashes[node.node_id])
+                if embedding is not None:
+                    node.embedding = embedding
+                    self.cache_hits += 1
+                    del self._text_hashes[node.node_id]
+        for node in nodes:
+            if node.embedding is None:
+                self._pending.append((key, node))
+            else:
+                self._ready.append((key, node))
+        if len(self._pending) >= self.batch_size * self.concurrency:
+            self._run_round(include_partial=False)
+
+    def flush(self) -> None:
+        """嵌入并写入所有剩余节点（包括不足一批的尾部）。"""
+        while self._pending or self._ready:
+            self._run_round(include_partial=True)
+
+    def outstanding_keys(self) -> Set[Hashable]:
+        """仍有节点未写入的 key。"""
+        return {key for key, _ in self._pending} | {key for key, _ in self._ready}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "embedded_nodes": self.embedded_nodes,
+            "embed_requests": self.embed_requests,
+            "cache_hits": self.cache_hits,
+            "written_nodes": sum(len(ids) for ids in self.written.values()),
+            "failed_keys": len(self.failed),
+        }
+
+    def _run_round(self, include_partial: bool) -> None:
+        full = len(self._pending) - len(self._pending) % self.batch_size
+        take = len(self._pending) if include_partial else full
+        items, self._pending = self._pending[:take], self._pending[take:]
+        items = [(key, node) for key, node in items if key not in self.failed]
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+
+        if batches:
+            asyncio_run(self._embed_batches(batches))
+            self._store_in_cache([node for batch in batches for _, node in batch])
+
+        # 本轮已带向量的节点一次性写入，跳过已失败文档的节点
+        ready, self._ready = self._ready, []
+        for batch in batches:
+            ready.extend(batch)
+        ready = [(key, node) for key, node in ready if key not in self.failed and node.embedding is not None]
+        if ready:
+            if self.before_write is not None:
+                self.before_write()
+            try:
+                ids = self.vector_store.add([node for _, node in ready])
+            except Exception as e:
+                logging.error(f"❌ 批量写入向量库失败（{len(ready)} 个节点）: {e}")
+                for key, _ in ready:
+                    self.failed.setdefault(key, str(e))
+                ids = []
+            for (key, _), node_id in zip(ready, ids):
+                self.written.setdefault(key, []).append(node_id)
+        if self.after_write is not None:
+            self.after_write()
+
+    def _store_in_cache(self, nodes: List[BaseNode]) -> None:
+        hashes = [self._text_hashes.pop(node.node_id, None) for node in nodes]
+        if self.cache is None or not self.cache.enabled:
+            return
+        items = {
+            text_hash: node.embedding
+            for node, text_hash in zip(nodes, hashes)
+            if text_hash is not None and node.embedding is not None
+        }
+        try:
+            self.cache.put_many(self.embed_model.model_name, items)
+        except Exception as e:
+            logging.warning(f"写入嵌入缓存失败: {e}")
+
+    async def _embed_batches(self, batches: List[List[Tuple[Hashable, BaseNode]]]) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def embed(batch: List[Tuple[Hashable, BaseNode]]) -> None:
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for _, node in batch]
+            async with semaphore:
+                try:
+                    embeddings = await self.embed_model.aget_text_embedding_batch(texts)
+                except Exception as e:
+                    keys = list(OrderedDict.fromkeys(key for key, _ in batch))
+                    logging.error(f"❌ 批量嵌入失败（{len(batch)} 个节点，涉及 {len(keys)} 个文档）: {e}")
+                    for key in keys:
+                        self.failed.setdefault(key, str(e))
+                    return
+            self.embed_requests += 1
+            self.embedded_nodes += len(batch)
+            for (_, node), embedding in zip(batch, embeddings):
+                node.embedding = embedding
+
+        await asyncio.gather(*(embed(batch) for batch in batches))
@@ -0,0 +1,68 @@
+"""
+集合指针模块
+
+正式集合名称（如 docs）是逻辑名，实际读写的 Chroma 集合由持久化目录下的指针文件
+collection_pointers.json 决定：
+
+    {"docs": {"collection": "docs__20250101T000000000000Z",
+              "retired": [{"collection": "docs", "retired_at": 1735689600.0}]}}
+
+强制重建完成后只需原子替换指针文件（os.replace），读取方下一次解析名称时即指向新集合，
+不存在正式名称暂时不可用的间隙。没有指针的名称（首次构建、影子集合）即其本身。
+
+本模块只依赖标准库，backend 的 skill.service / MCP Server 也用它解析集合名称。
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+POINTER_FILE = "collection_pointers.json"
+
+_cache_lock = threading.Lock()
+# 持久化目录 -> ((inode, mtime_ns, size), 指针表)
+_cache: Dict[str, Tuple[Tuple[int, int, int], Dict[str, Dict[str, Any]]]] = {}
+
+
+def pointer_path(persist_dir: str) -> str:
+    return os.path.join(persist_dir, POINTER_FILE)
+
+
+def read_pointers(persist_dir: str) -> Dict[str, Dict[str, Any]]:
+    """读取指针表（按文件 inode / 修改时间 / 大小缓存）；文件不存在或损坏时返回空表。调用方不应修改返回值。"""
+    path = pointer_path(persist_dir)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return {}
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    key = os.path.abspath(persist_dir)
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            pointers = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    with _cache_lock:
+        _cache[key] = (signature, pointers)
+    return pointers
+
+
+def write_pointers(persist_dir: str, pointers: Dict[str, Dict[str, Any]]) -> None:
+    """原子替换指针文件（只由构建进程写入）。"""
+    path = pointer_path(persist_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(pointers, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def resolve_collection_name(persist_dir: str, collection_name: str) -> str:
+    """逻辑集合名 -> 当前实际的 Chroma 集合名"""
+    entry = read_pointers(persist_dir).get(collection_name)
+    return entry["collection"] if entry else collection_name
@@ -1,19 +1,42 @@
 """
 RAG引擎核心模块
 """
+import asyncio
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional, Union
+from typing import Callable, Iterator, List, Dict, Any, Optional, Union
 import tiktoken
 
 from .config import config
-from .parser import DocumentParser
-from .db import get_storage_context, get_vector_store_index, get_collection_stats, clear_collection
+from .parser import DocumentParser, iter_markdown_files
+from .db import (
+    get_storage_context,
+    get_vector_store_index,
+    get_collection_stats,
+    clear_collection,
+    get_collection_manifest,
+    get_document_manifest,
+    delete_nodes_by_ids,
+    get_embeddings_by_ids,
+    collection_exists,
+    get_collection_id,
+    get_index_version,
+    set_index_version,
+    swap_in_collection,
+    drop_retired_collections,
+    invalidate_collection,
+)
+from .embedding import EmbeddingCache, QueryEmbeddingCache, create_embed_model
+from .pipeline import EmbeddingPipeline
+from .journal import BuildJournal
+from .hybrid import LexicalIndex, reciprocal_rank_fusion
 
-from llama_index.core import Settings as LlamaSettings
-from llama_index.core.schema import Document
-from llama_index.embeddings.openai import OpenAIEmbedding
+from llama_index.core import Settings as LlamaSettings, StorageContext
+from llama_index.core.schema import BaseNode, Document, NodeWithScore, QueryBundle
 from llama_index.llms.openai_like import OpenAILike
 from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.core.vector_stores.types import MetadataFilters, MetadataFilter, FilterOperator
@@ -47,6 +70,62 @@ def _parse_crawled_at(value: Union[str, datetime, None]) -> Optional[datetime]:
     return None
 
 
+# _process_document_embedding 的 stored 参数默认值：表示需要单独查询该文档的清单条目
+_LOOKUP = object()
+
+
+def _retired_collection_grace() -> float:
+    """被替换的旧集合保留的秒数：服务进程每 INDEX_RELOAD_INTERVAL 秒检查一次替换，留出两个间隔让各进程切换、旧句柄上的查询结束。"""
+    return 2 * config.INDEX_RELOAD_INTERVAL
+
+
+def _new_index_version() -> str:
+    """生成索引版本号（UTC 时间戳），每次构建改变了集合内容时更新。"""
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+class RetrievalExecutor:
+    """
+    异步检索使用的有界线程池，记录在途与排队的任务数。
+
+    Chroma 查询是同步接口，放在专用线程中执行；并发请求超过线程数时在此排队，
+    不会占满事件循环的默认线程池（asyncio.to_thread 等共用该线程池）。
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rag-retrieval")
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._running = 0
+        self._completed = 0
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            self._submitted += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, args)
+
+    def _call(self, func: Callable[..., Any], args: tuple) -> Any:
+        with self._lock:
+            self._running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "queued": self._submitted - self._completed - self._running,
+                "completed": self._completed,
+            }
+
+
 class RAGEngine:
     """RAG搜索引擎"""
 
@@ -71,25 +150,35 @@ class RAGEngine:
             collection_name=config.CHROMA_COLLECTION_NAME
         )
         self.index = self._load_index()
-        
-        # 初始化 token 计数器
-        # 使用通用的 cl100k_base encoding，适用于所有模型
-        self.token_counter = TokenCountingHandler(
-            tokenizer=tiktoken.get_encoding("cl100k_base").encode,
-            verbose=False
+        self._index_checked_at = time.monotonic()
+        # 检索线程池中的多个检索可能同时检查替换，串行化检查与重新加载
+        self._reload_lock = threading.Lock()
+        self._index_version = get_index_version(config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME)
+
+        # 查询向量缓存：同一问题的多次过滤检索、重复提问只调用一次嵌入 API
+        self.query_embedding_cache = QueryEmbeddingCache(
+            max_size=config.QUERY_EMBED_CACHE_SIZE,
+            ttl=config.QUERY_EMBED_CACHE_TTL,
         )
+        # 文档块向量磁盘缓存：重建、换集合名、调整分块后文本未变的块不再请求嵌入 API
+        self.embedding_cache = EmbeddingCache(
+            path=os.path.join(config.KNOWLEDGE_BASE_PATH, config.EMBED_CACHE_FILENAME),
+            max_bytes=config.EMBED_CACHE_MAX_MB * 1024 * 1024,
+        )
+        # BM25 词法索引：首次混合检索时才加载
+        self.lexical_index = LexicalIndex(config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME)
+        # 异步检索的 Chroma 查询线程池（查询向量走嵌入模型的异步接口，不占用线程）
+        self.retrieval_executor = RetrievalExecutor(config.RETRIEVAL_EXECUTOR_WORKERS)
+        
+        # token 计数使用通用的 cl100k_base encoding，适用于所有模型
+        self.tokenizer = tiktoken.get_encoding("cl100k_base").encode
         
         logging.info("RAG引擎初始化完成")
 
     def _setup_services(self):
         """配置LlamaIndex的LLM和嵌入模型"""
-        # 配置嵌入模型
-        LlamaSettings.embed_model = OpenAIEmbedding(
-            api_key=config.OPENAI_API_KEY,
-            api_base=config.OPENAI_BASE_URL,
-            model_name=config.EMBEDDING_MODEL,
-            embed_batch_size=32
-        )
+        # 配置嵌入模型（EMBEDDING_BACKEND 选择远端 / 本地 / 测试桩）
+        LlamaSettings.embed_model = create_embed_model()
         # 配置 LLM（使用 OpenAILike 支持自定义模型）
         LlamaSettings.llm = OpenAILike(
             api_key=config.OPENAI_API_KEY,
@@ -98,22 +187,32 @@ class RAGEngine:
             is_chat_model=True
         )
 
-    def _load_index(self):
-        """加载向量索引"""
+    def _load_index(self, storage_context: Optional[StorageContext] = None):
+        """加载向量索引（默认基于当前的 storage_context）"""
         stats = get_collection_stats(config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME)
         if stats.get("total_documents", 0) > 0:
             logging.info("从现有存储加载索引...")
-            return get_vector_store_index(self.storage_context, embed_model=LlamaSettings.embed_model)
+            return get_vector_store_index(storage_context or self.storage_context, embed_model=LlamaSettings.embed_model)
         logging.info("未找到现有索引。")
         return None
 
-    def build_knowledge_base(self, force_rebuild: bool = False, source_directories: Optional[List[str]] = None):
+    def build_knowledge_base(
+        self,
+        force_rebuild: bool = False,
+        source_directories: Optional[List[str]] = None,
+        resume: bool = True,
+    ):
         """
-        构建知识库，支持增量更新。
+        构建知识库，支持增量更新与断点续建。
+
+        构建过程写入进度日志（db/build_journal_<集合名>.json），中断后再次运行会先清理写到一半的
+        文档，再从断点继续。强制重建在影子集合中进行，全部完成后才替换正式集合，
+        服务端不会看到空的或只构建了一半的索引。
         
         Args:
-            force_rebuild: 如果为 True，清空集合并重新嵌入所有文档
+            force_rebuild: 如果为 True，在影子集合中全量重建，完成后替换正式集合
             source_directories: 要处理的源目录列表（纯路径字符串），覆盖 config 中的默认配置
+            resume: 存在未完成的强制重建时是否继续（默认 True）；为 False 时丢弃断点重新开始
             
         Returns:
             包含处理结果的字典
@@ -126,95 +225,304 @@ class RAGEngine:
                 (entry if isinstance(entry, tuple) else (entry, None))
                 for entry in config.KNOWLEDGE_SOURCE_DIRS
             ]
+        collection_name = config.CHROMA_COLLECTION_NAME
+        # 每次强制重建写入新的影子集合，完成后集合指针指向它（旧集合保留到各服务进程重新加载之后）
+        shadow_name = f"{collection_name}__{_new_index_version()}"
         
-        # force_rebuild 模式：先清空整个集合，确保无残留数据
-        if force_rebuild:
-            logging.info("强制重建模式：清空现有集合...")
-            try:
-                clear_collection(config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME)
-                logging.info("集合已清空")
-            except Exception:
-                logging.info("集合不存在，跳过清空步骤")
-            # 重新创建 storage_context 和 index（旧引用已失效）
-            self.storage_context = get_storage_context(
-                config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME
-            )
-            self.index = None
-        
-        # 加载所有文档
-        all_documents = []
-        for directory, filename_prefix in source_entries:
+        # 检查目录；文档在处理循环中逐个加载，不一次性持有整个语料
+        scanned_directories = []
+        for directory, _ in source_entries:
             if not os.path.isdir(directory):
                 logging.warning(f"目录不存在，跳过: {directory}")
                 continue
-            logging.info(f"加载目录: {directory}" + (f" (前缀过滤: {filename_prefix}*)" if filename_prefix else ""))
-            docs = self.parser.load_documents(directory)
-            if filename_prefix:
-                before = len(docs)
-                docs = [d for d in docs if os.path.basename(d.metadata.get('file_name', '')).startswith(filename_prefix)]
-                logging.info(f"  前缀过滤: {before} → {len(docs)} 个文档")
-            all_documents.extend(docs)
+            scanned_directories.append(directory)
         
-        if not all_documents:
+        if not any(True for directory in scanned_directories for _ in iter_markdown_files(directory)):
             logging.error("在指定目录中未找到可处理的文档。")
             return {"status": "error", "message": "未找到文档。"}
         
-        logging.info(f"共加载 {len(all_documents)} 个文档")
+        # 清理上次中断的构建写到一半的文档；未完成的强制重建默认继续
+        journal_path = os.path.join(config.KNOWLEDGE_BASE_PATH, f"build_journal_{collection_name}.json")
+        previous = self._recover_interrupted_build(journal_path)
+        if previous is not None and previous.mode == "force" and resume:
+            force_rebuild = True
+            journal = previous
+            logging.info(f"检测到未完成的强制重建，从断点继续：已完成 {len(journal.completed)} 个文档")
+        else:
+            if previous is not None and previous.mode == "force":
+                logging.info(f"丢弃未完成的强制重建（影子集合 {previous.target}）")
+                try:
+                    clear_collection(config.KNOWLEDGE_BASE_PATH, previous.target)
+                except Exception:
+                    pass
+            if force_rebuild:
+                # 强制重建：在全新的影子集合中构建，正式集合在完成前保持不变
+                logging.info(f"强制重建模式：在影子集合 {shadow_name} 中重建...")
+                journal = BuildJournal.start(journal_path, collection_name, shadow_name, "force")
+            else:
+                journal = BuildJournal.start(journal_path, collection_name, collection_name, "incremental")
+        target = journal.target
         
         # 确保索引已初始化
         self._ensure_index_initialized()
+
+        # 一次性获取目标集合清单，新增/更新/跳过/删除全部在内存中判定
+        manifest = get_collection_manifest(config.KNOWLEDGE_BASE_PATH, target)
+        logging.info(f"知识库清单（{target}）: {len(manifest)} 个已嵌入文档")
         
         # 统计信息
         processed_count = 0
         skipped_count = 0
         updated_count = 0
         error_count = 0
+        embedded_nodes = 0
+        reused_nodes = 0
         
-        # 逐个文档处理（复用通用方法）
-        for doc in all_documents:
-            try:
-                result = self._process_document_embedding(doc, force=force_rebuild)
-                
+        # 逐个文档判定与解析，节点跨文档凑满批次后并发嵌入、批量写入；
+        # 每轮写入前保存进度日志，写入后收尾已完成的文档
+        pending: Dict[str, Dict[str, Any]] = {}
+        results: List[Dict[str, Any]] = []
+
+        def checkpoint():
+            outstanding = pipeline.outstanding_keys()
+            for doc_id in [d for d in pending if d not in outstanding or d in pipeline.failed]:
+                result = self._finalize_document_embedding(pending.pop(doc_id), pipeline, collection_name=target)
                 if result["status"] == "success":
-                    processed_count += 1
-                    if result.get("updated"):
-                        updated_count += 1
-                elif result["status"] == "skipped":
-                    skipped_count += 1
+                    journal.mark_completed(doc_id)
                 else:
-                    error_count += 1
-                    
+                    journal.mark_abandoned(doc_id)
+                results.append(result)
+            journal.record_round(pipeline.stats()["written_nodes"])
+            journal.save()
+
+        pipeline = self._create_embedding_pipeline(
+            collection_name=target,
+            before_write=journal.save,
+            after_write=checkpoint,
+        )
+        loaded_doc_ids = set()
+
+        def documents_to_parse():
+            # 只有需要（重新）嵌入的文档才交给解析器，跳过的文档不分块
+            for doc in self._iter_source_documents(source_entries):
+                loaded_doc_ids.add(doc.doc_id)
+                stored = manifest.get(doc.doc_id)
+                if force_rebuild and stored is not None and doc.doc_id in journal.completed:
+                    results.append({
+                        "status": "skipped",
+                        "doc_id": doc.doc_id,
+                        "doc_title": doc.metadata.get('title', doc.doc_id),
+                        "reason": "本次重建已完成（断点续建）",
+                        "updated": False
+                    })
+                    continue
+                should_process, reason = self._decide_embedding(doc, stored, force_rebuild)
+                if not should_process:
+                    logging.info(f"跳过文档: {doc.metadata.get('title', doc.doc_id)} ({doc.doc_id}) - {reason}")
+                    results.append({
+                        "status": "skipped",
+                        "doc_id": doc.doc_id,
+                        "doc_title": doc.metadata.get('title', doc.doc_id),
+                        "reason": reason,
+                        "updated": False
+                    })
+                    continue
+                yield doc
+
+        # 解析分块可在进程池中并行（PARSE_WORKERS），结果按文档顺序产出
+        parsed = self.parser.iter_parsed_documents(documents_to_parse(), workers=config.PARSE_WORKERS)
+        for doc, nodes, parse_error in parsed:
+            if parse_error is not None:
+                error_count += 1
+                continue
+            try:
+                result = self._prepare_document_embedding(
+                    doc,
+                    force=force_rebuild,
+                    stored=manifest.get(doc.doc_id),
+                    collection_name=target,
+                    nodes=nodes,
+                )
+                if result["status"] != "pending":
+                    results.append(result)
+                    continue
+                nodes = result.pop("nodes")
+                journal.mark_in_flight(doc.doc_id, [node.node_id for node in nodes])
+                pending[doc.doc_id] = result
+                pipeline.submit(doc.doc_id, nodes)
             except Exception as e:
                 logging.error(f"❌ 处理文档失败: {e}", exc_info=True)
                 error_count += 1
-                continue
+        pipeline.flush()
+        checkpoint()
+        if not loaded_doc_ids:
+            # 目录中的文件全部被前缀过滤：不清理、不替换集合
+            if journal.mode == "incremental":
+                journal.finish()
+            logging.error("在指定目录中未找到可处理的文档。")
+            return {"status": "error", "message": "未找到文档。"}
+        logging.info(f"共加载 {len(loaded_doc_ids)} 个文档")
+        logging.info(f"嵌入流水线: {pipeline.stats()}")
+        
+        for result in results:
+            if result["status"] == "success":
+                processed_count += 1
+                if result.get("updated"):
+                    updated_count += 1
+                embedded_nodes += result.get("embedded", 0)
+                reused_nodes += result.get("reused", 0)
+            elif result["status"] == "skipped":
+                skipped_count += 1
+            else:
+                error_count += 1
+        
+        # 清理源文件已删除的文档
+        deleted_count = self._purge_deleted_documents(
+            manifest,
+            loaded_doc_ids,
+            scanned_directories,
+            collection_name=target,
+        )
+        
+        # 强制重建：全部文档写入成功后替换正式集合；有嵌入失败时保留影子集合与断点，正式集合不变
+        status = "success"
+        index_version = get_index_version(config.KNOWLEDGE_BASE_PATH, collection_name)
+        if journal.mode == "force":
+            if pipeline.failed:
+                status = "incomplete"
+                logging.warning(f"强制重建未完成：{len(pipeline.failed)} 个文档嵌入失败，正式集合保持不变；重新运行 init 将从断点继续")
+            else:
+                index_version = _new_index_version()
+                swap_in_collection(config.KNOWLEDGE_BASE_PATH, collection_name, target, index_version,
+                                   grace=_retired_collection_grace())
+                self._index_version = index_version
+                self.storage_context = get_storage_context(config.KNOWLEDGE_BASE_PATH, collection_name)
+                self.index = self._load_index()
+                journal.finish()
+                logging.info(f"影子集合已替换正式集合 {collection_name}（索引版本 {index_version}）")
+        else:
+            if processed_count or deleted_count:
+                index_version = _new_index_version()
+                set_index_version(config.KNOWLEDGE_BASE_PATH, collection_name, index_version)
+                self._index_version = index_version
+            journal.finish()
+            # 删除早先被替换下来、各服务进程都已不再使用的旧集合
+            drop_retired_collections(config.KNOWLEDGE_BASE_PATH, collection_name, _retired_collection_grace())
+        if status == "success":
+            self._refresh_lexical_index()
         
         # 返回统计信息
-        stats = get_collection_stats(config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME)
+        stats = get_collection_stats(config.KNOWLEDGE_BASE_PATH, collection_name)
         
         result = {
-            "status": "success",
+            "status": status,
             "stats": stats,
+            "index_version": index_version,
             "summary": {
-                "total_documents": len(all_documents),
+                "total_documents": len(loaded_doc_ids),
                 "processed": processed_count,
                 "skipped": skipped_count,
                 "updated": updated_count,
-                "errors": error_count
+                "deleted": deleted_count,
+                "errors": error_count,
+                "embedded_nodes": embedded_nodes,
+                "reused_nodes": reused_nodes,
+                "cache_hits": pipeline.cache_hits
             }
         }
         
         logging.info(f"\n{'='*60}")
-        logging.info(f"知识库构建完成！")
-        logging.info(f"  总文档数: {len(all_documents)}")
+        logging.info(f"知识库构建{'完成' if status == 'success' else '未完成'}！")
+        logging.info(f"  总文档数: {len(loaded_doc_ids)}")
         logging.info(f"  已处理: {processed_count} ({updated_count} 个更新)")
         logging.info(f"  已跳过: {skipped_count}")
+        logging.info(f"  已删除: {deleted_count}")
+        logging.info(f"  节点: 嵌入 {embedded_nodes}（缓存命中 {pipeline.cache_hits}），复用向量 {reused_nodes}")
         logging.info(f"  失败: {error_count}")
         logging.info(f"  知识库总节点数: {stats.get('total_documents', 0)}")
         logging.info(f"{'='*60}\n")
         
         return result
+
+    def _iter_source_documents(self, source_entries: List[tuple]) -> Iterator[Document]:
+        """按知识源配置逐个产出文档，应用文件名前缀过滤。"""
+        for directory, filename_prefix in source_entries:
+            if not os.path.isdir(directory):
+                continue
+            logging.info(f"加载目录: {directory}" + (f" (前缀过滤: {filename_prefix}*)" if filename_prefix else ""))
+            for doc in self.parser.iter_documents(directory):
+                if filename_prefix and not os.path.basename(doc.metadata.get('file_name', '')).startswith(filename_prefix):
+                    continue
+                yield doc
+
+    @staticmethod
+    def _recover_interrupted_build(journal_path: str) -> Optional[BuildJournal]:
+        """
+        读取上次构建的进度日志，删除其已提交但未确认完成的新节点。
+
+        增量构建中这些文档的旧节点仍在，下次构建会重新处理；强制重建中它们在影子集合里被视为未完成。
+
+        Returns:
+            上次构建的进度日志；不存在时返回 None
+        """
+        journal = BuildJournal.load(journal_path)
+        if journal is None:
+            return None
+        node_ids = journal.in_flight_node_ids()
+        if node_ids and collection_exists(config.KNOWLEDGE_BASE_PATH, journal.target):
+            removed = delete_nodes_by_ids(config.KNOWLEDGE_BASE_PATH, journal.target, node_ids)
+            logging.info(f"上次构建中断，清理 {len(journal.state['in_flight'])} 个未完成文档的 {removed} 个节点")
+        journal.clear_in_flight()
+        journal.save()
+        return journal
     
+    def _reload_index_if_swapped(self) -> None:
+        """
+        其他进程完成强制重建并交换集合后，重新加载正式集合（按 INDEX_RELOAD_INTERVAL 节流）。
+        集合内容变化后，已加载的 BM25 词法索引同时失效。
+
+        交换只替换集合指针，旧集合保留到重新加载间隔过后，重新加载前旧句柄仍可正常查询。
+        """
+        if config.INDEX_RELOAD_INTERVAL <= 0:
+            return
+        if time.monotonic() - self._index_checked_at < config.INDEX_RELOAD_INTERVAL:
+            return
+        with self._reload_lock:
+            # 等锁期间其他线程可能已完成检查
+            now = time.monotonic()
+            if now - self._index_checked_at < config.INDEX_RELOAD_INTERVAL:
+                return
+            # 先更新检查时间：重新加载期间其他检索走快速路径，继续使用旧索引而不是等锁
+            self._index_checked_at = now
+            self._index_version = get_index_version(config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME)
+            current_id = get_collection_id(config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME)
+            loaded_id = str(self.storage_context.vector_store.client.id)
+            if current_id is not None and current_id != loaded_id:
+                logging.info(f"检测到集合 {config.CHROMA_COLLECTION_NAME} 已被替换，重新加载索引")
+                invalidate_collection(config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME)
+                # 新索引加载完成后再替换，并发检索读到的要么是旧索引、要么是新索引
+                storage_context = get_storage_context(config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME)
+                index = self._load_index(storage_context)
+                self.storage_context, self.index = storage_context, index
+            # 增量构建不替换集合，但会改变索引版本号与节点数
+            self.lexical_index.invalidate_if_stale()
+
+    def get_index_version(self) -> Optional[str]:
+        """
+        正式集合当前的索引版本号（其他进程的构建按 INDEX_RELOAD_INTERVAL 节流感知，本进程内的构建立即生效）。
+        可作为依赖知识库内容的缓存（如 backend 的回答缓存）的失效键。
+        """
+        self._reload_index_if_swapped()
+        return self._index_version
+
+    def _refresh_lexical_index(self) -> None:
+        """集合内容变化后重建 BM25 词法索引（失败不影响构建结果，检索时会再次尝试）。"""
+        try:
+            if self.lexical_index.refresh():
+                logging.info("BM25 词法索引已更新")
+        except Exception as e:
+            logging.warning(f"重建词法索引失败: {e}")
+
     def _ensure_index_initialized(self):
         """确保索引已初始化"""
         if not self.index:
@@ -224,73 +532,145 @@ class RAGEngine:
                 embed_model=LlamaSettings.embed_model
             )
     
-    def _insert_nodes(self, nodes: List):
-        """插入节点到索引"""
-        self._ensure_index_initialized()
-        self.index.insert_nodes(nodes)
-    
-    def _process_document_embedding(self, document: Document, force: bool = False) -> Dict[str, Any]:
+    def _purge_deleted_documents(
+        self,
+        manifest: Dict[str, Dict[str, Any]],
+        loaded_doc_ids: set,
+        directories: List[str],
+        collection_name: Optional[str] = None,
+    ) -> int:
+        """
+        删除源文件已不存在的文档。
+
+        只清理 file_path 位于本次扫描目录下的文档，避免 --source-dirs 只处理部分目录时误删其他来源。
+
+        Returns:
+            删除的文档数量
+        """
+        collection_name = collection_name or config.CHROMA_COLLECTION_NAME
+        roots = [os.path.join(os.path.abspath(d), "") for d in directories]
+        deleted = 0
+        for doc_id, entry in manifest.items():
+            if doc_id in loaded_doc_ids:
+                continue
+            file_path = entry.get("file_path")
+            if not file_path or not any(os.path.abspath(file_path).startswith(root) for root in roots):
+                continue
+            try:
+                removed = delete_nodes_by_ids(config.KNOWLEDGE_BASE_PATH, collection_name, entry["node_ids"])
+                logging.info(f"源文件已删除，清理文档: {doc_id} ({file_path}) - {removed} 个节点")
+                deleted += 1
+            except Exception as e:
+                logging.error(f"❌ 清理文档失败: {doc_id} - {e}")
+        return deleted
+
+    @staticmethod
+    def _decide_embedding(document: Document, stored: Optional[Dict[str, Any]], force: bool) -> tuple:
+        """
+        根据清单条目判定文档是否需要（重新）嵌入。
+
+        Returns:
+            (should_process, reason)
+        """
+        if force:
+            # 命令行指定了 force，强制重新嵌入
+            return True, "命令行指定--force参数"
+        if stored is None:
+            # 文档不存在，需要嵌入
+            return True, "文档不存在于知识库"
+        # 文档已存在，检查元数据中的 force 标签
+        if document.metadata.get('force', False):
+            return True, "文档元数据force=true"
+
+        # 内容哈希变化（旧数据无哈希时跳过此判断）
+        current_hash = document.metadata.get('content_hash')
+        stored_hash = stored.get('content_hash')
+        if current_hash and stored_hash and current_hash != stored_hash:
+            return True, "文档内容已变化"
+
+        # 尝试通过 crawledAt 时间戳判断文档是否有更新
+        current_crawled_at = _parse_crawled_at(document.metadata.get('crawledAt'))
+        if current_crawled_at is None:
+            # 无 crawledAt 信息，退化为跳过
+            return False, "文档已存在且force=false"
+        stored_raw = stored.get('crawledAt')
+        stored_crawled_at = _parse_crawled_at(stored_raw)
+        if stored_crawled_at is None or current_crawled_at > stored_crawled_at:
+            return True, f"文档crawledAt已更新 ({stored_raw} → {document.metadata.get('crawledAt')})"
+        return False, "文档已存在且crawledAt未更新"
+
+    def _process_document_embedding(self, document: Document, force: bool = False, stored: Any = _LOOKUP) -> Dict[str, Any]:
         """
         通用的文档嵌入处理逻辑（支持增量更新）。
         
         Args:
             document: 要处理的文档
             force: 是否强制重新嵌入（忽略文档 frontmatter 的 force 标签）
+            stored: 该文档在集合清单中的条目（None 表示不存在）；未传入时单独查询一次
             
         Returns:
             包含处理结果的字典
         """
-        from .db import check_document_exists, delete_document_by_id
-        
+        pipeline = self._create_embedding_pipeline()
+        result = self._prepare_document_embedding(document, force=force, stored=stored)
+        if result["status"] == "pending":
+            pipeline.submit(result["doc_id"], result.pop("nodes"))
+            pipeline.flush()
+        return self._finalize_document_embedding(result, pipeline)
+
+    def _create_embedding_pipeline(
+        self,
+        collection_name: Optional[str] = None,
+        before_write: Optional[Callable[[], None]] = None,
+        after_write: Optional[Callable[[], None]] = None,
+    ) -> EmbeddingPipeline:
+        """创建写入指定集合（默认正式集合）的批量嵌入流水线。"""
+        self._ensure_index_initialized()
+        if collection_name is None or collection_name == config.CHROMA_COLLECTION_NAME:
+            vector_store = self.storage_context.vector_store
+        else:
+            vector_store = get_storage_context(config.KNOWLEDGE_BASE_PATH, collection_name).vector_store
+        return EmbeddingPipeline(
+            embed_model=LlamaSettings.embed_model,
+            vector_store=vector_store,
+            batch_size=config.EMBED_BATCH_SIZE,
+            concurrency=config.EMBED_CONCURRENCY,
+            cache=self.embedding_cache,
+            before_write=before_write,
+            after_write=after_write,
+        )
+
+    def _prepare_document_embedding(
+        self,
+        document: Document,
+        force: bool = False,
+        stored: Any = _LOOKUP,
+        collection_name: Optional[str] = None,
+        nodes: Optional[List[BaseNode]] = None,
+    ) -> Dict[str, Any]:
+        """
+        判定并解析文档，准备待写入的节点。
+
+        nodes 为已解析好的节点（批量构建时由解析进程池产出）；未传入时在此解析。
+
+        Returns:
+            处理结果字典；status 为 "pending" 时 "nodes" 为待提交到嵌入流水线的节点，
+            写入完成后调用 _finalize_document_embedding 删除旧节点
+        """
+        collection_name = collection_name or config.CHROMA_COLLECTION_NAME
         doc_id = document.doc_id
         doc_title = document.metadata.get('title', doc_id)
-        
-        # 检查文档是否已存在
-        exists = check_document_exists(
-            config.KNOWLEDGE_BASE_PATH,
-            config.CHROMA_COLLECTION_NAME,
-            doc_id
-        )
+
+        if stored is _LOOKUP:
+            stored = get_document_manifest(
+                config.KNOWLEDGE_BASE_PATH,
+                collection_name,
+                doc_id
+            )
+        exists = stored is not None
         
         # 决定是否需要处理
-        should_process = False
-        reason = ""
-        
-        if force:
-            # 命令行指定了 force，强制重新嵌入
-            should_process = True
-            reason = "命令行指定--force参数"
-        elif not exists:
-            # 文档不存在，需要嵌入
-            should_process = True
-            reason = "文档不存在于知识库"
-        else:
-            # 文档已存在，检查元数据中的 force 标签
-            doc_force = document.metadata.get('force', False)
-            if doc_force:
-                should_process = True
-                reason = "文档元数据force=true"
-            else:
-                # 尝试通过 crawledAt 时间戳判断文档是否有更新
-                current_crawled_at = _parse_crawled_at(document.metadata.get('crawledAt'))
-                if current_crawled_at is not None:
-                    from .db import get_document_crawled_at
-                    stored_raw = get_document_crawled_at(
-                        config.KNOWLEDGE_BASE_PATH,
-                        config.CHROMA_COLLECTION_NAME,
-                        doc_id
-                    )
-                    stored_crawled_at = _parse_crawled_at(stored_raw)
-                    if stored_crawled_at is None or current_crawled_at > stored_crawled_at:
-                        should_process = True
-                        reason = f"文档crawledAt已更新 ({stored_raw} → {document.metadata.get('crawledAt')})"
-                    else:
-                        should_process = False
-                        reason = "文档已存在且crawledAt未更新"
-                else:
-                    # 无 crawledAt 信息，退化为跳过
-                    should_process = False
-                    reason = "文档已存在且force=false"
+        should_process, reason = self._decide_embedding(document, stored, force)
         
         if not should_process:
             logging.info(f"跳过文档: {doc_title} ({doc_id}) - {reason}")
@@ -302,18 +682,9 @@ class RAGEngine:
                 "updated": False
             }
         
-        # 如果文档已存在且需要重新嵌入，先删除旧数据
-        if exists:
-            logging.info(f"删除旧数据: {doc_title} ({doc_id})")
-            deleted_count = delete_document_by_id(
-                config.KNOWLEDGE_BASE_PATH,
-                config.CHROMA_COLLECTION_NAME,
-                doc_id
-            )
-            logging.info(f"已删除 {deleted_count} 个节点")
-        
         # 解析文档为节点
-        nodes = self.parser.parse_documents([document])
+        if nodes is None:
+            nodes = self.parser.parse_documents([document])
         
         if not nodes:
             logging.warning(f"文档解析后没有生成节点: {doc_title}")
@@ -325,20 +696,100 @@ class RAGEngine:
                 "updated": False
             }
         
-        # 插入节点到索引（复用通用方法）
-        logging.info(f"嵌入文档: {doc_title} ({doc_id}) - 共 {len(nodes)} 个节点")
-        self._insert_nodes(nodes)
+        # 增量更新时按 chunk_hash 复用未变化块的向量（强制重建不复用）
+        reused_count = 0
+        if exists and not force and not document.metadata.get('force', False):
+            reused_count = self._reuse_chunk_embeddings(nodes, stored, collection_name=collection_name)
+        embedded_count = len(nodes) - reused_count
         
-        logging.info(f"文档嵌入成功: {doc_title} ({doc_id})")
+        # 已带向量的节点提交到流水线后不会再调用嵌入 API
+        logging.info(f"嵌入文档: {doc_title} ({doc_id}) - 共 {len(nodes)} 个节点（嵌入 {embedded_count}，复用 {reused_count}）")
         
         return {
-            "status": "success",
+            "status": "pending",
+            "nodes": nodes,
             "doc_id": doc_id,
             "doc_title": doc_title,
             "nodes_count": len(nodes),
+            "embedded": embedded_count,
+            "reused": reused_count,
             "reason": reason,
-            "updated": exists  # 是否是更新操作
+            "updated": exists,  # 是否是更新操作
+            "stale_node_ids": stored["node_ids"] if exists else [],
+        }
+
+    def _finalize_document_embedding(
+        self,
+        result: Dict[str, Any],
+        pipeline: EmbeddingPipeline,
+        collection_name: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        文档节点全部写入后收尾：成功则删除旧节点，失败则清理已写入的新节点并保留旧数据。
+        """
+        if result["status"] != "pending":
+            return result
+        collection_name = collection_name or config.CHROMA_COLLECTION_NAME
+        doc_id = result["doc_id"]
+        doc_title = result["doc_title"]
+        stale_node_ids = result.pop("stale_node_ids")
+
+        if doc_id in pipeline.failed:
+            written = pipeline.written.get(doc_id, [])
+            if written:
+                delete_nodes_by_ids(config.KNOWLEDGE_BASE_PATH, collection_name, written)
+            logging.error(f"❌ 文档嵌入失败: {doc_title} ({doc_id}) - {pipeline.failed[doc_id]}")
+            return {
+                "status": "error",
+                "doc_id": doc_id,
+                "doc_title": doc_title,
+                "message": pipeline.failed[doc_id],
+                "updated": False
+            }
+
+        # 新节点写入成功后再删除旧数据，避免嵌入失败时文档丢失
+        if stale_node_ids:
+            deleted_count = delete_nodes_by_ids(
+                config.KNOWLEDGE_BASE_PATH,
+                collection_name,
+                stale_node_ids
+            )
+            logging.info(f"已删除 {deleted_count} 个旧节点: {doc_title} ({doc_id})")
+
+        logging.info(f"文档嵌入成功: {doc_title} ({doc_id})")
+        return {**result, "status": "success"}
+
+    def _reuse_chunk_embeddings(self, nodes: List, stored: Dict[str, Any], collection_name: Optional[str] = None) -> int:
+        """
+        为 chunk_hash 未变化的节点填入已存储的向量。
+
+        chunk_hash 只覆盖块正文与分块参数；crawledAt 等元数据变化不会使向量失效。
+
+        Returns:
+            复用向量的节点数量
+        """
+        stored_ids_by_hash = {}
+        for node_id, chunk_hash in stored.get("chunk_hashes", {}).items():
+            stored_ids_by_hash.setdefault(chunk_hash, node_id)
+        matches = {
+            node.node_id: stored_ids_by_hash[node.metadata["chunk_hash"]]
+            for node in nodes
+            if node.metadata.get("chunk_hash") in stored_ids_by_hash
         }
+        if not matches:
+            return 0
+        embeddings = get_embeddings_by_ids(
+            config.KNOWLEDGE_BASE_PATH,
+            collection_name or config.CHROMA_COLLECTION_NAME,
+            list(set(matches.values()))
+        )
+        reused = 0
+        for node in nodes:
+            embedding = embeddings.get(matches.get(node.node_id))
+            if embedding is not None:
+                node.embedding = embedding
+                reused += 1
+        return reused
     
     def embed_single_document(self, file_path: str, force: bool = False) -> Dict[str, Any]:
         """
@@ -359,16 +810,16 @@ class RAGEngine:
             if not file_path.endswith('.md'):
                 raise ValueError(f"只支持.md文件: {file_path}")
             
-            # 使用统一的加载逻辑：加载文件所在目录，然后过滤出目标文档
-            documents = self.parser.load_documents(os.path.dirname(file_path))
-            abs_file_path = os.path.abspath(file_path)
-            document = next((d for d in documents if os.path.abspath(d.metadata.get('file_path')) == abs_file_path), None)
-            
-            if not document:
-                raise ValueError(f"无法加载文档: {file_path}")
+            # 只读取目标文件；file_path 的规范化方式与加载整个目录时一致
+            document = self.parser.load_document(file_path)
             
             # 复用通用的文档嵌入逻辑
-            return self._process_document_embedding(document, force=force)
+            result = self._process_document_embedding(document, force=force)
+            if result.get("status") == "success":
+                self._index_version = _new_index_version()
+                set_index_version(config.KNOWLEDGE_BASE_PATH, config.CHROMA_COLLECTION_NAME, self._index_version)
+                self._refresh_lexical_index()
+            return result
             
         except Exception as e:
             logging.error(f"嵌入文档失败: {e}", exc_info=True)
@@ -401,12 +852,57 @@ class RAGEngine:
             kwargs["filters"] = filters
         return self.index.as_retriever(**kwargs)
 
+    def get_query_embedding(self, question: str, embed_model: Optional[BaseEmbedding] = None) -> List[float]:
+        """
+        获取查询向量（优先读缓存）。
+
+        Args:
+            question: 查询问题
+            embed_model: 可选的嵌入模型，默认使用全局配置
+        """
+        model = embed_model or LlamaSettings.embed_model
+        return self.query_embedding_cache.get_or_compute(
+            model.model_name,
+            question,
+            lambda: model.get_query_embedding(question),
+        )
+
+    async def aget_query_embedding(self, question: str, embed_model: Optional[BaseEmbedding] = None) -> List[float]:
+        """get_query_embedding 的异步版本：缓存未命中时通过嵌入模型的异步接口计算。"""
+        model = embed_model or LlamaSettings.embed_model
+        embedding = self.query_embedding_cache.get(model.model_name, question)
+        if embedding is None:
+            embedding = await model.aget_query_embedding(question)
+            self.query_embedding_cache.put(model.model_name, question, embedding)
+        return embedding
+
+    def get_query_embedding_stats(self) -> Dict[str, Any]:
+        """查询向量缓存的命中统计"""
+        return self.query_embedding_cache.stats()
+
+    def get_retrieval_executor_stats(self) -> Dict[str, Any]:
+        """异步检索线程池的容量与在途 / 排队任务数"""
+        return self.retrieval_executor.stats()
+
+    def _build_query_bundle(
+        self,
+        question: str,
+        embed_model: Optional[BaseEmbedding] = None,
+        query_embedding: Optional[List[float]] = None,
+    ) -> QueryBundle:
+        """构建携带查询向量的 QueryBundle，检索器不会再次调用嵌入模型"""
+        if query_embedding is None:
+            query_embedding = self.get_query_embedding(question, embed_model)
+        return QueryBundle(query_str=question, embedding=query_embedding)
+
     def retrieve_nodes(
         self,
         question: str,
         filters: Optional[MetadataFilters] = None,
         top_k: Optional[int] = None,
         similarity_cutoff: Optional[float] = None,
+        query_embedding: Optional[List[float]] = None,
+        hybrid: bool = False,
     ) -> List:
         """
         检索并返回原始 NodeWithScore 列表。
@@ -418,10 +914,81 @@ class RAGEngine:
             filters: 可选的元数据过滤条件
             top_k: 可选的返回结果数
             similarity_cutoff: 可选的相似度阈值
+            query_embedding: 可选的预先计算的查询向量（多次过滤检索复用同一向量）
+            hybrid: 是否融合 BM25 词法检索结果（见 _retrieve_hybrid）
         """
+        self._reload_index_if_swapped()
         if not self.index:
             return []
-        return self._create_retriever(filters=filters, top_k=top_k, similarity_cutoff=similarity_cutoff).retrieve(question)
+        query_bundle = self._build_query_bundle(question, query_embedding=query_embedding)
+        if hybrid:
+            return self._retrieve_hybrid(query_bundle, filters, top_k, similarity_cutoff)
+        return self._create_retriever(filters=filters, top_k=top_k, similarity_cutoff=similarity_cutoff).retrieve(query_bundle)
+
+    async def aretrieve_nodes(
+        self,
+        question: str,
+        filters: Optional[MetadataFilters] = None,
+        top_k: Optional[int] = None,
+        similarity_cutoff: Optional[float] = None,
+        query_embedding: Optional[List[float]] = None,
+        hybrid: bool = False,
+    ) -> List:
+        """
+        retrieve_nodes 的异步版本，参数相同。
+
+        查询向量通过 aget_query_embedding 异步获取；Chroma 查询（及混合检索的 BM25 检索、按 ID 读取节点）
+        在 retrieval_executor 的专用线程中执行。
+        """
+        if not self.index:
+            return []
+        if query_embedding is None:
+            query_embedding = await self.aget_query_embedding(question)
+        return await self.retrieval_executor.run(
+            self.retrieve_nodes, question, filters, top_k, similarity_cutoff, query_embedding, hybrid,
+        )
+
+    def _retrieve_hybrid(
+        self,
+        query_bundle: QueryBundle,
+        filters: Optional[MetadataFilters],
+        top_k: Optional[int],
+        similarity_cutoff: Optional[float],
+    ) -> List[NodeWithScore]:
+        """
+        向量检索与 BM25 检索各取 HYBRID_CANDIDATES 条候选，按倒数排名融合后取前 top_k 条。
+
+        元数据过滤条件同时作用于两路检索；只被词法命中的节点（如原样粘贴的节点名、报错文本）从向量库按 ID 读取。
+        返回节点的 score 为归一化的融合分数：两路都排第一时为 1.0。
+        词法索引不可用或过滤条件无法在其上执行时退化为纯向量检索。
+        """
+        top_k = top_k if top_k is not None else config.TOP_K
+        candidates = max(top_k, config.HYBRID_CANDIDATES)
+        vector_nodes = self._create_retriever(filters=filters, top_k=candidates, similarity_cutoff=similarity_cutoff).retrieve(query_bundle)
+        try:
+            lexical_hits = self.lexical_index.search(query_bundle.query_str, candidates, filters)
+        except Exception as e:
+            logging.warning(f"词法检索失败，使用纯向量检索: {e}")
+            lexical_hits = None
+        if lexical_hits is None:
+            return vector_nodes[:top_k]
+
+        rrf_k = config.HYBRID_RRF_K
+        fused = reciprocal_rank_fusion(
+            [[n.node_id for n in vector_nodes], [node_id for node_id, _ in lexical_hits]],
+            k=rrf_k,
+        )[:top_k]
+        by_id = {n.node_id: n.node for n in vector_nodes}
+        missing = [node_id for node_id, _ in fused if node_id not in by_id]
+        if missing:
+            for node in self.storage_context.vector_store.get_nodes(node_ids=missing):
+                by_id[node.node_id] = node
+        max_score = 2.0 / (rrf_k + 1)
+        return [
+            NodeWithScore(node=by_id[node_id], score=score / max_score)
+            for node_id, score in fused
+            if node_id in by_id
+        ]
 
     def retrieve(
         self,
@@ -444,7 +1011,8 @@ class RAGEngine:
             return self._format_error_response(question, "索引未初始化。请先构建知识库。")
 
         logging.info(f"开始检索: {question}")
-        nodes = self._create_retriever(embed_model, filters).retrieve(question)
+        query_bundle = self._build_query_bundle(question, embed_model)
+        nodes = self._create_retriever(embed_model, filters).retrieve(query_bundle)
         logging.info(f"检索完成，找到 {len(nodes)} 个相关文档")
 
         return self._format_response(question, "仅检索", nodes)
@@ -468,45 +1036,38 @@ class RAGEngine:
         """
         from llama_index.core.response_synthesizers import get_response_synthesizer
 
-        # 使用提供的 LLM 或默认 LLM
-        target_llm = llm if llm is not None else LlamaSettings.llm
+        # 每次调用使用独立的 token 计数器，不修改全局 LlamaSettings.callback_manager。
+        # 合成器会把 callback manager 写到传入的 LLM 上，因此传入 LLM 的浅拷贝（共享底层 HTTP 客户端），
+        # 共享的 LLM 实例不被修改，并发调用互不影响
+        token_counter = TokenCountingHandler(tokenizer=self.tokenizer, verbose=False)
+        target_llm = (llm if llm is not None else LlamaSettings.llm).model_copy()
 
-        # 重置 token 计数器
-        self.token_counter.reset_counts()
-        
-        # 临时设置全局 callback manager
-        original_callback_manager = LlamaSettings.callback_manager
-        LlamaSettings.callback_manager = CallbackManager([self.token_counter])
-        
-        try:
-            # 创建响应合成器，使用 simple_summarize 模式避免多轮调用
-            # simple_summarize: 将所有上下文一次性传给 LLM，只调用一次
-            synthesizer = get_response_synthesizer(
-                response_mode="simple_summarize",
-                llm=target_llm
-            )
+        # 创建响应合成器，使用 simple_summarize 模式避免多轮调用
+        # simple_summarize: 将所有上下文一次性传给 LLM，只调用一次
+        synthesizer = get_response_synthesizer(
+            response_mode="simple_summarize",
+            llm=target_llm,
+            callback_manager=CallbackManager([token_counter])
+        )
 
-            # 合成响应
-            response = synthesizer.synthesize(
-                query=question,
-                nodes=context_nodes
-            )
+        # 合成响应
+        response = synthesizer.synthesize(
+            query=question,
+            nodes=context_nodes
+        )
 
-            answer = response.response if hasattr(response, 'response') else str(response)
+        answer = response.response if hasattr(response, 'response') else str(response)
 
-            # 只获取 completion tokens（LLM 输出的 token 数量）
-            completion_tokens = self.token_counter.completion_llm_token_count
-            
-            logging.info(f"LLM 响应生成完成，completion tokens: {completion_tokens}")
+        # 只获取 completion tokens（LLM 输出的 token 数量）
+        completion_tokens = token_counter.completion_llm_token_count
+        
+        logging.info(f"LLM 响应生成完成，completion tokens: {completion_tokens}")
 
-            return {
-                "answer": answer,
-                "tokens": completion_tokens,  # 只返回输出的 tokens
-                "response": response
-            }
-        finally:
-            # 恢复原来的 callback manager
-            LlamaSettings.callback_manager = original_callback_manager
+        return {
+            "answer": answer,
+            "tokens": completion_tokens,  # 只返回输出的 tokens
+            "response": response
+        }
 
     def query(
         self,
@@ -533,7 +1094,8 @@ class RAGEngine:
             return self._format_error_response(question, "索引未初始化。请先构建知识库。")
 
         logging.info(f"开始查询: {question}")
-        nodes = self._create_retriever(embed_model, filters).retrieve(question)
+        query_bundle = self._build_query_bundle(question, embed_model)
+        nodes = self._create_retriever(embed_model, filters).retrieve(query_bundle)
         logging.info(f"检索完成，找到 {len(nodes)} 个相关文档")
 
         # 如果不需要答案，只返回检索结果
@@ -1,33 +1,46 @@
 import os
 import argparse
 import shutil
+import tempfile
+import time
 from dotenv import load_dotenv
 from src.parser import DocumentParser
 from src.api import get_rag_api
 from src.config import config
 
-def run_parse_test(doc_path: str):
-    """测试单个文档的分块功能"""
-    print(f"==============\n▶️  Running Parse Test: {doc_path}\n==============")
-    if not os.path.exists(doc_path):
-        print(f"❌ FAILED: Document not found at '{doc_path}'")
-        return
-
+def run_parse_test(doc_path: str, directory: str = None, workers: int = 1):
+    """测试单个文档的分块功能；指定目录时用 workers 个进程解析整个目录"""
     parser = DocumentParser(
         chunk_size=config.MAX_CHUNK_SIZE,
         chunk_overlap=config.CHUNK_OVERLAP,
         use_h1_only=config.USE_H1_ONLY
     )
-    
-    docs = parser.load_documents(os.path.dirname(doc_path))
-    # 找到我们关心的那一个文档
-    abs_doc_path = os.path.abspath(doc_path)
-    target_doc = next((d for d in docs if os.path.abspath(d.metadata.get("file_path")) == abs_doc_path), None)
 
-    if not target_doc:
-        print(f"❌ FAILED: Could not load the specific document from its directory.")
+    if directory:
+        print(f"==============\n▶️  Running Parse Test: {directory} ({workers} workers)\n==============")
+        if not os.path.isdir(directory):
+            print(f"❌ FAILED: Directory not found at '{directory}'")
+            return
+        start = time.perf_counter()
+        doc_count = node_count = 0
+        for doc, nodes, error in parser.iter_parsed_documents(parser.iter_documents(directory), workers=workers):
+            doc_count += 1
+            if error is not None:
+                print(f"❌ {doc.doc_id}: {error}")
+                continue
+            node_count += len(nodes)
+            print(f"{len(nodes):>4} chunks  {doc.metadata.get('file_name', doc.doc_id)}")
+        elapsed = time.perf_counter() - start
+        print(f"\n✅ {doc_count} documents parsed into {node_count} chunks in {elapsed:.2f}s ({doc_count / elapsed:.1f} docs/s).")
         return
 
+    print(f"==============\n▶️  Running Parse Test: {doc_path}\n==============")
+    if not os.path.exists(doc_path):
+        print(f"❌ FAILED: Document not found at '{doc_path}'")
+        return
+    
+    target_doc = parser.load_document(doc_path)
+
     nodes = parser.parse_documents([target_doc])
 
     print(f"✅ Document parsed into {len(nodes)} chunks.\n")
@@ -147,13 +160,7 @@ def run_embed_test(doc_path: str):
             use_h1_only=config.USE_H1_ONLY
         )
         
-        docs = parser.load_documents(os.path.dirname(doc_path))
-        abs_doc_path = os.path.abspath(doc_path)
-        target_doc = next((d for d in docs if os.path.abspath(d.metadata.get("file_path")) == abs_doc_path), None)
-        
-        if not target_doc:
-            print(f"❌ FAILED: Could not load the specific document.")
-            return
+        target_doc = parser.load_document(doc_path)
         
         print(f"✅ Document loaded successfully.\n")
         print(f"📋 Original Document Metadata (from YAML frontmatter):")
@@ -285,6 +292,141 @@ def run_embed_test(doc_path: str):
         import traceback
         traceback.print_exc()
 
+def _time_per_call(fn, iterations: int) -> float:
+    """返回 fn 的平均单次耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+def run_db_benchmark(iterations: int, node_count: int):
+    """对比 db.py 辅助函数每次新建 PersistentClient 与复用共享句柄的单次调用延迟"""
+    print(f"==============\n▶️  Running DB Benchmark ({node_count} nodes, {iterations} iterations)\n==============")
+    import chromadb
+    from src import db
+
+    tmp_dir = tempfile.mkdtemp(prefix="rag_bench_db_")
+    collection_name = "bench"
+    try:
+        collection = db.get_collection(tmp_dir, collection_name, create=True)
+        dim = 64
+        for offset in range(0, node_count, 1000):
+            ids = [f"node-{i}" for i in range(offset, min(offset + 1000, node_count))]
+            collection.add(
+                ids=ids,
+                embeddings=[[(i % 97) / 97.0] * dim for i in range(offset, offset + len(ids))],
+                metadatas=[{"ref_doc_id": f"doc-{i // 4}", "crawledAt": "2025-01-01T00:00:00Z"} for i in range(offset, offset + len(ids))],
+                documents=["bench"] * len(ids),
+            )
+        doc_id = f"doc-{node_count // 8}"
+
+        # 旧实现：每次调用都新建客户端并重新打开集合
+        def fresh_exists():
+            client = chromadb.PersistentClient(path=tmp_dir)
+            c = client.get_collection(name=collection_name)
+            return len(c.get(where={"ref_doc_id": doc_id}, include=['metadatas'])['ids']) > 0
+
+        def fresh_stats():
+            client = chromadb.PersistentClient(path=tmp_dir)
+            return client.get_or_create_collection(name=collection_name).count()
+
+        cases = [
+            ("check_document_exists", fresh_exists,
+             lambda: db.check_document_exists(tmp_dir, collection_name, doc_id)),
+            ("get_collection_stats", fresh_stats,
+             lambda: db.get_collection_stats(tmp_dir, collection_name)),
+        ]
+        print(f"{'helper':<24}{'fresh client (ms)':>20}{'pooled (ms)':>14}{'speedup':>10}")
+        for name, fresh_fn, pooled_fn in cases:
+            fresh_fn(); pooled_fn()  # 预热
+            fresh_ms = _time_per_call(fresh_fn, iterations)
+            pooled_ms = _time_per_call(pooled_fn, iterations)
+            print(f"{name:<24}{fresh_ms:>20.3f}{pooled_ms:>14.3f}{fresh_ms / pooled_ms:>9.1f}x")
+    finally:
+        db.invalidate_collection(tmp_dir)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def run_parse_benchmark(directories, worker_counts, repeat: int):
+    """对比不同解析进程数下的分块吞吐量（docs/s），并校验各进程数的分块结果与串行一致"""
+    parser = DocumentParser(
+        chunk_size=config.MAX_CHUNK_SIZE,
+        chunk_overlap=config.CHUNK_OVERLAP,
+        use_h1_only=config.USE_H1_ONLY
+    )
+    if directories:
+        entries = [(d, None) for d in directories]
+    else:
+        entries = [(e if isinstance(e, tuple) else (e, None)) for e in config.KNOWLEDGE_SOURCE_DIRS]
+
+    documents = []
+    for directory, prefix in entries:
+        if not os.path.isdir(directory):
+            print(f"⚠️  Skipping missing directory: {directory}")
+            continue
+        documents.extend(
+            doc for doc in parser.iter_documents(directory)
+            if not prefix or os.path.basename(doc.metadata.get('file_name', '')).startswith(prefix)
+        )
+    print(f"==============\n▶️  Running Parse Benchmark ({len(documents)} documents, {os.cpu_count()} CPUs, best of {repeat})\n==============")
+    if not documents:
+        print("❌ FAILED: No documents found.")
+        return
+
+    def chunk_signature(results):
+        return [(doc.doc_id, [(n.get_content(), n.metadata.get("chunk_hash")) for n in nodes or []]) for doc, nodes, _ in results]
+
+    baseline = None
+    baseline_rate = None
+    print(f"{'workers':>8}{'seconds':>10}{'docs/s':>10}{'chunks':>9}{'speedup':>9}  identical")
+    for workers in worker_counts:
+        best = None
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            results = list(parser.iter_parsed_documents(documents, workers=workers))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        signature = chunk_signature(results)
+        if baseline is None:
+            baseline = signature
+        rate = len(documents) / best
+        baseline_rate = baseline_rate or rate
+        chunks = sum(len(nodes or []) for _, nodes, _ in results)
+        print(f"{workers:>8}{best:>10.2f}{rate:>10.1f}{chunks:>9}{rate / baseline_rate:>8.2f}x  {signature == baseline}")
+
+BENCH_QUERIES = [
+    "小地图标识", "节点图 定时器", "自定义变量 同步", "角色 攻击 命中与受击", "货币与商店 背包 道具",
+    "信号通信 事件", "投射运动器 位移", "镜头设置", "阵营设置 敌对", "界面控件 按钮",
+]
+
+
+def run_embed_benchmark(backends, iterations: int):
+    """对比各嵌入后端的查询向量延迟 p50 / p95（不经过查询向量缓存）"""
+    from src.embedding import create_embed_model
+
+    print(f"==============\n▶️  Running Embedding Benchmark ({iterations} queries per backend)\n==============")
+    print(f"{'backend':<10}{'model':<28}{'load (s)':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'max (ms)':>10}")
+    for backend in backends:
+        try:
+            start = time.perf_counter()
+            model = create_embed_model(backend)
+            model.get_query_embedding("预热")  # 模型加载 / 建立连接
+            load_s = time.perf_counter() - start
+            latencies = []
+            for i in range(iterations):
+                # 每次使用不同文本，避免服务端缓存
+                query = f"{BENCH_QUERIES[i % len(BENCH_QUERIES)]} {i}"
+                start = time.perf_counter()
+                model.get_query_embedding(query)
+                latencies.append((time.perf_counter() - start) * 1000)
+        except Exception as e:
+            print(f"{backend:<10}❌ {type(e).__name__}: {str(e)[:100]}")
+            continue
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{backend:<10}{model.model_name[:27]:<28}{load_s:>10.2f}{p50:>10.1f}{p95:>10.1f}{latencies[-1]:>10.1f}")
+
 if __name__ == "__main__":
     load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
     
@@ -296,6 +438,8 @@ if __name__ == "__main__":
     # Parser command
     parse_parser = subparsers.add_parser('parse', help='Test document chunking.')
     parse_parser.add_argument('--doc', type=str, default=default_doc, help='Path to the document to parse.')
+    parse_parser.add_argument('--dir', type=str, default=None, help='Parse every document in this directory instead of a single document.')
+    parse_parser.add_argument('--workers', type=int, default=config.PARSE_WORKERS, help='Parser processes used with --dir.')
 
     # Retrieve command
     retrieve_parser = subparsers.add_parser('retrieve', help='Test keyword retrieval using existing knowledge base.')
@@ -309,13 +453,35 @@ if __name__ == "__main__":
     embed_parser = subparsers.add_parser('embed', help='Test embedding and metadata verification (saves to production DB).')
     embed_parser.add_argument('--doc', type=str, default=default_doc, help='Path to the document to embed.')
 
+    # DB benchmark command
+    bench_db_parser = subparsers.add_parser('bench-db', help='Benchmark per-call latency of db.py helpers (fresh client vs pooled).')
+    bench_db_parser.add_argument('--iterations', type=int, default=200, help='Calls per helper.')
+    bench_db_parser.add_argument('--nodes', type=int, default=5000, help='Synthetic nodes in the temporary collection.')
+
+    # Parse benchmark command
+    bench_parse_parser = subparsers.add_parser('bench-parse', help='Benchmark parsing throughput (docs/sec) at several worker counts.')
+    bench_parse_parser.add_argument('--dirs', nargs='+', default=None, help='Directories to parse (default: all knowledge sources).')
+    bench_parse_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to compare.')
+    bench_parse_parser.add_argument('--repeat', type=int, default=1, help='Runs per worker count; the fastest is reported.')
+
+    # Embedding benchmark command
+    bench_embed_parser = subparsers.add_parser('bench-embed', help='Compare p50/p95 query-embedding latency across embedding backends.')
+    bench_embed_parser.add_argument('--backends', nargs='+', default=['openai', 'local'], help='Backends to compare (openai / local / stub).')
+    bench_embed_parser.add_argument('--iterations', type=int, default=50, help='Queries per backend.')
+
     args = parser.parse_args()
 
     if args.command == 'parse':
-        run_parse_test(args.doc)
+        run_parse_test(args.doc, args.dir, args.workers)
     elif args.command == 'retrieve':
         run_retrieve_test(args.keyword)
     elif args.command == 'query':
         run_query_test(args.question)
     elif args.command == 'embed':
-        run_embed_test(args.doc)
\ No newline at end of file
+        run_embed_test(args.doc)
+    elif args.command == 'bench-db':
+        run_db_benchmark(args.iterations, args.nodes)
+    elif args.command == 'bench-parse':
+        run_parse_benchmark(args.dirs, args.workers, args.repeat)
+    elif args.command == 'bench-embed':
+        run_embed_benchmark(args.backends, args.iterations)
\ No newline at end of file
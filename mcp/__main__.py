@@ -1,4 +1,4 @@
 """Allow running as: python3 -m mcp"""
-from mcp_server import mcp, _parse_transport
+from mcp_server import main
 
-mcp.run(transport=_parse_transport())
+main()
@@ -6,21 +6,46 @@ Miliastra 知识库 MCP Server
 2. list_documents   - 列出文档标题和路径（可选模糊过滤）
 3. get_document     - 按文档标题获取完整文档内容（模糊匹配）
 4. rag_search       - 知识库向量检索（直接查询 ChromaDB）
+
+两种运行模式：
+- 本地模式（默认）：在本进程中导入 backend 的 skill.service
+- 代理模式（--backend-url 或环境变量 MCP_BACKEND_URL）：转发到 FastAPI 后端的 Skill API，
+  与后端共用一份索引、Chroma 客户端与术语库，本进程只保留 HTTP 连接池；
+  get_document 从后端按 NDJSON 逐个标题读取，每读完一个标题上报一次进度，全部读完后一次返回
+  （MCP 工具结果本身不是流式的），连接池在进程退出时关闭
 """
 
 import argparse
+import asyncio
+import json
+import os
 import sys
 from pathlib import Path
-from typing import Literal
+from typing import Any, Literal
+
+from mcp.server.fastmcp import Context, FastMCP
 
-from mcp.server.fastmcp import FastMCP
+from skill_proxy import SkillProxy
 
 TOOLBOX_DIR = Path(__file__).resolve().parent.parent
 BACKEND_DIR = TOOLBOX_DIR / "backend"
-if str(BACKEND_DIR) not in sys.path:
-    sys.path.insert(0, str(BACKEND_DIR))
 
-from skill.service import get_document_json, get_node_info_json, list_documents_json, rag_search_json
+# 代理模式下由 _parse_transport 设置
+_proxy: SkillProxy | None = None
+
+
+def _service():
+    """本地模式导入 skill.service（代理模式不加载）"""
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+    from skill import service
+
+    return service
+
+
+def _dumps(result: Any) -> str:
+    """与 skill.service 的 *_json 函数输出格式一致"""
+    return json.dumps(result, ensure_ascii=False, indent=2)
 
 
 # ── MCP Server ──────────────────────────────────────────────
@@ -39,8 +64,10 @@ mcp = FastMCP(
         "输入一个或多个节点名称，返回每个节点的说明内容和来源文档信息。"
     ),
 )
-def get_node_info(names: list[str]) -> str:
-    return get_node_info_json(names)
+async def get_node_info(names: list[str]) -> str:
+    if _proxy is not None:
+        return _dumps(await _proxy.call("get_node_info", {"names": names}))
+    return await _service().aget_node_info_json(names)
 
 
 @mcp.tool(
@@ -51,8 +78,10 @@ def get_node_info(names: list[str]) -> str:
         "不传关键词（空列表）时返回全部文档列表。用于浏览可用文档或确认文档名称。"
     ),
 )
-def list_documents(keywords: list[str] = []) -> str:
-    return list_documents_json(keywords)
+async def list_documents(keywords: list[str] = []) -> str:
+    if _proxy is not None:
+        return _dumps(await _proxy.call("list_documents", {"keywords": keywords}))
+    return await _service().alist_documents_json(keywords)
 
 
 @mcp.tool(
@@ -62,8 +91,15 @@ def list_documents(keywords: list[str] = []) -> str:
         "同时按同关键词查找节点信息，若命中则一并返回 related_nodes。"
     ),
 )
-def get_document(titles: list[str]) -> str:
-    return get_document_json(titles)
+async def get_document(titles: list[str], ctx: Context) -> str:
+    if _proxy is not None:
+        # 后端出错或响应被截断时 iter_documents 抛出 SkillProxyError，工具调用返回错误而不是不完整的列表
+        results = []
+        async for result in _proxy.iter_documents(titles):
+            results.append(result)
+            await ctx.report_progress(len(results), len(titles), f"已读取「{result['query']}」")
+        return _dumps(results)
+    return await _service().aget_document_json(titles)
 
 
 @mcp.tool(
@@ -74,8 +110,10 @@ def get_document(titles: list[str]) -> str:
         "返回相关文档片段和相似度分数。"
     ),
 )
-def rag_search(queries: list[str], top_k: int = 5) -> str:
-    return rag_search_json(queries, top_k=top_k)
+async def rag_search(queries: list[str], top_k: int = 5) -> str:
+    if _proxy is not None:
+        return _dumps(await _proxy.call("rag_search", {"queries": queries, "top_k": top_k}))
+    return await _service().arag_search_json(queries, top_k=top_k)
 
 
 # ── 入口 ────────────────────────────────────────────────────
@@ -85,11 +123,36 @@ def _parse_transport() -> Literal["stdio", "sse", "streamable-http"]:
                         default="streamable-http")
     parser.add_argument("--port", type=int, default=8818)
     parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--backend-url", default=os.getenv("MCP_BACKEND_URL", ""),
+                        help="代理模式：FastAPI 后端地址（如 http://127.0.0.1:8000），为空时在本进程中加载知识库")
     args = parser.parse_args()
     mcp.settings.host = args.host
     mcp.settings.port = args.port
+    if args.backend_url:
+        global _proxy
+        _proxy = SkillProxy(args.backend_url)
+    else:
+        _service()  # 本地模式启动时即加载，与原先一致
     return args.transport
 
 
+async def _serve(transport: Literal["stdio", "sse", "streamable-http"]) -> None:
+    """在同一事件循环中运行 MCP Server，退出时关闭代理连接池"""
+    try:
+        if transport == "stdio":
+            await mcp.run_stdio_async()
+        elif transport == "sse":
+            await mcp.run_sse_async()
+        else:
+            await mcp.run_streamable_http_async()
+    finally:
+        if _proxy is not None:
+            await _proxy.aclose()
+
+
+def main() -> None:
+    asyncio.run(_serve(_parse_transport()))
+
+
 if __name__ == "__main__":
-    mcp.run(transport=_parse_transport())
+    main()
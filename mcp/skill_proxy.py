@@ -0,0 +1,79 @@
+"""
+Skill API 代理客户端
+
+MCP Server 以代理模式运行时（--backend-url / MCP_BACKEND_URL），工具调用转发到 FastAPI 后端的
+/api/v1/skills/miliastra-knowledge/tools/* 端点，本进程不导入 skill.service，
+不再单独加载 index.json、节点文档、Chroma 客户端与术语库。
+
+    连接:     共享一个 httpx.AsyncClient（keep-alive 连接池，首次调用时在当前事件循环中创建）
+    get_document: 使用端点的 stream=true 模式按 NDJSON 逐个标题读取结果，大文档不必整包缓冲；
+                  错误行或结果行数少于标题数（响应被截断）时抛出 SkillProxyError
+    关闭:     aclose() 由 MCP Server 退出时调用（见 mcp_server._serve）
+"""
+
+import json
+from typing import Any, AsyncIterator
+
+import httpx
+
+SKILL_TOOLS_PATH = "/api/v1/skills/miliastra-knowledge/tools"
+
+
+class SkillProxyError(RuntimeError):
+    """后端返回错误或响应格式不符"""
+
+
+class SkillProxy:
+    def __init__(self, base_url: str, timeout: float = 60.0, max_connections: int = 16):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client: httpx.AsyncClient | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response, tool: str) -> None:
+        if response.is_error:
+            raise SkillProxyError(f"后端调用 {tool} 失败: HTTP {response.status_code} {response.text[:500]}")
+
+    @staticmethod
+    def _unwrap(body: dict[str, Any], tool: str) -> Any:
+        """取通用响应包裹中的 data.result"""
+        if not body.get("success"):
+            raise SkillProxyError(f"后端调用 {tool} 失败: {body.get('error')}")
+        return body["data"]["result"]
+
+    async def call(self, tool: str, payload: dict[str, Any]) -> Any:
+        """调用工具端点，返回通用响应包裹中的 data.result"""
+        response = await self._get_client().post(f"{SKILL_TOOLS_PATH}/{tool}", json=payload)
+        self._raise_for_status(response, tool)
+        return self._unwrap(response.json(), tool)
+
+    async def iter_documents(self, titles: list[str]) -> AsyncIterator[dict[str, Any]]:
+        """逐个标题产出 get_document 的结果"""
+        received = 0
+        async with self._get_client().stream(
+            "POST", f"{SKILL_TOOLS_PATH}/get_document", params={"stream": "true"}, json={"titles": titles},
+        ) as response:
+            if response.is_error:
+                await response.aread()
+                self._raise_for_status(response, "get_document")
+            async for line in response.aiter_lines():
+                if line:
+                    yield self._unwrap(json.loads(line), "get_document")
+                    received += 1
+        if received < len(titles):
+            raise SkillProxyError(f"后端调用 get_document 失败: 响应被截断（{received}/{len(titles)}）")
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None